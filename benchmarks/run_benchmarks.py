@@ -0,0 +1,242 @@
+"""
+Benchmark suite for day counts, schedules, rate conversion and IRR solving.
+
+Every case runs over a synthetic portfolio of each requested size and reports
+throughput (items per second), latency percentiles and peak traced memory.
+Scalar cases time every call; batched cases time whole batches, so their
+latencies are per batch. Scalar paths are capped at --max-scalar items.
+
+Usage::
+    python benchmarks/run_benchmarks.py --sizes 1,1000,100000 --output bench.json
+    python benchmarks/run_benchmarks.py --sizes 1000 --compare bench.json --tolerance 0.25
+"""
+from __future__ import division, print_function
+
+import argparse
+import json
+import os
+import sys
+import tracemalloc
+from datetime import date
+from timeit import default_timer
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'valoracion'))
+
+from date_helper import edate, periodic_date_gen, periodic_date_array, schedule_cache
+from interest_factor import InterestFactor
+from interest_rate import change_rate, rate_plan, RATE_CASES, InputError as RateInputError
+from root_find import (find_root, find_root_halley, parametrize_tir, parametrize_tir_MP,
+                       solve_tir_batch)
+
+CONVENTIONS = [(30, 360, None), (30, 360, 'US'), ('30E', 360, None), ('30E', 360, 'ISDA'), ('act', 'act', 'Fixed'),
+               ('act', 'act', 'ISDA'), ('act', 'act', 'Euro'), ('act', 'act', 'ICMA'), ('act', 360, None)]
+
+
+class Portfolio(object):
+    """Synthetic bullet bonds: flat cashflow arrays plus offsets, and dates for the day counts.
+    """
+    def __init__(self, size, seed=0):
+        rng = np.random.RandomState(seed)
+        self.size = size
+        counts = rng.randint(2, 41, size)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        n_flows = self.offsets[-1]
+        owners = np.repeat(np.arange(size), counts)
+        first = self.offsets[:-1]
+
+        # Coupon every 30 to 180 days, a negative price at day 0 and the principal with the last coupon
+        steps = rng.randint(30, 181, n_flows).astype('float64')
+        steps[first] = 0
+        self.days = np.cumsum(steps) - np.repeat(np.cumsum(steps)[first], counts)
+        coupon_rates = rng.uniform(0, 0.12, size)
+        self.flows = 100 * coupon_rates[owners] * steps / 365
+        self.flows[self.offsets[1:] - 1] += 100
+        self.flows[first] = -rng.uniform(97, 103, size)
+        self.reference_rates = rng.uniform(0, 0.1, size)
+
+        # Period start and end dates for the day counts
+        i_ordinals = date(1990, 1, 1).toordinal() + rng.randint(0, 15000, size)
+        self.i_ordinals = i_ordinals
+        self.f_ordinals = i_ordinals + rng.randint(1, 4000, size)
+        self.months = rng.choice([1, 3, 6, 12], size)
+
+    def instrument(self, k):
+        """Return the lists (cashflows, days_to_flows) of instrument k.
+        """
+        start, end = self.offsets[k], self.offsets[k + 1]
+        return self.flows[start:end].tolist(), self.days[start:end].tolist()
+
+
+def _scalar(func, arguments):
+    """Time every call of `func` over `arguments`, return the latencies."""
+    latencies = np.empty(len(arguments))
+    timer = default_timer
+    for k, args in enumerate(arguments):
+        start = timer()
+        func(*args)
+        latencies[k] = timer() - start
+    return latencies
+
+def _batch(func, repeat):
+    """Time `repeat` calls of `func`, return the latencies."""
+    latencies = np.empty(repeat)
+    for k in range(repeat):
+        start = default_timer()
+        func()
+        latencies[k] = default_timer() - start
+    return latencies
+
+def _peak_memory(func):
+    """Return the peak traced memory (MiB) while running `func`."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+
+def cases(portfolio, max_scalar):
+    """Yield (suite, case, kind, items, runner) for every benchmark over `portfolio`.
+
+    `kind` is 'scalar' (runner is a function and its list of argument tuples) or
+    'batch' (runner is a function of no arguments processing `items` items).
+    """
+    n_scalar = min(portfolio.size, max_scalar)
+    i_dates = [date.fromordinal(int(o)) for o in portfolio.i_ordinals[:n_scalar]]
+    f_dates = [date.fromordinal(int(o)) for o in portfolio.f_ordinals[:n_scalar]]
+
+    # Day counts
+    for convention in CONVENTIONS:
+        factor = InterestFactor(*convention)
+        name = '_'.join(str(c) for c in convention)
+        yield ('daycount', name + '.factor', 'scalar', n_scalar, (factor.factor, list(zip(i_dates, f_dates))))
+        yield ('daycount', name + '.factor_array', 'batch', portfolio.size,
+               lambda factor=factor: factor.factor_array(portfolio.i_ordinals, portfolio.f_ordinals))
+
+    # Dates and schedules
+    months = portfolio.months[:n_scalar].tolist()
+    yield ('dates', 'edate', 'scalar', n_scalar, (edate, list(zip(f_dates, months))))
+    yield ('dates', 'periodic_date_gen', 'scalar', n_scalar, (periodic_date_gen, list(zip(i_dates, f_dates, months))))
+    yield ('dates', 'periodic_date_array', 'scalar', n_scalar,
+           (lambda i, f, m: periodic_date_array(i, f, m, cache=False), list(zip(i_dates, f_dates, months))))
+
+    # Rate conversion, every pair of cases the equivalence chart can reach
+    rates = (portfolio.reference_rates[:n_scalar]).tolist()
+    for i_case in RATE_CASES:
+        for f_case in RATE_CASES:
+            try:
+                plan = rate_plan(i_case, f_case)
+            except RateInputError:
+                continue
+            name = '%s->%s' % (i_case, f_case)
+            yield ('rates', name + '.change_rate', 'scalar', n_scalar,
+                   (change_rate, [(rate, i_case, 12, f_case, 4) for rate in rates]))
+            yield ('rates', name + '.plan_array', 'batch', portfolio.size,
+                   lambda plan=plan: plan(portfolio.reference_rates, 12, 4))
+
+    # IRR and own margin
+    instruments = [portfolio.instrument(k) for k in range(n_scalar)]
+    references = portfolio.reference_rates[:n_scalar].tolist()
+    yield ('irr', 'parametrize_tir+brentq', 'scalar', n_scalar,
+           (lambda flows, days: find_root(parametrize_tir(flows, days), -0.999, 0.999), instruments))
+    yield ('irr', 'parametrize_tir_MP+brentq', 'scalar', n_scalar,
+           (lambda flows, days, rate: find_root(parametrize_tir_MP(flows, days, [rate]), -0.999, 0.999),
+            [instrument + (rate,) for instrument, rate in zip(instruments, references)]))
+    yield ('irr', 'parametrize_tir_MP+halley', 'scalar', n_scalar,
+           (lambda flows, days, rate: find_root_halley(parametrize_tir_MP(flows, days, [rate], derivatives=True)),
+            [instrument + (rate,) for instrument, rate in zip(instruments, references)]))
+    yield ('irr', 'solve_tir_batch', 'batch', portfolio.size,
+           lambda: solve_tir_batch(portfolio.flows, portfolio.days, offsets=portfolio.offsets))
+    yield ('irr', 'solve_tir_batch.MP', 'batch', portfolio.size,
+           lambda: solve_tir_batch(portfolio.flows, portfolio.days, portfolio.reference_rates, offsets=portfolio.offsets))
+
+
+def run(sizes, repeat=5, max_scalar=10000, memory=True, only=None, seed=0):
+    """Run every benchmark for every size and return the list of results (dicts).
+    """
+    results = []
+    for size in sizes:
+        portfolio = Portfolio(size, seed)
+        for suite, case, kind, items, runner in cases(portfolio, max_scalar):
+            if only and suite not in only:
+                continue
+            if kind == 'scalar':
+                func, arguments = runner
+                latencies = _scalar(func, arguments)
+                total = latencies.sum()
+                peak = _peak_memory(lambda: _scalar(func, arguments[:1000])) if memory else None
+            else:
+                runner()  # warm up
+                latencies = _batch(runner, repeat)
+                total = np.median(latencies)
+                peak = _peak_memory(runner) if memory else None
+            p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+            result = {'suite': suite, 'case': case, 'kind': kind, 'size': size, 'items': items,
+                      'throughput': items / total if total > 0 else float('inf'),
+                      'p50_us': 1e6 * p50, 'p90_us': 1e6 * p90, 'p99_us': 1e6 * p99,
+                      'peak_mib': peak}
+            results.append(result)
+            print(_format(result))
+            sys.stdout.flush()
+    schedule_cache.clear()
+    return results
+
+
+def _format(result):
+    peak = '-' if result['peak_mib'] is None else '%.2f' % result['peak_mib']
+    return '{0:<9} {1:<40} {2:<7} {3:>8} {4:>14.1f} {5:>12.2f} {6:>12.2f} {7:>12.2f} {8:>9}'.format(
+        result['suite'], result['case'], result['kind'], result['size'], result['throughput'],
+        result['p50_us'], result['p90_us'], result['p99_us'], peak)
+
+
+def compare(results, baseline, tolerance):
+    """Return the list of (result, baseline throughput) whose throughput dropped more than `tolerance`.
+    """
+    reference = dict(((r['suite'], r['case'], r['size']), r['throughput']) for r in baseline)
+    regressions = []
+    for result in results:
+        key = (result['suite'], result['case'], result['size'])
+        if key in reference and result['throughput'] < (1 - tolerance) * reference[key]:
+            regressions.append((result, reference[key]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='1,1000,100000',
+                        help='comma separated portfolio sizes (number of instruments), up to 1000000')
+    parser.add_argument('--suites', default=None, help='comma separated subset of: daycount,dates,rates,irr')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of each batched case')
+    parser.add_argument('--max-scalar', type=int, default=10000, help='cap on items timed through scalar paths')
+    parser.add_argument('--no-memory', action='store_true', help='skip the peak memory runs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of a previous run to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative throughput drop')
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    only = args.suites.split(',') if args.suites else None
+    print('{0:<9} {1:<40} {2:<7} {3:>8} {4:>14} {5:>12} {6:>12} {7:>12} {8:>9}'.format(
+        'suite', 'case', 'kind', 'size', 'items/s', 'p50 [us]', 'p90 [us]', 'p99 [us]', 'peak MiB'))
+    results = run(sizes, args.repeat, args.max_scalar, not args.no_memory, only, args.seed)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=1)
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(results, json.load(baseline), args.tolerance)
+        for result, reference in regressions:
+            print('REGRESSION %s %s size=%d: %.1f items/s (baseline %.1f)' % (
+                result['suite'], result['case'], result['size'], result['throughput'], reference))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,241 @@
+"""
+Batch valuation of instruments stored in CSV or JSON-lines files.
+
+Instruments are read in chunks, each chunk is solved with `solve_tir_batch` in a process
+pool and results are written in input order as soon as their chunk is done; only a few
+chunks per worker are in memory at any time, so files larger than RAM can be processed.
+
+Input formats:
+- JSON lines, one instrument per line::
+
+    {"id": "TES-2024", "cashflows": [-98.5, 6, 106], "days_to_flows": [0, 180, 365],
+     "reference_rates": [0.05, 0.051, 0.052], "day_count_base": 365}
+
+  `reference_rates` (one per cashflow or a single one) and `day_count_base` are optional.
+- CSV with a header and one row per cashflow, rows of an instrument being consecutive::
+
+    id,cashflow,days_to_flow,reference_rate,day_count_base
+
+  the last two columns are optional.
+
+Without reference rates the IRR is solved, otherwise the own margin over them.
+Results have the columns ``id, spread, status`` with status 'converged', 'maxiter' or 'no_bracket',
+or 'error' for a record that cannot be valued (the reason is logged as a warning to stderr) and does not
+stop the run.
+
+Usage::
+    python valoracion/batch.py instruments.jsonl results.csv --chunk-size 20000 --workers 8
+"""
+from __future__ import division, print_function
+
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby, islice
+
+import numpy as np
+
+from root_find import solve_tir_batch, InputError, NUMPY_TYPE, SOLVER_CONVERGED, SOLVER_MAXITER, SOLVER_NO_BRACKET
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+STATUS_NAMES = {SOLVER_CONVERGED: 'converged', SOLVER_MAXITER: 'maxiter', SOLVER_NO_BRACKET: 'no_bracket'}
+ERROR_STATUS = 'error'
+FORMATS = ('csv', 'jsonl')
+
+def _file_format(path, file_format=None):
+    """Return the format of `path`, from its extension unless given.
+    """
+    if file_format is None:
+        file_format = 'jsonl' if os.path.splitext(path)[1].lower() in ('.jsonl', '.json', '.ndjson') else 'csv'
+    if file_format not in FORMATS:
+        raise InputError(expr = "Error in _file_format(), format must be one of %r" % (FORMATS,))
+    return file_format
+
+def read_jsonl(stream):
+    """Yield instruments as tuples ``(id, cashflows, days_to_flows, reference_rates, day_count_base)``.
+
+    Values are passed on as read, `check_instrument` validates them. A line that is not a JSON
+    object yields an instrument identified by its line number and without cashflows.
+    """
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError('not a JSON object')
+        except ValueError as error:
+            logger.warning('line %d is not a valid instrument: %s', number, error)
+            yield (number, None, None, None, 365)
+            continue
+        yield (record.get('id', number), record.get('cashflows'), record.get('days_to_flows'),
+               record.get('reference_rates'), record.get('day_count_base', 365))
+
+def read_csv(stream):
+    """Yield instruments as tuples ``(id, cashflows, days_to_flows, reference_rates, day_count_base)``.
+
+    Values are passed on as the strings read, `check_instrument` converts and validates them.
+    Reference rates are None when no row of the instrument has one.
+    """
+    rows = csv.DictReader(stream)
+    for identifier, group in groupby(rows, key=lambda row: row.get('id')):
+        group = list(group)
+        rates = [row.get('reference_rate') for row in group]
+        base = group[0].get('day_count_base')
+        yield (identifier,
+               [row.get('cashflow') for row in group],
+               [row.get('days_to_flow') for row in group],
+               rates if any(rates) else None,
+               base if base else 365)
+
+_readers = {'csv': read_csv, 'jsonl': read_jsonl}
+
+
+def check_instrument(instrument):
+    """Return `instrument` with float arrays of cashflows, days and reference rates and a float
+    day count base, raising InputError (naming the instrument) when it cannot be valued.
+    """
+    identifier, cashflows, days_to_flows, reference_rates, day_count_base = instrument
+    if cashflows is None or days_to_flows is None:
+        raise InputError(expr = "Error in check_instrument(), instrument %r: cashflows and days_to_flows are required" % (identifier,))
+    if np.ndim(reference_rates) == 1 and any(rate is None or rate == '' for rate in reference_rates):
+        raise InputError(expr = "Error in check_instrument(), instrument %r: reference rates are missing for some cashflows" % (identifier,))
+    try:
+        flows = np.asarray(cashflows, dtype=NUMPY_TYPE)
+        days = np.asarray(days_to_flows, dtype=NUMPY_TYPE)
+        rates = None if reference_rates is None else np.asarray(reference_rates, dtype=NUMPY_TYPE)
+        base = float(day_count_base)
+    except (TypeError, ValueError) as error:
+        raise InputError(expr = "Error in check_instrument(), instrument %r: %s" % (identifier, error))
+    if flows.ndim != 1 or not len(flows) or flows.shape != days.shape:
+        raise InputError(expr = "Error in check_instrument(), instrument %r: cashflows and days_to_flows must be non-empty and of the same length" % (identifier,))
+    if rates is not None and rates.ndim != 0 and rates.shape != flows.shape:
+        raise InputError(expr = "Error in check_instrument(), instrument %r: reference_rates must have one value per cashflow or a single one" % (identifier,))
+    if not (np.all(np.isfinite(flows)) and np.all(np.isfinite(days)) and (rates is None or np.all(rates > -1))
+            and np.isfinite(base) and base > 0):
+        raise InputError(expr = "Error in check_instrument(), instrument %r: values must be finite, rates above -1 and day_count_base positive" % (identifier,))
+    return identifier, flows, days, rates, base
+
+def value_chunk(instruments, xtol=2e-12, maxiter=100):
+    """Solve a list of instruments, return the list of result rows ``(id, spread, status)``.
+
+    Instruments rejected by `check_instrument` get an ERROR_STATUS row, the others are solved together.
+    """
+    rows = [None] * len(instruments)
+    positions = []
+    valid = []
+    for position, instrument in enumerate(instruments):
+        try:
+            valid.append(check_instrument(instrument))
+            positions.append(position)
+        except InputError as error:
+            logger.warning('%s', error.expr)
+            rows[position] = (instrument[0], None, ERROR_STATUS)
+    if valid:
+        for position, row in zip(positions, _solve_chunk(valid, xtol, maxiter)):
+            rows[position] = row
+    return rows
+
+def _solve_chunk(instruments, xtol, maxiter):
+    identifiers, cashflows, days_to_flows, reference_rates, bases = zip(*instruments)
+    counts = [len(flows) for flows in cashflows]
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype('int64')
+    # Instruments without reference rates are discounted at a zero reference rate, i.e. solved for their IRR
+    rates = [0. if rate is None else rate for rate in reference_rates]
+    flat_rates = np.concatenate([np.broadcast_to(np.asarray(rate, dtype=NUMPY_TYPE), (count,))
+                                 for rate, count in zip(rates, counts)])
+    roots, status = solve_tir_batch(np.concatenate(cashflows), np.concatenate(days_to_flows),
+                                    flat_rates, np.asarray(bases, dtype=NUMPY_TYPE), offsets,
+                                    xtol=xtol, maxiter=maxiter)
+    return [(identifier, None if np.isnan(root) else float(root), STATUS_NAMES[code])
+            for identifier, root, code in zip(identifiers, roots, status)]
+
+def _chunks(instruments, chunk_size):
+    iterator = iter(instruments)
+    chunk = list(islice(iterator, chunk_size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, chunk_size))
+
+def value_stream(instruments, chunk_size=10000, workers=None, xtol=2e-12, maxiter=100):
+    """Yield the result rows of an iterable of instruments, in input order.
+
+    Chunks are solved in a pool of `workers` processes (default the number of CPUs, 1 solves
+    in the calling process) with at most two chunks per worker waiting to be written.
+    """
+    chunks = _chunks(instruments, chunk_size)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        for chunk in chunks:
+            for row in value_chunk(chunk, xtol, maxiter):
+                yield row
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(value_chunk, chunk, xtol, maxiter))
+            if len(pending) >= 2 * workers:
+                for row in pending.popleft().result():
+                    yield row
+        while pending:
+            for row in pending.popleft().result():
+                yield row
+
+def write_results(rows, stream, file_format='csv'):
+    """Write result rows to `stream`, return the number of rows written.
+    """
+    written = 0
+    if file_format == 'csv':
+        writer = csv.writer(stream)
+        writer.writerow(('id', 'spread', 'status'))
+        for identifier, spread, status in rows:
+            writer.writerow((identifier, '' if spread is None else repr(spread), status))
+            written += 1
+    else:
+        for identifier, spread, status in rows:
+            stream.write(json.dumps({'id': identifier, 'spread': spread, 'status': status}) + '\n')
+            written += 1
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Solve the IRR / own margin of every instrument in a file.')
+    parser.add_argument('input', help="CSV or JSON-lines file of instruments, '-' for stdin")
+    parser.add_argument('output', help="file for the results, '-' for stdout")
+    parser.add_argument('--input-format', choices=FORMATS, help='default from the file extension')
+    parser.add_argument('--output-format', choices=FORMATS, help='default from the file extension')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='instruments solved together')
+    parser.add_argument('--workers', type=int, default=None, help='processes, default the number of CPUs')
+    parser.add_argument('--xtol', type=float, default=2e-12, help='absolute tolerance on the spreads')
+    parser.add_argument('--maxiter', type=int, default=100, help='maximum solver iterations')
+    parser.add_argument('--log-level', default='INFO', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+                        help='messages logged to stderr, among them the reason of every error row')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=getattr(logging, args.log_level))
+
+    input_format = _file_format(args.input, args.input_format)
+    output_format = _file_format(args.output, args.output_format)
+    source = sys.stdin if args.input == '-' else open(args.input, newline='')
+    target = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    try:
+        rows = value_stream(_readers[input_format](source), args.chunk_size, args.workers, args.xtol, args.maxiter)
+        written = write_results(rows, target, output_format)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if target is not sys.stdout:
+            target.close()
+    logger.info('%d instruments valued', written)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
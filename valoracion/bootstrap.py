@@ -0,0 +1,233 @@
+"""
+Bootstrapping of discount curves from par instruments (deposits, bonds, swaps).
+
+Every instrument adds the node at its last cashflow; nodes are solved in one sequential pass,
+shortest first, so each one only depends on the nodes before it. The present value of the
+flows fixed by earlier nodes is accumulated as the pass goes, and a node whose instrument has
+no other flow after the previous node is solved in closed form; otherwise a few Newton steps
+on the log-discount factor of the node are taken. Every step works on all the scenarios at
+once, so many curves (one row of flows or prices per scenario) cost one pass over the nodes.
+
+Usage::
+>>> flows = par_flows(par_rates, accrual_factors, offsets)
+>>> curve = bootstrap_curve(flows, days_to_flows, offsets, prices=1.)
+>>> curves = bootstrap_curve(par_flows(shocked_par_rates, accrual_factors, offsets), days_to_flows, offsets, 1.)
+"""
+from __future__ import division
+
+import logging
+from collections import namedtuple
+
+import numpy as np
+
+from discount_curve import DiscountCurve, InputError, NUMPY_TYPE
+from instrumentation import instrumented
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+Bootstrap = namedtuple('Bootstrap', ['tenor_days', 'discount_factors', 'order', 'iterations', 'converged'])
+
+_INTERPOLATIONS = ('log_linear', 'flat_forward', 'linear_zero')
+
+def par_flows(par_rates, accrual_factors, offsets, notional=1.):
+    """Return the flows of par instruments paying ``notional*par_rate*accrual_factor`` in every
+    period and the notional with the last one.
+
+    :par_rates: one rate per instrument, or a (scenarios x instruments) array
+    :accrual_factors: flat accrual factor of every flow (e.g. from `InterestFactor.factor_array`), zero for
+                      entries without coupon
+    :offsets: start of each instrument in the flat arrays, plus the total length
+
+    Returns flows as `bootstrap_discount_factors` takes them: flat, or (scenarios x flows) when
+    `par_rates` is 2-D. The accrual factors are computed once and only the rates change between scenarios.
+    """
+    offsets = np.asarray(offsets, dtype='int64')
+    accrual_factors = np.asarray(accrual_factors, dtype=NUMPY_TYPE)
+    counts = np.diff(offsets)
+    owners = np.repeat(np.arange(len(counts)), counts)
+    par_rates = np.asarray(par_rates, dtype=NUMPY_TYPE)
+    if par_rates.shape[-1:] != counts.shape or par_rates.ndim > 2:
+        raise InputError(expr = "Error in par_flows(), par_rates must have one rate per instrument (and optionally one row per scenario)")
+    flows = notional * par_rates[..., owners] * accrual_factors
+    flows[..., offsets[1:][counts > 0] - 1] += notional
+    return flows
+
+def _node_log_df(y, interpolation, t, w, prev_log_df, prev_zero, tenor, day_count_base):
+    """Return the log-discount factors of flows at days `t` (weights `w` between the previous node
+    and this one) and their derivatives, given the log-discount factors `y` of the node, one per scenario.
+    """
+    if interpolation == 'linear_zero':
+        node_zero = np.expm1(-y * day_count_base / tenor)[:, np.newaxis]
+        zero = (1 - w) * prev_zero[:, np.newaxis] + w * node_zero
+        log_df = -(t / day_count_base) * np.log1p(zero)
+        return log_df, (t / tenor) * w * (1 + node_zero) / (1 + zero)
+    log_df = (1 - w) * prev_log_df[:, np.newaxis] + w * y[:, np.newaxis]
+    return log_df, np.broadcast_to(w, log_df.shape)
+
+def _solve_node(flows, t, w, target, interpolation, prev_log_df, prev_zero, tenor, day_count_base, xtol, maxiter):
+    """Return the log-discount factor of a node, one per scenario, and the Newton iterations taken.
+
+    `flows` (scenarios x flows) are the flows of the node instrument after the previous node,
+    worth `target` together.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Exact when the only flows are at the node, a starting point otherwise
+        y = np.log(target / flows.sum(axis=1))
+    if np.all(t == tenor):
+        return y, 0
+    for iteration in range(1, maxiter + 1):
+        log_df, slope = _node_log_df(y, interpolation, t, w, prev_log_df, prev_zero, tenor, day_count_base)
+        present_values = flows * np.exp(log_df)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = (present_values.sum(axis=1) - target) / (present_values * slope).sum(axis=1)
+        y = y - step
+        if not np.any(np.abs(step) > xtol):
+            return y, iteration
+    logger.warning('node at day %r did not converge in %d iterations', tenor, maxiter)
+    return y, maxiter
+
+@instrumented
+def bootstrap_discount_factors(flows,
+                               days_to_flows,
+                               offsets,
+                               prices=0.,
+                               day_count_base=365,
+                               interpolation='log_linear',
+                               xtol=1e-14,
+                               maxiter=50):
+    """
+    Return the discount factors that price every instrument at its price.
+
+    The curve has one node at the last cashflow of every instrument (maturities must be distinct)
+    and is interpolated as `DiscountCurve` does, so ``DiscountCurve.from_discount_factors`` of the
+    result reprices the instruments. Flows at day 0, such as the negative price entries of
+    `generate_cashflows`, have a discount factor of 1.
+
+    Keyword arguments:
+    - `flows`: flat cashflows of all the instruments, or a (scenarios x cashflows) array with
+      the flows of every scenario (see `par_flows`)
+    - `days_to_flows`: flat days to every cashflow, non-negative, shared by the scenarios
+    - `offsets`: start of each instrument in the flat arrays, plus the total length
+    - `prices`: present value of every instrument's flows: scalar, one per instrument or
+      (scenarios x instruments); 0 when the price is one of the flows, 1 for par instruments of `par_flows`
+    - `day_count_base`: day count base of the curve
+    - `interpolation`: 'log_linear', 'flat_forward' or 'linear_zero', as in `DiscountCurve`
+    - `xtol`: tolerance of the Newton steps on the log-discount factors
+    - `maxiter`: most Newton steps for a node
+
+    Returns a `Bootstrap` tuple:
+    - `tenor_days`: the nodes, ascending
+    - `discount_factors`: discount factor of every node, with one row per scenario for 2-D `flows` or `prices`
+    - `order`: instrument of every node
+    - `iterations`: Newton steps taken for every node (0 when solved in closed form)
+    - `converged`: False for scenarios whose quotes admit no positive discount factors (those are NaN)
+    """
+    if interpolation not in _INTERPOLATIONS:
+        raise InputError(expr = "Error in bootstrap_discount_factors(), interpolation must be one of %r" % (_INTERPOLATIONS,))
+    days = np.asarray(days_to_flows, dtype=NUMPY_TYPE).ravel()
+    offsets = np.asarray(offsets, dtype='int64')
+    flows = np.asarray(flows, dtype=NUMPY_TYPE)
+    counts = np.diff(offsets)
+    n_nodes = len(counts)
+    if flows.shape[-1] != len(days) or flows.ndim > 2 or offsets[0] != 0 or offsets[-1] != len(days) or np.any(counts <= 0):
+        raise InputError(expr = "Error in bootstrap_discount_factors(), offsets must split flows and days_to_flows in non-empty instruments")
+    if np.any(days < 0):
+        raise InputError(expr = "Error in bootstrap_discount_factors(), days_to_flows must be non-negative")
+    prices = np.asarray(prices, dtype=NUMPY_TYPE)
+    single = flows.ndim == 1 and prices.ndim < 2
+    n_scenarios = max(flows.shape[0] if flows.ndim == 2 else 1, prices.shape[0] if prices.ndim == 2 else 1)
+    flows = np.broadcast_to(flows, (n_scenarios, len(days)))
+    prices = np.broadcast_to(prices, (n_scenarios, n_nodes))
+
+    # Node k belongs to the k-th shortest instrument; a flow is fixed once the first node on or after it is solved
+    maturities = np.maximum.reduceat(days, offsets[:-1])
+    order = np.argsort(maturities, kind='stable')
+    tenors = maturities[order]
+    if tenors[0] <= 0 or np.any(np.diff(tenors) <= 0):
+        raise InputError(expr = "Error in bootstrap_discount_factors(), instruments must have distinct positive maturities")
+    node_of = np.empty(n_nodes, dtype='int64')
+    node_of[order] = np.arange(n_nodes)
+    flow_nodes = node_of[np.repeat(np.arange(n_nodes), counts)]
+    segments = np.searchsorted(tenors, days, side='left')
+    by_segment = np.argsort(segments, kind='stable')
+    bounds = np.searchsorted(segments[by_segment], np.arange(n_nodes + 1))
+
+    prices = prices[:, order]
+    fixed_values = np.zeros((n_nodes, n_scenarios))
+    log_dfs = np.empty((n_scenarios, n_nodes))
+    iterations = np.zeros(n_nodes, dtype='int64')
+    prev_log_df = np.zeros(n_scenarios)
+    prev_zero = np.zeros(n_scenarios)
+    prev_tenor = 0.
+    for k in range(n_nodes):
+        members = by_segment[bounds[k]:bounds[k + 1]]
+        t = days[members]
+        if interpolation == 'linear_zero' and k == 0:
+            # Flat zero rate before the first node
+            w = np.ones(len(t))
+        else:
+            w = (t - prev_tenor) / (tenors[k] - prev_tenor)
+        own = flow_nodes[members] == k
+        y, iterations[k] = _solve_node(flows[:, members[own]], t[own], w[own], prices[:, k] - fixed_values[k],
+                                       interpolation, prev_log_df, prev_zero, tenors[k], day_count_base, xtol, maxiter)
+        log_dfs[:, k] = y
+
+        # Flows of longer instruments fixed by this node
+        later = ~own
+        if np.any(later):
+            log_df, _ = _node_log_df(y, interpolation, t[later], w[later], prev_log_df, prev_zero, tenors[k], day_count_base)
+            np.add.at(fixed_values, flow_nodes[members[later]], (flows[:, members[later]] * np.exp(log_df)).T)
+        prev_log_df = y
+        prev_zero = np.expm1(-y * day_count_base / tenors[k])
+        prev_tenor = tenors[k]
+
+    discount_factors = np.exp(log_dfs)
+    converged = np.all(np.isfinite(discount_factors) & (discount_factors > 0), axis=1)
+    if single:
+        return Bootstrap(tenors, discount_factors[0], order, iterations, converged[0])
+    return Bootstrap(tenors, discount_factors, order, iterations, converged)
+
+@instrumented
+def bootstrap_curve(flows,
+                    days_to_flows,
+                    offsets,
+                    prices=0.,
+                    day_count_base=365,
+                    interpolation='log_linear',
+                    xtol=1e-14,
+                    maxiter=50):
+    """
+    Return the `DiscountCurve` bootstrapped from the instruments, or a list with one curve per
+    scenario when `flows` or `prices` have a row per scenario (None for scenarios that did not converge).
+
+    Arguments are those of `bootstrap_discount_factors`.
+    """
+    result = bootstrap_discount_factors(flows, days_to_flows, offsets, prices, day_count_base, interpolation, xtol, maxiter)
+    make_curve = lambda discount_factors: DiscountCurve.from_discount_factors(result.tenor_days, discount_factors,
+                                                                              day_count_base, interpolation)
+    if result.discount_factors.ndim == 1:
+        if not result.converged:
+            raise InputError(expr = "Error in bootstrap_curve(), the prices admit no positive discount factors")
+        return make_curve(result.discount_factors)
+    return [make_curve(row) if converged else None for row, converged in zip(result.discount_factors, result.converged)]
+
+
+if __name__ == '__main__':
+    # Deposits at 30 and 90 days, then par bonds with semiannual coupons (act/360 accruals)
+    days = [[30], [90], [182, 365], [182, 365, 547, 730], [182, 365, 547, 730, 912, 1095]]
+    offsets = np.cumsum([0] + [len(d) for d in days])
+    days = np.concatenate(days).astype(NUMPY_TYPE)
+    period_starts = np.concatenate([[0.], days[:-1]])
+    period_starts[offsets[:-1]] = 0.
+    accruals = (days - period_starts) / 360
+    par_rates = np.array([0.050, 0.052, 0.054, 0.056, 0.058])
+
+    curve = bootstrap_curve(par_flows(par_rates, accruals, offsets), days, offsets, 1.)
+    print(curve)
+    print(curve.discount_factors(curve.tenor_days))
+    print(curve.zero_rates)
+    shocks = np.linspace(-0.01, 0.01, 5)[:, np.newaxis]
+    result = bootstrap_discount_factors(par_flows(par_rates + shocks, accruals, offsets), days, offsets, 1.)
+    print(result.discount_factors)
+    print(result.iterations, result.converged)
@@ -0,0 +1,182 @@
+"""
+Holiday calendars with precomputed business-day tables.
+
+A `BusinessCalendar` covers a range of days and stores, for every day of it, whether it is a
+business day, how many business days come before it and the nearest business days on or after
+and on or before it. Rolling dates and counting business days over whole arrays are then
+table lookups.
+
+Holiday files hold one ISO date (YYYY-MM-DD) per line; anything after the date on the same
+line (e.g. ``2024-01-01,Año Nuevo``), blank lines and lines starting with '#' are ignored.
+
+Usage::
+>>> calendar = BusinessCalendar.from_file('holidays_co.txt')
+>>> calendar.modified_following(schedule_dates)
+>>> InterestFactor('bus', 252, calendar=calendar).factor_array(i_dates, f_dates)
+"""
+from __future__ import division
+
+import io
+import logging
+from datetime import date
+
+import numpy as np
+
+from date_helper import _to_ordinals, _ORDINAL_EPOCH
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+class Error(Exception):
+    """Base class for exceptions in this module."""
+    def __init__(self, expr):
+        Exception.__init__(self, expr)
+        self.expr = expr
+
+class InputError(Error):
+    """Exception raised for errors in parameters."""
+    pass
+
+ROLLS = ('following', 'modified_following', 'preceding', 'modified_preceding', 'none')
+
+class BusinessCalendar(object):
+    """Business days between `first_year` and `last_year` (both included).
+
+    Days are business days unless their weekday (0 is Monday) is in `weekend` or they are holidays.
+    """
+    def __init__(self, holidays=(), weekend=(5, 6), first_year=1950, last_year=2100, name=None):
+        """Constructor.
+
+        :holidays: datetime.date objects, datetime64 values or ordinals
+        :weekend: weekdays that are not business days, 0 is Monday
+        :first_year, last_year: years covered by the tables
+        :name: optional name, e.g. the market of the holidays
+        """
+        self.name = name
+        self.weekend = tuple(weekend)
+        self.first_ordinal = date(first_year, 1, 1).toordinal()
+        self.last_ordinal = date(last_year, 12, 31).toordinal()
+        n_days = self.last_ordinal - self.first_ordinal + 1
+        # Day one (an ordinal of 1) was a Monday
+        weekdays = (np.arange(self.first_ordinal, self.last_ordinal + 1) - 1) % 7
+        business = ~np.isin(weekdays, self.weekend)
+        holidays = _to_ordinals(holidays if len(holidays) else np.empty(0, dtype='int64')) - self.first_ordinal
+        business[holidays[(holidays >= 0) & (holidays < n_days)]] = False
+        self.holidays = np.sort(holidays[(holidays >= 0) & (holidays < n_days)]) + self.first_ordinal
+        self._business = business
+
+        # Business days before each day, with one more entry for the day after the range
+        self._count_before = np.concatenate([[0], np.cumsum(business)])
+        # Nearest business day on or after / on or before each day, n_days / -1 when there is none
+        index = np.arange(n_days)
+        following = np.where(business, index, n_days)
+        self._following = np.minimum.accumulate(following[::-1])[::-1]
+        preceding = np.where(business, index, -1)
+        self._preceding = np.maximum.accumulate(preceding)
+
+    @classmethod
+    def from_file(cls, path, weekend=(5, 6), first_year=1950, last_year=2100, name=None):
+        """Return the calendar of the holidays listed in the file at `path`.
+        """
+        holidays = []
+        with io.open(path, encoding='utf-8') as holiday_file:
+            for number, line in enumerate(holiday_file, 1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                text = line.replace(',', ' ').replace(';', ' ').split()[0]
+                try:
+                    holidays.append(np.datetime64(text, 'D'))
+                except ValueError:
+                    raise InputError(expr = "Error in BusinessCalendar.from_file(), line %d of %r is not a date: %r" % (number, path, line))
+        return cls(np.array(holidays, dtype='datetime64[D]'), weekend, first_year, last_year, name or path)
+
+    def _index(self, dates):
+        """Return the table indexes of `dates` (any type accepted by `_to_ordinals`).
+        """
+        index = _to_ordinals(dates) - self.first_ordinal
+        if np.any(index < 0) or np.any(index > self.last_ordinal - self.first_ordinal):
+            raise InputError(expr = "Error in BusinessCalendar, dates out of the calendar range %s to %s"
+                             % (date.fromordinal(self.first_ordinal), date.fromordinal(self.last_ordinal)))
+        return index
+
+    def _to_dates(self, index):
+        if np.any(index < 0) or np.any(index > self.last_ordinal - self.first_ordinal):
+            raise InputError(expr = "Error in BusinessCalendar, rolled dates out of the calendar range")
+        return (index + (self.first_ordinal - _ORDINAL_EPOCH)).astype('datetime64[D]')
+
+    def is_business_day(self, dates):
+        """Return a boolean array, True for business days.
+        """
+        return self._business[self._index(dates)]
+
+    def following(self, dates):
+        """Roll every date to the first business day on or after it, as datetime64[D].
+        """
+        return self._to_dates(self._following[self._index(dates)])
+
+    def preceding(self, dates):
+        """Roll every date to the last business day on or before it, as datetime64[D].
+        """
+        return self._to_dates(self._preceding[self._index(dates)])
+
+    def modified_following(self, dates):
+        """Roll following, unless that changes the month, then preceding.
+        """
+        index = self._index(dates)
+        return self._modified(index, self._following[index], self._preceding[index])
+
+    def modified_preceding(self, dates):
+        """Roll preceding, unless that changes the month, then following.
+        """
+        index = self._index(dates)
+        return self._modified(index, self._preceding[index], self._following[index])
+
+    def _modified(self, index, rolled, fallback):
+        days = self._to_dates(index)
+        rolled_days = self._to_dates(np.clip(rolled, 0, len(self._business) - 1))
+        same_month = days.astype('datetime64[M]') == rolled_days.astype('datetime64[M]')
+        same_month &= (rolled >= 0) & (rolled < len(self._business))
+        return np.where(same_month, rolled_days, self._to_dates(np.where(same_month, index, fallback)))
+
+    def roll(self, dates, convention='modified_following'):
+        """Roll dates with one of `ROLLS`.
+        """
+        if convention not in ROLLS:
+            raise InputError(expr = "Error in BusinessCalendar.roll(), convention must be one of %r" % (ROLLS,))
+        if convention == 'none':
+            return self._to_dates(self._index(dates))
+        return getattr(self, convention)(dates)
+
+    def business_days_between(self, i_dates, f_dates):
+        """Return the number of business days from each initial date (included) to each final date (excluded).
+
+        Negative when the final date comes first.
+        """
+        return self._count_between(self._index(i_dates), self._index(f_dates))
+
+    def _count_between(self, i_index, f_index):
+        return self._count_before[f_index] - self._count_before[i_index]
+
+    def add_business_days(self, dates, n_days):
+        """Return the dates `n_days` business days after (before, if negative) each date rolled following.
+        """
+        start = self._following[self._index(dates)]
+        target = self._count_before[np.minimum(start, len(self._business) - 1)] + np.asarray(n_days)
+        return self._to_dates(np.searchsorted(self._count_before[1:], target, side='right'))
+
+    def __repr__(self):
+        return "businessCalendar(name=%(name)r, holidays=%(n)r, weekend=%(weekend)r)" % {'name': self.name, 'n': len(self.holidays), 'weekend': self.weekend}
+
+
+if __name__ == '__main__':
+    calendar = BusinessCalendar([date(2024, 1, 1), date(2024, 1, 8), date(2024, 3, 25), date(2024, 3, 28),
+                                 date(2024, 3, 29)], name='CO')
+    days = np.arange('2024-03-23', '2024-04-02', dtype='datetime64[D]')
+    print(calendar)
+    print(calendar.is_business_day(days))
+    print(calendar.following(days))
+    print(calendar.modified_following(days))
+    print(calendar.preceding(days))
+    print(calendar.business_days_between(np.datetime64('2024-01-01'), days))
+    print(calendar.add_business_days(days, 2))
@@ -0,0 +1,208 @@
+"""
+Vectorized generation of fixed and floating rate bond cashflows for whole portfolios.
+
+Schedules come from `periodic_date_arrays`, accrual factors from `InterestFactor.factor_array`
+and rates are brought to annual effective terms with `rate_plan`; every step works on the
+flat arrays of the whole portfolio. The result is laid out as `solve_tir_batch` takes it
+(flat cashflows, days to flows and offsets).
+
+Usage::
+>>> cashflows = generate_cashflows(issue_dates, maturity_dates, 6, date(2024, 3, 1),
+...                                coupon_rates=[0.07, 0.065], prices=[99.1, 101.3])
+>>> solve_tir_batch(cashflows.flows, cashflows.days_to_flows, offsets=cashflows.offsets)
+"""
+from __future__ import division
+
+import logging
+from collections import namedtuple
+
+import numpy as np
+
+from date_helper import periodic_date_arrays, _to_ordinals, _ORDINAL_EPOCH
+from discount_curve import DiscountCurve
+from instrumentation import instrumented
+from interest_factor import InterestFactor
+from interest_rate import rate_plan, InputError
+
+NUMPY_TYPE = 'float64'
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+Cashflows = namedtuple('Cashflows', ['flows', 'days_to_flows', 'offsets', 'payment_dates',
+                                     'period_starts', 'accrual_factors', 'period_rates', 'principal'])
+
+def _per_instrument(values, n_instruments, dtype=NUMPY_TYPE):
+    return np.array(np.broadcast_to(np.asarray(values, dtype=dtype), (n_instruments,)))
+
+def _accrual_factors(convention, n_instruments, owners, period_starts, period_ends, calendar=None,
+                     frequency=None, maturity=None):
+    """Return the accrual factor of every period, `convention` being one tuple for every
+    instrument or a list of tuples (dim, diy, flavor), one per instrument.
+
+    `frequency` (coupons in a year) and `maturity` (ordinals) have one value per period, for
+    the conventions that take them (act/act ICMA, 30E/360 ISDA).
+    """
+    if isinstance(convention, tuple):
+        return InterestFactor(*convention, calendar=calendar).factor_array(period_starts, period_ends,
+                                                                          frequency, maturity)
+    if len(convention) != n_instruments:
+        raise InputError(expr = "Error in _accrual_factors(), convention must be a tuple or one tuple per instrument")
+    factors = np.empty(len(period_starts))
+    codes = dict((key, code) for code, key in enumerate(set(convention)))
+    instrument_codes = np.array([codes[key] for key in convention])[owners]
+    for key, code in codes.items():
+        mask = instrument_codes == code
+        factors[mask] = InterestFactor(*key, calendar=calendar).factor_array(
+            period_starts[mask], period_ends[mask],
+            None if frequency is None else frequency[mask], None if maturity is None else maturity[mask])
+    return factors
+
+@instrumented
+def generate_cashflows(issue_dates,
+                       maturity_dates,
+                       periodicity_in_months,
+                       valuation_date,
+                       coupon_rates=None,
+                       reference_rates=None,
+                       spreads=0.,
+                       term='EMR1',
+                       piy=1,
+                       add_method='combine',
+                       convention=(30, 360, None),
+                       notional=100.,
+                       prices=None,
+                       day_count_base=365,
+                       calendar=None,
+                       roll='modified_following'):
+    """
+    Return the cashflows still due at `valuation_date` of a portfolio of bullet bonds.
+
+    Coupon dates roll every `periodicity_in_months` months backwards from maturity, as
+    `periodic_date_gen` does; a short first period accrues from the issue date. Each coupon pays
+    ``notional*((1 + annual effective rate)**accrual_factor - 1)``, the periodic rate equivalent
+    to the annual effective one, as `change_rate` would give it.
+
+    Keyword arguments:
+    - `issue_dates`, `maturity_dates`: datetime64 values, datetime.date objects or ordinals, one per instrument
+    - `periodicity_in_months`: months between coupons, scalar or one per instrument
+    - `valuation_date`: date the days to flows are counted from, only later payments are kept
+    - `coupon_rates`: rates of fixed rate instruments, stated in `term` with `piy` periods in a year
+    - `reference_rates`: for floating rate instruments (when `coupon_rates` is None), one rate per
+      instrument stated in `term` with `piy` periods, or a `DiscountCurve` whose forward rates
+      over each remaining period (from `valuation_date` at the soonest) are used
+    - `spreads`: margin over the reference rates, scalar or one per instrument
+    - `term`, `piy`: term of the rates (a case of `change_rate`) and periods in a year
+    - `add_method`: 'combine' for ``(1+reference)*(1+spread)-1`` or 'add' to add the spread
+      to the reference rate in its own term, as `InterestRate.add_spread`
+    - `convention`: (dim, diy, flavor) of `InterestFactor`, or a list with one per instrument;
+      act/act ICMA uses ``12/periodicity_in_months`` coupons a year and 30E/360 ISDA the maturity
+    - `notional`: redeemed at maturity, scalar or one per instrument
+    - `prices`: optional dirty prices, added as a negative cashflow at day 0 so the result can
+      go straight into `solve_tir_batch`
+    - `day_count_base`: day count base of the curve forward rates
+    - `calendar`: optional `BusinessCalendar`, schedule dates are then rolled with `roll`
+      (adjusted periods: accruals run between rolled dates); also used by bus/252 conventions
+
+    Returns a `Cashflows` tuple of flat arrays (one entry per cashflow, `offsets` delimiting the
+    instruments): `flows`, `days_to_flows`, `payment_dates` (datetime64[D]), `period_starts`,
+    `accrual_factors`, the annual effective `period_rates` and the `principal` part of each flow.
+    Price entries have the valuation date as payment date and period start, a zero factor and a NaN rate.
+    """
+    issue = _to_ordinals(issue_dates).ravel()
+    maturity = _to_ordinals(maturity_dates).ravel()
+    n_instruments = len(maturity)
+    valuation = _to_ordinals(valuation_date)
+    if issue.shape != maturity.shape:
+        raise InputError(expr = "Error in generate_cashflows(), issue_dates and maturity_dates must have the same length")
+
+    # Periods: every schedule date after the first one closes a period
+    dates, schedule_offsets = periodic_date_arrays(issue, maturity, periodicity_in_months)
+    if calendar is not None:
+        dates = calendar.roll(dates, roll)
+    dates = _to_ordinals(dates)
+    # Coupons in a year and (adjusted) maturity of every instrument, for the conventions using them
+    periodicity = _per_instrument(periodicity_in_months, n_instruments, 'int64')
+    frequency = np.where(12 % periodicity == 0, 12 // periodicity, 0)
+    adjusted_maturity = dates[schedule_offsets[1:] - 1]
+    period_end = np.ones(len(dates), dtype=bool)
+    period_end[schedule_offsets[:-1]] = False
+    owners = np.repeat(np.arange(n_instruments), np.diff(schedule_offsets))
+    period_starts = np.maximum(np.roll(dates, 1), issue[owners])[period_end]
+    period_ends = dates[period_end]
+    owners = owners[period_end]
+
+    # Only payments after the valuation date
+    due = period_ends > valuation
+    period_starts, period_ends, owners = period_starts[due], period_ends[due], owners[due]
+    factors = _accrual_factors(convention, n_instruments, owners, period_starts, period_ends, calendar,
+                               frequency[owners], adjusted_maturity[owners])
+
+    # Annual effective rate of every period
+    to_annual = rate_plan(term, 'EMR2')
+    spreads = _per_instrument(spreads, n_instruments)
+    if coupon_rates is not None:
+        rates = to_annual(_per_instrument(coupon_rates, n_instruments), piy, 1)[owners]
+    elif isinstance(reference_rates, DiscountCurve):
+        start_days = np.maximum(period_starts - valuation, 0)
+        end_days = period_ends - valuation
+        log_growth = reference_rates.log_discount(start_days) - reference_rates.log_discount(end_days)
+        forwards = np.expm1(log_growth * day_count_base / (end_days - start_days))
+        rates = forwards + spreads[owners] if add_method == 'add' else (1 + forwards) * (1 + spreads[owners]) - 1
+    elif reference_rates is not None:
+        reference = _per_instrument(reference_rates, n_instruments)
+        if add_method == 'add':
+            rates = to_annual(reference + spreads, piy, 1)[owners]
+        else:
+            rates = ((1 + to_annual(reference, piy, 1)) * (1 + spreads) - 1)[owners]
+    else:
+        raise InputError(expr = "Error in generate_cashflows(), either coupon_rates or reference_rates are required")
+
+    notional = _per_instrument(notional, n_instruments)
+    flows = notional[owners] * np.expm1(factors * np.log1p(rates))
+    counts = np.bincount(owners, minlength=n_instruments)
+    ends = np.cumsum(counts)
+    principal = np.zeros(len(flows))
+    principal[ends[counts > 0] - 1] = notional[counts > 0]
+    flows += principal
+
+    if prices is not None:
+        # One extra entry at the head of every instrument
+        heads = np.concatenate([[0], ends[:-1]])
+        positions = np.arange(len(owners)) + owners + 1
+        counts = counts + 1
+        size = len(owners) + n_instruments
+        price_positions = heads + np.arange(n_instruments)
+        expand = lambda values, head: _scatter(size, positions, values, price_positions, head)
+        flows = expand(flows, -_per_instrument(prices, n_instruments))
+        period_starts = expand(period_starts, valuation)
+        period_ends = expand(period_ends, valuation)
+        factors = expand(factors, 0.)
+        rates = expand(rates, np.nan)
+        principal = expand(principal, 0.)
+
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    to_dates = lambda ordinals: (ordinals - _ORDINAL_EPOCH).astype('datetime64[D]')
+    return Cashflows(flows, (period_ends - valuation).astype(NUMPY_TYPE), offsets,
+                     to_dates(period_ends), to_dates(period_starts), factors, rates, principal)
+
+def _scatter(size, positions, values, head_positions, head_values):
+    """Return an array of `size` with `values` at `positions` and `head_values` at `head_positions`.
+    """
+    result = np.empty(size, dtype=np.result_type(values, head_values))
+    result[positions] = values
+    result[head_positions] = head_values
+    return result
+
+
+if __name__ == '__main__':
+    from datetime import date
+
+    from root_find import solve_tir_batch
+
+    cashflows = generate_cashflows([date(2020, 7, 24), date(2022, 3, 15)], [date(2030, 7, 24), date(2027, 3, 15)],
+                                   [12, 6], date(2024, 3, 1), coupon_rates=[0.0725, 0.065], prices=[99.1, 101.3],
+                                   convention=[(30, 360, None), ('act', 'act', 'ISDA')])
+    print(cashflows.offsets)
+    print(cashflows.flows)
+    print(cashflows.days_to_flows)
+    print(solve_tir_batch(cashflows.flows, cashflows.days_to_flows, offsets=cashflows.offsets))
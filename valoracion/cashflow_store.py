@@ -0,0 +1,202 @@
+"""
+On-disk columnar store of portfolio cashflows.
+
+A store is a directory holding flat ``.npy`` columns ``flows``, ``days`` and optionally
+``rates`` (one value per cashflow, float64), an ``offsets`` index (int64, one entry per
+instrument plus the total number of cashflows) and optionally ``day_count_base`` (one per
+instrument). Columns are opened memory-mapped, so slices of instruments are views of the
+files and go into `solve_tir_batch` without copies, and valuing a store chunk by chunk only
+needs memory for the chunk being solved.
+
+Usage::
+>>> with CashflowStoreWriter('portfolio.store') as writer:
+...     writer.append([-100, 5, 105], [0, 180, 365], [0.05])
+>>> store = CashflowStore('portfolio.store')
+>>> roots, status = store.solve(chunk_size=100000)
+"""
+from __future__ import division
+
+import logging
+import os
+from array import array
+
+import numpy as np
+
+from root_find import solve_tir_batch, InputError, NUMPY_TYPE, SOLVER_NO_BRACKET
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+COLUMNS = ('flows', 'days', 'rates')
+COPY_BLOCK = 2**20
+
+class CashflowStore(object):
+    """Read-only, memory-mapped view of a store directory.
+    """
+    def __init__(self, path):
+        """Constructor.
+
+        :path: directory of the store
+        """
+        self.path = path
+        column = lambda name: os.path.join(path, name + '.npy')
+        if not os.path.exists(column('offsets')):
+            raise InputError(expr = "Error in CashflowStore(), %r is not a cashflow store" % (path,))
+        self.offsets = np.load(column('offsets'), mmap_mode='r')
+        self.flows = np.load(column('flows'), mmap_mode='r')
+        self.days = np.load(column('days'), mmap_mode='r')
+        self.rates = np.load(column('rates'), mmap_mode='r') if os.path.exists(column('rates')) else None
+        self.day_count_base = (np.load(column('day_count_base'), mmap_mode='r')
+                               if os.path.exists(column('day_count_base')) else None)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def instrument(self, k):
+        """Return the views ``(cashflows, days_to_flows, reference_rates)`` of instrument `k`.
+        """
+        start, end = self.offsets[k], self.offsets[k + 1]
+        return (self.flows[start:end], self.days[start:end],
+                None if self.rates is None else self.rates[start:end])
+
+    def chunk(self, start, stop):
+        """Return the arguments of `solve_tir_batch` for instruments ``start`` to ``stop`` (excluded).
+
+        The tuple ``(cashflows, days_to_flows, reference_rates, day_count_base, offsets)`` holds
+        views of the mapped columns, only the rebased offsets are a new (small) array.
+        """
+        offsets = self.offsets[start:stop + 1]
+        first, last = offsets[0], offsets[-1]
+        return (self.flows[first:last], self.days[first:last],
+                None if self.rates is None else self.rates[first:last],
+                365 if self.day_count_base is None else self.day_count_base[start:stop],
+                offsets - first)
+
+    def solve(self, chunk_size=100000, out=None, **options):
+        """Solve the IRR (own margin when the store has rates) of every instrument, chunk by chunk.
+
+        :chunk_size: instruments solved together
+        :out: optional tuple of arrays ``(roots, status)`` to fill, e.g. memory-mapped result columns
+        :options: `lower`, `upper`, `xtol` and `maxiter` of `solve_tir_batch`
+
+        Returns the tuple ``(roots, status)``.
+        """
+        n_instruments = len(self)
+        if out is None:
+            out = (np.empty(n_instruments), np.full(n_instruments, SOLVER_NO_BRACKET, dtype='int8'))
+        roots, status = out
+        for start in range(0, n_instruments, chunk_size):
+            stop = min(start + chunk_size, n_instruments)
+            roots[start:stop], status[start:stop] = solve_tir_batch(*self.chunk(start, stop), **options)
+            logger.debug('CashflowStore.solve: %d of %d instruments', stop, n_instruments)
+        return roots, status
+
+    def __repr__(self):
+        return "cashflowStore(path=%(path)r, instruments=%(n)r, cashflows=%(flows)r)" % {'path': self.path, 'n': len(self), 'flows': len(self.flows)}
+
+
+class CashflowStoreWriter(object):
+    """Build a store by appending instruments, without holding the portfolio in memory.
+
+    Columns are streamed to raw files while appending; `close` writes each ``.npy`` header
+    and copies the raw data after it in blocks of `COPY_BLOCK` values.
+    """
+    def __init__(self, path):
+        """Constructor.
+
+        :path: directory of the store, created if needed
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self._raw = dict((name, open(self._raw_path(name), 'wb')) for name in COLUMNS + ('day_count_base',))
+        self._offsets = array('q', [0])
+        self._has_rates = None
+        self._has_base = None
+
+    def _raw_path(self, name):
+        return os.path.join(self.path, name + '.raw')
+
+    def append(self, cashflows, days_to_flows, reference_rates=None, day_count_base=None):
+        """Add one instrument.
+
+        :cashflows: money-value of its cashflows
+        :days_to_flows: number of days till the cashflows are due
+        :reference_rates: one per cashflow or a single one; either every instrument has them or none
+        :day_count_base: its day count base; either every instrument has one or none (365 is used)
+        """
+        flows = np.asarray(cashflows, dtype=NUMPY_TYPE)
+        days = np.asarray(days_to_flows, dtype=NUMPY_TYPE)
+        if flows.ndim != 1 or flows.shape != days.shape:
+            raise InputError(expr = "Error in CashflowStoreWriter.append(), len(cashflows) must be equal to len(days_to_flows)")
+        if self._has_rates is None:
+            self._has_rates = reference_rates is not None
+            self._has_base = day_count_base is not None
+        if self._has_rates != (reference_rates is not None) or self._has_base != (day_count_base is not None):
+            raise InputError(expr = "Error in CashflowStoreWriter.append(), reference_rates and day_count_base must be given for every instrument or for none")
+
+        flows.tofile(self._raw['flows'])
+        days.tofile(self._raw['days'])
+        if self._has_rates:
+            np.broadcast_to(np.asarray(reference_rates, dtype=NUMPY_TYPE), flows.shape).tofile(self._raw['rates'])
+        if self._has_base:
+            np.asarray([day_count_base], dtype=NUMPY_TYPE).tofile(self._raw['day_count_base'])
+        self._offsets.append(self._offsets[-1] + len(flows))
+
+    def close(self):
+        """Write the ``.npy`` columns and remove the raw files.
+        """
+        for name, raw in self._raw.items():
+            raw.close()
+        written = dict(zip(COLUMNS, (True, True, self._has_rates)))
+        written['day_count_base'] = self._has_base
+        for name in self._raw:
+            if written[name]:
+                self._copy_column(name)
+            os.remove(self._raw_path(name))
+        np.save(os.path.join(self.path, 'offsets.npy'), np.frombuffer(self._offsets, dtype='int64'))
+
+    def _copy_column(self, name):
+        target = os.path.join(self.path, name + '.npy')
+        if not os.path.getsize(self._raw_path(name)):
+            np.save(target, np.empty(0, dtype=NUMPY_TYPE))
+            return
+        raw = np.memmap(self._raw_path(name), dtype=NUMPY_TYPE, mode='r')
+        column = np.lib.format.open_memmap(target, mode='w+', dtype=NUMPY_TYPE, shape=raw.shape)
+        for start in range(0, len(raw), COPY_BLOCK):
+            column[start:start + COPY_BLOCK] = raw[start:start + COPY_BLOCK]
+        column.flush()
+        del column, raw
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_store(path, cashflows, days_to_flows, reference_rates=None, day_count_base=None, offsets=None):
+    """Write flat arrays (as taken by `solve_tir_batch` with `offsets`) as a store, return it opened.
+    """
+    flows = np.asarray(cashflows, dtype=NUMPY_TYPE)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    columns = {'flows': flows, 'days': days_to_flows, 'rates': reference_rates, 'day_count_base': day_count_base}
+    for name, values in columns.items():
+        if values is not None:
+            np.save(os.path.join(path, name + '.npy'), np.asarray(values, dtype=NUMPY_TYPE))
+    np.save(os.path.join(path, 'offsets.npy'), np.asarray([0, len(flows)] if offsets is None else offsets, dtype='int64'))
+    return CashflowStore(path)
+
+
+if __name__ == '__main__':
+    import tempfile
+
+    path = os.path.join(tempfile.mkdtemp(), 'portfolio.store')
+    with CashflowStoreWriter(path) as writer:
+        writer.append([-100, 5, 5, 105], [0, 182, 365, 547], [0.05])
+        writer.append([-98.5, 3, 3, 3, 103], [0, 90, 180, 270, 360], [0.04, 0.041, 0.042, 0.043, 0.044])
+    store = CashflowStore(path)
+    print(store)
+    print(store.instrument(1))
+    print(store.solve(chunk_size=1))
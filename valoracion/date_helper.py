@@ -4,11 +4,20 @@ from __future__ import division
 
 import logging
 
+from collections import namedtuple, OrderedDict
 from datetime import date
 from datetime import timedelta
 import math
 
-logger = logging.getLogger(__name__).addHandler(logger.NullHandler())
+import numpy as np
+
+from instrumentation import instrumented
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+_ORDINAL_EPOCH = 719163 # date(1970, 1, 1).toordinal(), ordinal of datetime64 day zero
+_DAYS_IN_MONTH = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31], dtype='int64')
 
 def _isleap(year):
     """Return True for leap years and False otherwise.
@@ -18,71 +27,193 @@ def _isleap(year):
 def _is_end_of_month(date):
     """Checks if date is an end of the month.
     """
-    return date == end_of_month(date)
+    return _is_end_of_month_ordinal(date.toordinal())
     
 def end_of_month(date):
     """Return a datetime.date object as the end of the month of date.month 
     """ 
-    end_of_month = {1:31,
-                    2:None,
-                    3:31,
-                    4:30,
-                    5:31,
-                    6:30,
-                    7:31,
-                    8:31,
-                    9:30,
-                    10:31,
-                    11:30,
-                    12:31}
-    if not date.month == 2:
-        return date.replace(day=end_of_month[date.month])
-    elif _isleap(date.year):
-        return date.replace(day=29)
-    else:
-        return date.replace(day=28)
+    return date.fromordinal(_end_of_month_ordinal(date.toordinal()))
+    
+# Ordinal (as given by `date.toordinal()`) fast path: dates are plain integers and the
+# year/month/day decomposition, both ways, uses the precomputed tables below instead of
+# `datetime.date` objects.
+_DAYS_IN_MONTH_TABLE = ((0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31),   # common years
+                        (0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31))   # leap years
+_COMMON_DAYS_IN_MONTH = _DAYS_IN_MONTH_TABLE[0]
+_DAYS_BEFORE_MONTH_TABLE = tuple(tuple(sum(days_in_month[1:month]) for month in range(13))
+                                 for days_in_month in _DAYS_IN_MONTH_TABLE)
+_MONTH_OF_DAY_TABLE = tuple(tuple(month for month in range(1, 13) for _ in range(days_in_month[month]))
+                            for days_in_month in _DAYS_IN_MONTH_TABLE)   # month of each day of the year
+_YEAR_START_TABLE = [0] + [365 * (year - 1) + (year - 1) // 4 - (year - 1) // 100 + (year - 1) // 400 + 1
+                           for year in range(1, 10001)]
+_LEAP_YEAR_TABLE = tuple(1 if _isleap(year) else 0 for year in range(10001))
+
+def _ord2ymd(ordinal):
+    """Return the tuple (year, month, day) of an ordinal.
+    """
+    # 146097 days every 400 years: the estimate is at most one year off
+    year = ordinal * 400 // 146097 + 1
+    if _YEAR_START_TABLE[year] > ordinal:
+        year -= 1
+    elif _YEAR_START_TABLE[year + 1] <= ordinal:
+        year += 1
+    day_of_year = ordinal - _YEAR_START_TABLE[year]
+    leap = _LEAP_YEAR_TABLE[year]
+    month = _MONTH_OF_DAY_TABLE[leap][day_of_year]
+    return year, month, day_of_year - _DAYS_BEFORE_MONTH_TABLE[leap][month] + 1
+
+def _ymd2ord(year, month, day):
+    """Return the ordinal of a (year, month, day), `day` must be valid for that month.
+    """
+    return _YEAR_START_TABLE[year] + _DAYS_BEFORE_MONTH_TABLE[_LEAP_YEAR_TABLE[year]][month] + day - 1
+
+def _days_in_month(year, month):
+    """Return the number of days in a (year, month).
+    """
+    return _DAYS_IN_MONTH_TABLE[_LEAP_YEAR_TABLE[year]][month]
+
+def _end_of_month_ordinal(ordinal):
+    """Return the ordinal of the end of the month of an ordinal.
+    """
+    year, month, day = _ord2ymd(ordinal)
+    return ordinal + _days_in_month(year, month) - day
+
+def _is_end_of_month_ordinal(ordinal):
+    """Checks if an ordinal is an end of the month.
+    """
+    year, month, day = _ord2ymd(ordinal)
+    return day == _days_in_month(year, month)
+
+def _edate_ordinal(ordinal, months):
+    """Ordinal of the same date nth months away, 'alla Excel'.
+    """
+    year, month, day = _ord2ymd(ordinal)
+    months += month - 1
+    year += months // 12
+    month = months % 12 + 1
+    if day > 28 and day > _COMMON_DAYS_IN_MONTH[month]:
+        day = _days_in_month(year, month)
+    return _ymd2ord(year, month, day)
+
+def _feb29_up_to_ordinal(ordinal, year):
+    """Return the number of February 29th on or before `ordinal` (from 0001-01-01).
+    
+    :ordinal: ordinal of a date, as given by `date.toordinal()`
+    :year: year of that date
+    """
+    return _leaps_before(year) + (_isleap(year) and ordinal >= _ymd2ord(year, 2, 29))
+
+def _leaps_before(year):
+    """Return the number of leap years before `year` (from year 1), in closed form.
     
+    Works on integers and on integer arrays.
+    """
+    prev = year - 1
+    return prev // 4 - prev // 100 + prev // 400
+
+def _leap_days_before(ordinal, year):
+    """Return the number of days before `ordinal` (from 0001-01-01) that fall in leap years.
+    
+    :ordinal: ordinal of a date, as given by `date.toordinal()`
+    :year: year of that date
+    """
+    leaps_before = _leaps_before(year)
+    if _isleap(year):
+        day_of_year = ordinal - (365 * (year - 1) + leaps_before + 1)
+        return 366 * leaps_before + day_of_year
+    return 366 * leaps_before
+
 def _days_in_leap_and_common_years(i_date, f_date):
-    """Return the a tuple with number of days in common and leap years (respectively) between initial and final dates.
-    """
-    
-    iy = i_date.year
-    fy = f_date.year
-    
-    days_in_leap = 0
-    days_in_common = 0
-    if iy == fy:
-        # same year
-        delta = f_date - i_date
-        if _isleap(iy):
-            days_in_leap += delta.days
-        else:
-            days_in_common += delta.days
-    elif fy - iy >= 1:
-        # different year
-        delta1 = i_date.replace(year = iy+1, month=1, day=1) - i_date # days in initial year
-        delta2 = f_date - f_date.replace(month=1, day=1) # days in final year
-        
-        if _isleap(iy):
-            days_in_leap += delta1.days
-        else:
-            days_in_common += delta1.days
-        
-        if _isleap(fy):
-            days_in_leap += delta2.days
-        else:
-            days_in_common += delta2.days
-        
-        leaps_in_between = [y for y in range(iy+1, fy) if _isleap(y)]
-        commons_in_between = [y for y in range(iy+1, fy) if not(_isleap(y))]
-        
-        days_in_leap += len(leaps_in_between) * 366
-        days_in_common += len(commons_in_between) * 365
-    #else:
-        #raise InputError(expr = "Error in days_in_years(), f_date.year must be greater than i_date.year")
-        
+    """Return the a tuple with number of days in leap and common years (respectively) between initial and final dates.
+    
+    Constant time, whatever the number of years in between.
+    When f_date is before i_date both counts are negative.
+    """
+    return _days_in_leap_and_common_years_ordinal(i_date.toordinal(), f_date.toordinal())
+
+def _days_in_leap_and_common_years_ordinal(i_ordinal, f_ordinal):
+    """Ordinal counterpart of `_days_in_leap_and_common_years`.
+    """
+    days_in_leap = (_leap_days_before(f_ordinal, _ord2ymd(f_ordinal)[0])
+                    - _leap_days_before(i_ordinal, _ord2ymd(i_ordinal)[0]))
+    days_in_common = (f_ordinal - i_ordinal) - days_in_leap
+    
+    return (days_in_leap, days_in_common)
+    
+def _to_ordinals(dates):
+    """Return an int64 array of ordinals (as given by `date.toordinal()`) for an array of dates.
+    
+    :dates: array of datetime64 values, of datetime.date objects or of integer ordinals
+    """
+    dates = np.asarray(dates)
+    if dates.dtype.kind == 'O':
+        dates = dates.astype('datetime64[D]')
+    if dates.dtype.kind == 'M':
+        return dates.astype('datetime64[D]').astype('int64') + _ORDINAL_EPOCH
+    elif dates.dtype.kind in 'iu':
+        return dates.astype('int64')
+    else:
+        raise TypeError("Dates must be datetime64 values or integer ordinals, not %r" % dates.dtype)
+
+def _ymd_from_ordinals(ordinals):
+    """Return a tuple with the arrays of years, months and days for an array of ordinals.
+    """
+    days = (ordinals - _ORDINAL_EPOCH).astype('datetime64[D]')
+    months = days.astype('datetime64[M]')
+    month_count = months.astype('int64')
+    return (month_count // 12 + 1970,
+            month_count % 12 + 1,
+            (days - months).astype('int64') + 1)
+
+def _isleap_array(years):
+    """Return a boolean array, True for leap years and False otherwise.
+    """
+    return (years % 4 == 0) & ((years % 100 != 0) | (years % 400 == 0))
+
+def _days_in_month_array(years, months):
+    """Return an array with the number of days in each (year, month).
+    """
+    return _DAYS_IN_MONTH[months] + ((months == 2) & _isleap_array(years))
+
+def _years_from_ordinals(ordinals):
+    """Return the array of years for an array of ordinals.
+    """
+    return (ordinals - _ORDINAL_EPOCH).astype('datetime64[D]').astype('datetime64[Y]').astype('int64') + 1970
+
+def _leap_days_before_array(ordinals, years):
+    """Array counterpart of `_leap_days_before`.
+    """
+    leaps_before = _leaps_before(years)
+    day_of_year = ordinals - (365 * (years - 1) + leaps_before + 1)
+    return 366 * leaps_before + np.where(_isleap_array(years), day_of_year, 0)
+
+def _feb29_up_to_array(ordinals, years):
+    """Array counterpart of `_feb29_up_to_ordinal`.
+    """
+    leaps_before = _leaps_before(years)
+    day_of_year = ordinals - (365 * (years - 1) + leaps_before + 1)
+    return leaps_before + (_isleap_array(years) & (day_of_year >= 59))
+
+def _edate_array(ordinals, months):
+    """Array counterpart of `_edate_ordinal`, `months` being a scalar or an array.
+    """
+    years, month, days = _ymd_from_ordinals(ordinals)
+    month_count = (years - 1970) * 12 + (month - 1) + months
+    new_years, new_months = month_count // 12 + 1970, month_count % 12 + 1
+    first_days = month_count.astype('datetime64[M]').astype('datetime64[D]').astype('int64') + _ORDINAL_EPOCH
+    return first_days + np.minimum(days, _days_in_month_array(new_years, new_months)) - 1
+
+def _days_in_leap_and_common_years_array(i_ordinals, f_ordinals):
+    """Return a tuple with the arrays of days in leap and common years (respectively) between initial and final ordinals.
+    
+    Array counterpart of `_days_in_leap_and_common_years`.
+    """
+    days_in_leap = (_leap_days_before_array(f_ordinals, _years_from_ordinals(f_ordinals))
+                    - _leap_days_before_array(i_ordinals, _years_from_ordinals(i_ordinals)))
+    days_in_common = (f_ordinals - i_ordinals) - days_in_leap
     return (days_in_leap, days_in_common)
     
+@instrumented
 def periodic_date_gen(start_date, end_date, periodicity_in_months):
     """Generates periodic dates
     
@@ -104,17 +235,152 @@ def periodic_date_gen(start_date, end_date, periodicity_in_months):
         date_count += 1
     return dates[::-1]
 
+def _periodic_date_array(start_date, end_date, periodicity_in_months):
+    """Array counterpart of `periodic_date_gen`, without the cache of `periodic_date_array`.
+    """
+    if periodicity_in_months < 1:
+        raise ValueError("periodicity_in_months must be a positive number of months, not %r" % periodicity_in_months)
+    start = np.datetime64(start_date, 'D')
+    end = np.datetime64(end_date, 'D')
+    if end <= start:
+        return np.array([end])
+    
+    # Month counts (since 1970-01) of end_date and of every roll date going backwards
+    end_month = end.astype('datetime64[M]')
+    end_day = int((end - end_month).astype('int64')) + 1
+    n_periods = int((end_month - start.astype('datetime64[M]')).astype('int64')) // periodicity_in_months + 1
+    months = end_month.astype('int64') - periodicity_in_months * np.arange(n_periods + 1)
+    
+    # Same day of the month, clamped to the end of the month as `edate` does
+    days_in_month = _days_in_month_array(months // 12 + 1970, months % 12 + 1)
+    dates = months.astype('datetime64[M]').astype('datetime64[D]') + (np.minimum(end_day, days_in_month) - 1)
+    
+    # Keep up to the first date that is not after start_date
+    n_dates = len(dates) - np.searchsorted(dates[::-1], start, side='right') + 1
+    return dates[n_dates - 1::-1]
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+class ScheduleCache(object):
+    """Bounded LRU cache of periodic date schedules.
+    
+    Schedules are keyed by (start_date, end_date, periodicity_in_months), so instruments sharing
+    the same schedule generate it only once. Cached arrays are read-only.
+    """
+    def __init__(self, maxsize=4096):
+        """Constructor.
+        
+        :maxsize: maximum number of schedules kept, the least recently used ones are dropped first;
+                  nothing is kept when it is 0 or less
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._schedules = OrderedDict()
+    
+    def schedule(self, start_date, end_date, periodicity_in_months):
+        """Return the schedule as a read-only datetime64[D] array, generating it on a miss.
+        """
+        key = (np.datetime64(start_date, 'D'), np.datetime64(end_date, 'D'), periodicity_in_months)
+        try:
+            dates = self._schedules.pop(key)
+            self.hits += 1
+        except KeyError:
+            dates = _periodic_date_array(start_date, end_date, periodicity_in_months)
+            dates.flags.writeable = False
+            self.misses += 1
+            if self.maxsize <= 0:
+                return dates
+            if len(self._schedules) >= self.maxsize:
+                self._schedules.popitem(last=False)
+        self._schedules[key] = dates
+        return dates
+    
+    def cache_info(self):
+        """Return the hits, misses, maximum size and current size of the cache.
+        """
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._schedules))
+    
+    def clear(self):
+        """Drop every schedule and reset the statistics.
+        """
+        self._schedules.clear()
+        self.hits = 0
+        self.misses = 0
+
+schedule_cache = ScheduleCache()
+
+@instrumented
+def periodic_date_array(start_date, end_date, periodicity_in_months, cache=True):
+    """Generates periodic dates as a datetime64[D] array, in one shot.
+    
+    Same dates as `periodic_date_gen`: every `periodicity_in_months` months going backwards from
+    end_date (clamped to the end of the month like `edate`), down to the first date not after start_date.
+    
+    :start_date: datetime.date or datetime64
+    :end_date: datetime.date or datetime64
+    :periodicity_in_months: months between dates
+    :cache: when True use (and fill) `schedule_cache` and return a read-only array
+    """
+    if cache:
+        return schedule_cache.schedule(start_date, end_date, periodicity_in_months)
+    return _periodic_date_array(start_date, end_date, periodicity_in_months)
+
+@instrumented
+def periodic_date_arrays(start_dates, end_dates, periodicity_in_months):
+    """Generates the periodic dates of many schedules at once, as flat arrays.
+
+    Schedule k holds the same dates as ``periodic_date_array(start_dates[k], end_dates[k], periodicity_in_months[k])``.
+
+    :start_dates: array of datetime64 values, of datetime.date objects or of integer ordinals
+    :end_dates: same, broadcastable with start_dates
+    :periodicity_in_months: months between dates, scalar or one per schedule
+
+    Returns a tuple ``(dates, offsets)``: the datetime64[D] dates of every schedule, ascending,
+    one after the other, and the start of each schedule in `dates` (plus a final entry).
+    """
+    start_ordinals, end_ordinals = np.broadcast_arrays(_to_ordinals(start_dates), _to_ordinals(end_dates))
+    start = (start_ordinals.ravel() - _ORDINAL_EPOCH).astype('datetime64[D]')
+    end = (end_ordinals.ravel() - _ORDINAL_EPOCH).astype('datetime64[D]')
+    periodicity = np.broadcast_to(np.asarray(periodicity_in_months, dtype='int64'), start.shape)
+    if np.any(periodicity < 1):
+        raise ValueError("periodicity_in_months must be a positive number of months")
+
+    # Candidate roll dates going backwards from each end_date, as in `_periodic_date_array`
+    end_month = end.astype('datetime64[M]')
+    end_day = (end - end_month).astype('int64') + 1
+    n_periods = (end_month - start.astype('datetime64[M]')).astype('int64') // periodicity + 1
+    counts = np.where(end > start, n_periods + 1, 1)
+    owners = np.repeat(np.arange(len(start)), counts)
+    back = np.arange(len(owners)) - np.repeat(np.cumsum(counts) - counts, counts)
+    months = end_month.astype('int64')[owners] - periodicity[owners] * back
+    days_in_month = _days_in_month_array(months // 12 + 1970, months % 12 + 1)
+    dates = months.astype('datetime64[M]').astype('datetime64[D]') + (np.minimum(end_day[owners], days_in_month) - 1)
+
+    # Keep up to the first date that is not after start_date
+    keep = back == 0
+    keep[1:] |= (back[1:] > 0) & (dates[:-1] > start[owners[1:]])
+    dates, owners, back = dates[keep], owners[keep], back[keep]
+
+    # Reverse every schedule into ascending order
+    counts = np.bincount(owners, minlength=len(start))
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    ascending = np.empty_like(dates)
+    ascending[offsets[owners] + counts[owners] - 1 - back] = dates
+    return ascending, offsets
+
 def edate(d, months):
     """Same date nth months away, 'alla Excel'.
     
     :d: a datetime.date instance from the datetime module
     """
-    new_month = ((( d.month - 1) + months ) % 12 ) + 1
-    new_year  = d.year + ((( d.month - 1) + months ) // 12 )
-    try:
-        return date(new_year, new_month, d.day)
-    except ValueError:
-        return end_of_month(date(new_year, new_month, 1))
+    months += d.month - 1
+    new_year = d.year + months // 12
+    new_month = months % 12 + 1
+    day = d.day
+    if day > 28 and day > _COMMON_DAYS_IN_MONTH[new_month]:
+        day = _days_in_month(new_year, new_month)
+    return date(new_year, new_month, day)
 
 if __name__ == '__main__':
     
@@ -146,4 +412,6 @@ if __name__ == '__main__':
     
     for d in periodic_date_gen(date3, date4, 3):
         print(d.__str__())
+    print(periodic_date_array(date3, date4, 3))
+    print(schedule_cache.cache_info())
     
\ No newline at end of file
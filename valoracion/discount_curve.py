@@ -0,0 +1,128 @@
+"""
+"""
+from __future__ import division
+
+import logging
+
+import numpy as np
+
+from interest_rate import rate_plan
+
+NUMPY_TYPE = 'float64'
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+class Error(Exception):
+    """Base class for exceptions in this module."""
+    def __init__(self, expr):
+        Exception.__init__(self, expr)
+        self.expr = expr
+
+class InputError(Error):
+    """Exception raised for errors in parameters."""
+    pass
+
+class DiscountCurve(object):
+    """Discount curve built from (tenor in days, rate) nodes.
+
+    Node rates are given in any term of the `change_rate` equivalence chart and converted once
+    to annual effective rates; the log-discount factor of every node is precomputed, so pricing
+    a whole array of `days_to_flows` is a `searchsorted` plus a few vector operations.
+
+    Interpolation between nodes:
+    - 'log_linear' (alias 'flat_forward'): linear in log-discount factor, i.e. the forward rate
+      is flat between nodes. Before the first node and after the last one the zero rate is flat.
+    - 'linear_zero': linear in the annual effective zero rate, flat outside the nodes.
+
+    Usage::
+    >>> curve = DiscountCurve([30, 90, 180, 360], [0.050, 0.052, 0.053, 0.055])
+    >>> curve.discount_factors([45, 200])
+    >>> parametrize_tir_MP(cashflows, days_to_flows, curve)
+    """
+    _interpolations = ('log_linear', 'flat_forward', 'linear_zero')
+
+    def __init__(self, tenor_days, rates, term='EMR1', piy=1, day_count_base=365, interpolation='log_linear'):
+        """Constructor.
+
+        :tenor_days: days to each node, strictly increasing and positive
+        :rates: rate of each node, as a fraction (**not** percentage)
+        :term: term of the rates, one of the cases of `change_rate`
+        :piy: number of periods in a year of the rates (scalar or one per node)
+        :day_count_base: day count base used to turn days into years
+        :interpolation: 'log_linear', 'flat_forward' or 'linear_zero'
+        """
+        tenor_days = np.array(tenor_days, dtype=NUMPY_TYPE, ndmin=1)
+        rates = np.array(rates, dtype=NUMPY_TYPE, ndmin=1)
+        if tenor_days.shape != rates.shape or tenor_days.ndim != 1:
+            raise InputError(expr = "Error in DiscountCurve(), tenor_days and rates must be 1-D and of the same length")
+        if tenor_days[0] <= 0 or np.any(np.diff(tenor_days) <= 0):
+            raise InputError(expr = "Error in DiscountCurve(), tenor_days must be positive and strictly increasing")
+        if interpolation not in self._interpolations:
+            raise InputError(expr = "Error in DiscountCurve(), interpolation must be one of %r" % (self._interpolations,))
+
+        self.tenor_days = tenor_days
+        self.day_count_base = day_count_base
+        self.interpolation = interpolation
+        self.zero_rates = rate_plan(term, 'EMR2')(rates, piy, 1)
+        self.log_discount_factors = -(tenor_days / day_count_base) * np.log1p(self.zero_rates)
+
+        # Segments for the log-linear interpolation, starting at day 0 where log(DF) = 0
+        self._node_days = np.concatenate([[0.], tenor_days])
+        node_log_df = np.concatenate([[0.], self.log_discount_factors])
+        self._node_log_df = node_log_df[:-1]
+        self._slopes = np.diff(node_log_df) / np.diff(self._node_days)
+        self._last_slope = self.log_discount_factors[-1] / tenor_days[-1]
+
+    @classmethod
+    def from_discount_factors(cls, tenor_days, discount_factors, day_count_base=365, interpolation='log_linear'):
+        """Return the curve with the given discount factor at each node.
+
+        :tenor_days: days to each node, strictly increasing and positive
+        :discount_factors: discount factor of each node, positive
+        """
+        tenor_days = np.array(tenor_days, dtype=NUMPY_TYPE, ndmin=1)
+        discount_factors = np.array(discount_factors, dtype=NUMPY_TYPE, ndmin=1)
+        if tenor_days.shape != discount_factors.shape or not np.all(discount_factors > 0):
+            raise InputError(expr = "Error in DiscountCurve.from_discount_factors(), discount_factors must be positive, one per tenor")
+        rates = np.expm1(-np.log(discount_factors) * day_count_base / tenor_days)
+        return cls(tenor_days, rates, 'EMR2', 1, day_count_base, interpolation)
+
+    def log_discount(self, days_to_flows):
+        """Return the array of log-discount factors for an array of days.
+        """
+        days = np.asarray(days_to_flows, dtype=NUMPY_TYPE)
+        if self.interpolation == 'linear_zero':
+            zero_rates = np.interp(days, self.tenor_days, self.zero_rates)
+            return -(days / self.day_count_base) * np.log1p(zero_rates)
+        segment = np.searchsorted(self._node_days, days, side='right') - 1
+        np.clip(segment, 0, len(self._slopes) - 1, out=segment)
+        log_df = self._node_log_df[segment] + self._slopes[segment] * (days - self._node_days[segment])
+        beyond = days > self.tenor_days[-1]
+        if np.any(beyond):
+            log_df = np.where(beyond, self._last_slope * days, log_df)
+        return log_df
+
+    def discount_factors(self, days_to_flows):
+        """Return the array of discount factors for an array of days.
+        """
+        return np.exp(self.log_discount(days_to_flows))
+
+    def reference_rates(self, days_to_flows):
+        """Return the annual effective zero rates for an array of days, as `parametrize_tir_MP` expects them.
+
+        For a flow at day 0 the rate of the first node is returned.
+        """
+        days = np.asarray(days_to_flows, dtype=NUMPY_TYPE)
+        safe_days = np.where(days == 0, self.tenor_days[0], days)
+        return np.expm1(-self.log_discount(safe_days) * self.day_count_base / safe_days)
+
+    def __repr__(self):
+        return "discountCurve(nodes=%(n)r, day_count_base=%(base)r, interpolation=%(interpolation)r)" % {'n': len(self.tenor_days), 'base': self.day_count_base, 'interpolation': self.interpolation}
+
+
+if __name__ == '__main__':
+    curve = DiscountCurve([30, 90, 180, 360, 720], [5.0/100, 5.2/100, 5.3/100, 5.5/100, 5.8/100], 'MNR1', 12)
+    print(curve)
+    print(curve.zero_rates)
+    print(curve.discount_factors([0, 15, 30, 100, 720, 1000]))
+    print(curve.reference_rates([0, 15, 30, 100, 720, 1000]))
@@ -0,0 +1,105 @@
+"""
+Opt-in instrumentation for the hot paths of the package.
+
+Functions decorated with `instrumented` count their calls and accumulate their
+running time, and solvers record how many iterations and evaluations each root
+needed. Nothing is recorded until `enable()` is called; while disabled an
+instrumented function only pays for one flag check.
+
+Usage::
+>>> import instrumentation
+>>> instrumentation.enable()
+>>> # ... batch run ...
+>>> print(instrumentation.report())
+"""
+from __future__ import division
+
+import functools
+from timeit import default_timer
+
+_enabled = False
+_calls = {}
+_times = {}
+_histograms = {}
+
+def enable():
+    """Start recording calls, timings and histograms.
+    """
+    global _enabled
+    _enabled = True
+
+def disable():
+    """Stop recording, what was recorded so far is kept.
+    """
+    global _enabled
+    _enabled = False
+
+def is_enabled():
+    """Return True while recording.
+    """
+    return _enabled
+
+def reset():
+    """Forget everything recorded so far.
+    """
+    _calls.clear()
+    _times.clear()
+    _histograms.clear()
+
+def instrumented(func):
+    """Decorator counting the calls of `func` and accumulating its running time.
+
+    Entries are named after the module and qualified name of the function.
+    """
+    name = '%s.%s' % (func.__module__, getattr(func, '__qualname__', func.__name__))
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+        start = default_timer()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _calls[name] = _calls.get(name, 0) + 1
+            _times[name] = _times.get(name, 0.) + (default_timer() - start)
+    return wrapper
+
+def record(name, value):
+    """Add one observation of `value` (an integer, e.g. iterations of a solver) to the histogram `name`.
+    """
+    if _enabled:
+        histogram = _histograms.setdefault(name, {})
+        histogram[value] = histogram.get(value, 0) + 1
+
+def record_counts(name, values, counts):
+    """Add `counts[k]` observations of `values[k]` to the histogram `name`, for batch solvers.
+    """
+    if _enabled:
+        histogram = _histograms.setdefault(name, {})
+        for value, count in zip(values, counts):
+            histogram[value] = histogram.get(value, 0) + count
+
+def snapshot():
+    """Return a copy of everything recorded as a dict with 'calls', 'times' and 'histograms'.
+    """
+    return {'calls': dict(_calls),
+            'times': dict(_times),
+            'histograms': dict((name, dict(histogram)) for name, histogram in _histograms.items())}
+
+def report():
+    """Return a text report of calls and timings (slowest first) and of the histograms.
+    """
+    lines = ['{0:<60} {1:>12} {2:>14} {3:>14}'.format('Function', 'Calls', 'Total [s]', 'Mean [us]')]
+    for name in sorted(_times, key=_times.get, reverse=True):
+        lines.append('{0:<60} {1:>12} {2:>14.6f} {3:>14.3f}'.format(name, _calls[name], _times[name],
+                                                                   1e6 * _times[name] / _calls[name]))
+    for name in sorted(_histograms):
+        histogram = _histograms[name]
+        total = sum(histogram.values())
+        mean = sum(value * count for value, count in histogram.items()) / total
+        lines.append('')
+        lines.append('%(name)s: %(total)d observations, mean %(mean).2f' % {'name': name, 'total': total, 'mean': mean})
+        for value in sorted(histogram):
+            lines.append('{0:>8} {1:>12}'.format(value, histogram[value]))
+    return '\n'.join(lines)
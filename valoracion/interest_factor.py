@@ -1,11 +1,21 @@
 """
 """
 from __future__ import division
+from collections import namedtuple
 from datetime import date
+import functools
 import logging
+
+import numpy as np
+
 from date_helper import *
+from instrumentation import instrumented
+from date_helper import _ord2ymd, _days_in_month, _days_in_leap_and_common_years_ordinal
+from date_helper import _to_ordinals, _ymd_from_ordinals, _days_in_month_array, _days_in_leap_and_common_years_array
+from date_helper import _edate_ordinal, _edate_array, _feb29_up_to_ordinal, _feb29_up_to_array, _years_from_ordinals
 
-logger = logging.getLogger(__name__).addHandler(logger.NullHandler())
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
 
 def check_date_objects(date1, date2):
     if not(isinstance(date1, date) or isinstance(date2, date)):
@@ -14,7 +24,9 @@ def check_date_objects(date1, date2):
 class Error(Exception):
     """Base class for exceptions in this module.
     """
-    pass
+    def __init__(self, expr):
+        Exception.__init__(self, expr)
+        self.expr = expr
 
 class InputError(Error):
     """Exception raised for errors in parameters.
@@ -28,11 +40,10 @@ def _days_30_360_main(i_year, i_month, i_day, f_year, f_month, f_day):
     """
     num = 360 * (f_year - i_year) + 30 * (f_month - i_month) + (f_day - i_day)
     den = 360
-    log = "[%(num)r/%(den)r]" % {'num':num, 'den':den}
-    logger.debug(log)
     return num / den
         
 
+@instrumented
 def _daycount_act_act_ISDA(i_date, f_date):
     """Return factor to apply for interests between i_date and f_date.
     
@@ -49,7 +60,12 @@ def _daycount_act_act_ISDA(i_date, f_date):
     This method splits up the actual number of days falling in leap years and in non-leap years.
     The year fraction is the sum of the actual number of days falling in leap years divided by 366 and the actual number of days falling in non-leap years divided by 365.
     """
-    days_in_commons, days_in_leaps = _days_in_leap_and_common_years(i_date, f_date)
+    return _daycount_act_act_ISDA_ordinal(i_date.toordinal(), f_date.toordinal())
+
+def _daycount_act_act_ISDA_ordinal(i_ordinal, f_ordinal):
+    """Ordinal counterpart of `_daycount_act_act_ISDA`.
+    """
+    days_in_leaps, days_in_commons = _days_in_leap_and_common_years_ordinal(i_ordinal, f_ordinal)
     
     if days_in_commons == 0:
         num = days_in_leaps
@@ -60,13 +76,9 @@ def _daycount_act_act_ISDA(i_date, f_date):
     else:
         num = (366 * days_in_commons) + (365 * days_in_leaps)        
         den = 133590 #least common multiple between 366 and 365
-    
-    log = "%(f_name)r(%(i_date)r, %(f_date)r)" % {'f_name':'daycount_act_act_ISDA', 'i_date':i_date, 'f_date':f_date}
-    logger.debug(log)
-    log = "[%(num)r/%(den)r]" % {'num':num, 'den':den}
-    logger.debug(log)
     return num / den
 
+@instrumented
 def _daycount_act_act_Euro(i_date, f_date):
     """Return factor to apply for interests between i_date and f_date.
     
@@ -82,15 +94,28 @@ def _daycount_act_act_Euro(i_date, f_date):
     This method first calculates the number of full years counting backwards from the second date.
     For any resulting stub periods, the numerator is the actual number of days in the period, the denominator being 365 or 366 depending on whether February 29th falls in the stub period.
     """
-#    delta = f_date - i_date
-#    days1 = delta.days
-#    
-#    log = "%(f_name)r(%(i_date)r, %(f_date)r)" % {'f_name':'daycount_act_act_Euro', 'i_date':i_date, 'f_date':f_date}
-#    logger.debug(log)
-#    log = "[%(num)r/%(den)r]" % {'num':num, 'den':den}
-#    logger.debug(log)
-#    return num / den
+    return _daycount_act_act_Euro_ordinal(i_date.toordinal(), f_date.toordinal())
 
+def _daycount_act_act_Euro_ordinal(i_ordinal, f_ordinal):
+    """Ordinal counterpart of `_daycount_act_act_Euro`.
+    """
+    if f_ordinal < i_ordinal:
+        return -_daycount_act_act_Euro_ordinal(f_ordinal, i_ordinal)
+    i_year = _ord2ymd(i_ordinal)[0]
+    years = _ord2ymd(f_ordinal)[0] - i_year
+    stub_end = _edate_ordinal(f_ordinal, -12 * years)
+    if stub_end < i_ordinal:
+        years -= 1
+        stub_end = _edate_ordinal(f_ordinal, -12 * years)
+    
+    num = stub_end - i_ordinal
+    if _feb29_up_to_ordinal(stub_end, _ord2ymd(stub_end)[0]) > _feb29_up_to_ordinal(i_ordinal, i_year):
+        den = 366
+    else:
+        den = 365
+    return years + num / den
+
+@instrumented
 def _daycount_act_365_Fixed(i_date, f_date):
     """Return factor to apply for interests between i_date and f_date.
     
@@ -107,16 +132,16 @@ def _daycount_act_365_Fixed(i_date, f_date):
     This method first calculates the number of full years counting backwards from the second date.
     For any resulting stub periods, the numerator is the actual number of days in the period, the denominator being 365 or 366 depending on whether February 29th falls in the stub period.
     """
-    delta = f_date - i_date
-    num = delta.days
+    return _daycount_act_365_Fixed_ordinal(i_date.toordinal(), f_date.toordinal())
+
+def _daycount_act_365_Fixed_ordinal(i_ordinal, f_ordinal):
+    """Ordinal counterpart of `_daycount_act_365_Fixed`.
+    """
+    num = f_ordinal - i_ordinal
     den = 365
-    
-    log = "%(f_name)r(%(i_date)r, %(f_date)r)" % {'f_name':'daycount_act_365_Fixed', 'i_date':i_date, 'f_date':f_date}
-    logger.debug(log)
-    log = "[%(num)r/%(den)r]" % {'num':num, 'den':den}
-    logger.debug(log)
     return num / den
 
+@instrumented
 def _daycount_30_360(i_date, f_date):
     """Return factor to apply for interests between i_date and f_date.
     
@@ -129,19 +154,18 @@ def _daycount_30_360(i_date, f_date):
     Days in a year: 360
     Flavor: None
     """
-    i_year = i_date.year
-    i_month = i_date.month
-    i_day = i_date.day
-    
-    f_year = f_date.year
-    f_month = f_date.month
-    f_day = f_date.day
+    return _daycount_30_360_ordinal(i_date.toordinal(), f_date.toordinal())
+
+def _daycount_30_360_ordinal(i_ordinal, f_ordinal):
+    """Ordinal counterpart of `_daycount_30_360`.
+    """
+    i_year, i_month, i_day = _ord2ymd(i_ordinal)
+    f_year, f_month, f_day = _ord2ymd(f_ordinal)
     
-    log = "%(f_name)r(%(i_date)r, %(f_date)r)" % {'f_name':'daycount_30_360', 'i_date':i_date, 'f_date':f_date}
-    logger.debug(log)
     factor = _days_30_360_main(i_year, i_month, i_day, f_year, f_month, f_day)
     return factor
 
+@instrumented
 def _daycount_30_360_US(i_date, f_date):
     """Return factor to apply for interests between i_date and f_date.
     
@@ -154,29 +178,340 @@ def _daycount_30_360_US(i_date, f_date):
     Days in a year: 360
     Flavor: US
     """
-    i_year = i_date.year
-    i_month = i_date.month
-    i_day = i_date.day
-    
-    f_year = f_date.year
-    f_month = f_date.month
-    f_day = f_date.day
+    return _daycount_30_360_US_ordinal(i_date.toordinal(), f_date.toordinal())
+
+def _daycount_30_360_US_ordinal(i_ordinal, f_ordinal):
+    """Ordinal counterpart of `_daycount_30_360_US`.
+    """
+    i_year, i_month, i_day = _ord2ymd(i_ordinal)
+    f_year, f_month, f_day = _ord2ymd(f_ordinal)
     
+    i_feb_eom = i_month == 2 and i_day == _days_in_month(i_year, i_month)
+    f_feb_eom = f_month == 2 and f_day == _days_in_month(f_year, f_month)
     
-    if (i_date.month == 2 and _is_end_of_month(i_date)) and (f_date.month == 2 and _is_end_of_month(f_date)):
+    if i_feb_eom and f_feb_eom:
         f_day = 30
-    if (i_date.month == 2 and _is_end_of_month(i_date)):
+    if i_feb_eom:
         i_day = 30
     if (f_day == 31) and (i_day in [30, 31]):
         f_day = 30
     if  (i_day == 31):
         i_day = 30
     
-    log = "%(f_name)r(%(i_date)r, %(f_date)r)" % {'f_name':'daycount_30_360_US', 'i_date':i_date, 'f_date':f_date}
-    logger.debug(log)
     factor = _days_30_360_main(i_year, i_month, i_day, f_year, f_month, f_day)
     return factor
 
+def _days_30_360_main_array(i_years, i_months, i_days, f_years, f_months, f_days):
+    """Array counterpart of `_days_30_360_main`.
+    """
+    num = 360 * (f_years - i_years) + 30 * (f_months - i_months) + (f_days - i_days)
+    return num / 360
+
+def _daycount_act_act_ISDA_array(i_ordinals, f_ordinals):
+    """Return an array of factors between the ordinals in i_ordinals and f_ordinals.
+    
+    Array counterpart of `_daycount_act_act_ISDA`.
+    """
+    days_in_leaps, days_in_commons = _days_in_leap_and_common_years_array(i_ordinals, f_ordinals)
+    return np.where(days_in_commons == 0, days_in_leaps / 366,
+                    np.where(days_in_leaps == 0, days_in_commons / 365,
+                             ((366 * days_in_commons) + (365 * days_in_leaps)) / 133590))
+
+def _daycount_act_365_Fixed_array(i_ordinals, f_ordinals):
+    """Return an array of factors between the ordinals in i_ordinals and f_ordinals.
+    
+    Array counterpart of `_daycount_act_365_Fixed`.
+    """
+    return (f_ordinals - i_ordinals) / 365
+
+def _daycount_30_360_array(i_ordinals, f_ordinals):
+    """Return an array of factors between the ordinals in i_ordinals and f_ordinals.
+    
+    Array counterpart of `_daycount_30_360`.
+    """
+    return _days_30_360_main_array(*(_ymd_from_ordinals(i_ordinals) + _ymd_from_ordinals(f_ordinals)))
+
+def _daycount_30_360_US_array(i_ordinals, f_ordinals):
+    """Return an array of factors between the ordinals in i_ordinals and f_ordinals.
+    
+    Array counterpart of `_daycount_30_360_US`, the adjustments are applied in the same order.
+    """
+    i_years, i_months, i_days = _ymd_from_ordinals(i_ordinals)
+    f_years, f_months, f_days = _ymd_from_ordinals(f_ordinals)
+    
+    i_feb_eom = (i_months == 2) & (i_days == _days_in_month_array(i_years, i_months))
+    f_feb_eom = (f_months == 2) & (f_days == _days_in_month_array(f_years, f_months))
+    
+    f_days = np.where(i_feb_eom & f_feb_eom, 30, f_days)
+    i_days = np.where(i_feb_eom, 30, i_days)
+    f_days = np.where((f_days == 31) & ((i_days == 30) | (i_days == 31)), 30, f_days)
+    i_days = np.where(i_days == 31, 30, i_days)
+    
+    return _days_30_360_main_array(i_years, i_months, i_days, f_years, f_months, f_days)
+
+def _daycount_bus_252_ordinal(i_ordinal, f_ordinal, calendar):
+    """Return factor to apply for interests between two ordinals, bus/252.
+    
+    Business days of *calendar* from i_ordinal (included) to f_ordinal (excluded), over 252.
+    """
+    num = int(calendar.business_days_between(i_ordinal, f_ordinal))
+    den = 252
+    return num / den
+
+@instrumented
+def _daycount_bus_252(i_date, f_date, calendar):
+    """Return factor to apply for interests between i_date and f_date.
+    
+    :i_date: initial date.
+    :f_date: final date.
+    :calendar: `BusinessCalendar` of the business days.
+    
+    *i_date* and *f_date* must be instances of datetime.date class from the datetime module
+    
+    bus/252
+    Days in a month: business days of the calendar
+    Days in a year: 252 Always
+    Flavor: None
+    """
+    return _daycount_bus_252_ordinal(i_date.toordinal(), f_date.toordinal(), calendar)
+
+def _daycount_bus_252_array(i_ordinals, f_ordinals, calendar):
+    """Return an array of factors between the ordinals in i_ordinals and f_ordinals.
+    
+    Array counterpart of `_daycount_bus_252`.
+    """
+    return calendar.business_days_between(i_ordinals, f_ordinals) / 252
+
+
+@instrumented
+def _daycount_act_360(i_date, f_date):
+    """Return factor to apply for interests between i_date and f_date.
+    
+    :i_date: initial date.
+    :f_date: final date.
+    
+    *i_date* and *f_date* must be instances of datetime.date class from the datetime module
+    
+    act/360, money market
+    Days in a month: actual
+    Days in a year: 360 Always
+    Flavor: None
+    """
+    return _daycount_act_360_ordinal(i_date.toordinal(), f_date.toordinal())
+
+def _daycount_act_360_ordinal(i_ordinal, f_ordinal):
+    """Ordinal counterpart of `_daycount_act_360`.
+    """
+    num = f_ordinal - i_ordinal
+    den = 360
+    return num / den
+
+def _daycount_act_360_array(i_ordinals, f_ordinals):
+    """Return an array of factors between the ordinals in i_ordinals and f_ordinals.
+    
+    Array counterpart of `_daycount_act_360`.
+    """
+    return (f_ordinals - i_ordinals) / 360
+
+@instrumented
+def _daycount_30E_360(i_date, f_date):
+    """Return factor to apply for interests between i_date and f_date.
+    
+    :i_date: initial date.
+    :f_date: final date.
+    
+    *i_date* and *f_date* must be instances of datetime.date class from the datetime module
+    
+    30E/360, Eurobond basis
+    Days in a month: 30, the 31st of any month counts as the 30th
+    Days in a year: 360
+    Flavor: None
+    """
+    return _daycount_30E_360_ordinal(i_date.toordinal(), f_date.toordinal())
+
+def _daycount_30E_360_ordinal(i_ordinal, f_ordinal):
+    """Ordinal counterpart of `_daycount_30E_360`.
+    """
+    i_year, i_month, i_day = _ord2ymd(i_ordinal)
+    f_year, f_month, f_day = _ord2ymd(f_ordinal)
+    return _days_30_360_main(i_year, i_month, min(i_day, 30), f_year, f_month, min(f_day, 30))
+
+def _daycount_30E_360_array(i_ordinals, f_ordinals):
+    """Return an array of factors between the ordinals in i_ordinals and f_ordinals.
+    
+    Array counterpart of `_daycount_30E_360`.
+    """
+    i_years, i_months, i_days = _ymd_from_ordinals(i_ordinals)
+    f_years, f_months, f_days = _ymd_from_ordinals(f_ordinals)
+    return _days_30_360_main_array(i_years, i_months, np.minimum(i_days, 30),
+                                   f_years, f_months, np.minimum(f_days, 30))
+
+@instrumented
+def _daycount_30E_360_ISDA(i_date, f_date, maturity=None):
+    """Return factor to apply for interests between i_date and f_date.
+    
+    :i_date: initial date.
+    :f_date: final date.
+    :maturity: ordinal of the maturity date, or None
+    
+    *i_date* and *f_date* must be instances of datetime.date class from the datetime module
+    
+    30E/360 ISDA, German
+    Days in a month: 30, the last day of any month counts as the 30th, except for
+    a final date in February that is the maturity date
+    Days in a year: 360
+    Flavor: ISDA
+    """
+    return _daycount_30E_360_ISDA_ordinal(i_date.toordinal(), f_date.toordinal(), maturity)
+
+def _daycount_30E_360_ISDA_ordinal(i_ordinal, f_ordinal, maturity=None):
+    """Ordinal counterpart of `_daycount_30E_360_ISDA`.
+    """
+    i_year, i_month, i_day = _ord2ymd(i_ordinal)
+    f_year, f_month, f_day = _ord2ymd(f_ordinal)
+    if i_day == _days_in_month(i_year, i_month):
+        i_day = 30
+    if f_day == _days_in_month(f_year, f_month) and not (f_month == 2 and f_ordinal == maturity):
+        f_day = 30
+    return _days_30_360_main(i_year, i_month, i_day, f_year, f_month, f_day)
+
+def _daycount_30E_360_ISDA_array(i_ordinals, f_ordinals, maturity=None):
+    """Return an array of factors between the ordinals in i_ordinals and f_ordinals.
+    
+    Array counterpart of `_daycount_30E_360_ISDA`.
+    """
+    i_years, i_months, i_days = _ymd_from_ordinals(i_ordinals)
+    f_years, f_months, f_days = _ymd_from_ordinals(f_ordinals)
+    i_days = np.where(i_days == _days_in_month_array(i_years, i_months), 30, i_days)
+    f_eom = f_days == _days_in_month_array(f_years, f_months)
+    if maturity is not None:
+        f_eom &= ~((f_months == 2) & (f_ordinals == maturity))
+    f_days = np.where(f_eom, 30, f_days)
+    return _days_30_360_main_array(i_years, i_months, i_days, f_years, f_months, f_days)
+
+def _daycount_act_act_Euro_array(i_ordinals, f_ordinals):
+    """Return an array of factors between the ordinals in i_ordinals and f_ordinals.
+    
+    Array counterpart of `_daycount_act_act_Euro`.
+    """
+    sign = np.where(f_ordinals < i_ordinals, -1, 1)
+    i_ordinals, f_ordinals = np.minimum(i_ordinals, f_ordinals), np.maximum(i_ordinals, f_ordinals)
+    i_years = _years_from_ordinals(i_ordinals)
+    years = _years_from_ordinals(f_ordinals) - i_years
+    stub_ends = _edate_array(f_ordinals, -12 * years)
+    before = stub_ends < i_ordinals
+    years = years - before
+    stub_ends = np.where(before, _edate_array(f_ordinals, -12 * years), stub_ends)
+    feb29 = _feb29_up_to_array(stub_ends, _years_from_ordinals(stub_ends)) > _feb29_up_to_array(i_ordinals, i_years)
+    return sign * (years + (stub_ends - i_ordinals) / np.where(feb29, 366, 365))
+
+@instrumented
+def _daycount_act_act_ICMA(i_date, f_date, frequency=1):
+    """Return factor to apply for interests between i_date and f_date.
+    
+    :i_date: initial date.
+    :f_date: final date.
+    :frequency: coupons in a year (1, 2, 3, 4, 6 or 12)
+    
+    *i_date* and *f_date* must be instances of datetime.date class from the datetime module
+    
+    act/act, ICMA, ISMA-99
+    Days in a month: actual
+    Days in a year: actual days of the coupon period times the frequency
+    
+    Coupon periods are rolled every 12/frequency months from i_date (as `edate` does), so i_date
+    must be a coupon date: each full period adds 1/frequency and the last partial one its
+    actual days over frequency times its actual length. When i_date is the last day of its month
+    every coupon date is a month end too (30 Sep, 31 Mar, 30 Sep...), so regular month-end
+    periods accrue exactly 1/frequency.
+    """
+    return _daycount_act_act_ICMA_ordinal(i_date.toordinal(), f_date.toordinal(), frequency)
+
+def _daycount_act_act_ICMA_ordinal(i_ordinal, f_ordinal, frequency=1):
+    """Ordinal counterpart of `_daycount_act_act_ICMA`.
+    """
+    if f_ordinal < i_ordinal:
+        return -_daycount_act_act_ICMA_ordinal(f_ordinal, i_ordinal, frequency)
+    months = 12 // frequency
+    i_year, i_month, i_day = _ord2ymd(i_ordinal)
+    f_year, f_month, _ = _ord2ymd(f_ordinal)
+    # End-of-month rule: roll from the first day of the next month and step back one day
+    eom = 1 if i_day == _days_in_month(i_year, i_month) else 0
+    periods = (12 * (f_year - i_year) + (f_month - i_month)) // months
+    period_start = _edate_ordinal(i_ordinal + eom, periods * months) - eom
+    if period_start > f_ordinal:
+        periods -= 1
+        period_start = _edate_ordinal(i_ordinal + eom, periods * months) - eom
+    period_end = _edate_ordinal(i_ordinal + eom, (periods + 1) * months) - eom
+    
+    num = f_ordinal - period_start
+    den = frequency * (period_end - period_start)
+    return periods / frequency + num / den
+
+def _daycount_act_act_ICMA_array(i_ordinals, f_ordinals, frequency=1):
+    """Return an array of factors between the ordinals in i_ordinals and f_ordinals.
+    
+    Array counterpart of `_daycount_act_act_ICMA`.
+    """
+    sign = np.where(f_ordinals < i_ordinals, -1, 1)
+    i_ordinals, f_ordinals = np.minimum(i_ordinals, f_ordinals), np.maximum(i_ordinals, f_ordinals)
+    months = 12 // frequency
+    i_years, i_months, i_days = _ymd_from_ordinals(i_ordinals)
+    f_years, f_months, _ = _ymd_from_ordinals(f_ordinals)
+    eom = (i_days == _days_in_month_array(i_years, i_months)).astype('int64')
+    periods = (12 * (f_years - i_years) + (f_months - i_months)) // months
+    period_starts = _edate_array(i_ordinals + eom, periods * months) - eom
+    after = period_starts > f_ordinals
+    periods = periods - after
+    period_starts = np.where(after, _edate_array(i_ordinals + eom, periods * months) - eom, period_starts)
+    period_ends = _edate_array(i_ordinals + eom, (periods + 1) * months) - eom
+    return sign * (periods + (f_ordinals - period_starts) / (period_ends - period_starts)) / frequency
+
+
+_FREQUENCIES = (1, 2, 3, 4, 6, 12)
+
+Convention = namedtuple('Convention', ['factor', 'factor_ordinal', 'factor_array', 'parameters'])
+
+_conventions = {}
+
+def _convention_key(dim, diy, flavor):
+    return '_'.join([str(dim), str(diy), str(flavor)])
+
+def register_convention(dim, diy, flavor, factor, factor_ordinal, factor_array, parameters=()):
+    """Register a day count convention, used by `InterestFactor(dim, diy, flavor)`.
+    
+    :factor: function of two datetime.date objects
+    :factor_ordinal: function of two ordinals (`date.toordinal()`)
+    :factor_array: function of two int64 arrays of ordinals, with the results of `factor_ordinal`
+    :parameters: names of the keyword arguments of `InterestFactor` the three functions also take
+                 ('calendar', 'frequency' or 'maturity')
+    
+    Registering an existing (dim, diy, flavor) replaces its functions.
+    """
+    _conventions[_convention_key(dim, diy, flavor)] = Convention(factor, factor_ordinal, factor_array, tuple(parameters))
+
+def registered_conventions():
+    """Return the sorted list of (dim, diy, flavor) keys of the registered conventions, as strings.
+    """
+    return sorted(_conventions)
+
+register_convention(30, 360, None, _daycount_30_360, _daycount_30_360_ordinal, _daycount_30_360_array)
+register_convention(30, 360, 'US', _daycount_30_360_US, _daycount_30_360_US_ordinal, _daycount_30_360_US_array)
+register_convention('30E', 360, None, _daycount_30E_360, _daycount_30E_360_ordinal, _daycount_30E_360_array)
+register_convention('30E', 360, 'ISDA', _daycount_30E_360_ISDA, _daycount_30E_360_ISDA_ordinal,
+                    _daycount_30E_360_ISDA_array, ('maturity',))
+register_convention('act', 'act', 'ISDA', _daycount_act_act_ISDA, _daycount_act_act_ISDA_ordinal, _daycount_act_act_ISDA_array)
+register_convention('act', 'act', 'ICMA', _daycount_act_act_ICMA, _daycount_act_act_ICMA_ordinal,
+                    _daycount_act_act_ICMA_array, ('frequency',))
+for flavor in ('Euro', 'AFB'):
+    register_convention('act', 'act', flavor, _daycount_act_act_Euro, _daycount_act_act_Euro_ordinal, _daycount_act_act_Euro_array)
+# 'act_act_Fixed' is the historical key of act/365 fixed
+for dim, diy, flavor in (('act', 'act', 'Fixed'), ('act', 365, 'Fixed'), ('act', 365, None)):
+    register_convention(dim, diy, flavor, _daycount_act_365_Fixed, _daycount_act_365_Fixed_ordinal, _daycount_act_365_Fixed_array)
+register_convention('act', 360, None, _daycount_act_360, _daycount_act_360_ordinal, _daycount_act_360_array)
+register_convention('bus', 252, None, _daycount_bus_252, _daycount_bus_252_ordinal, _daycount_bus_252_array, ('calendar',))
+
+
 class InterestFactor(object):
     """.
     
@@ -189,19 +524,72 @@ class InterestFactor(object):
     
     """
 
-    def __init__(self, dim=30, diy=360, flavor=None):
+    def __init__(self, dim=30, diy=360, flavor=None, calendar=None, frequency=1, maturity=None):
         """Constructor.
         
+        :calendar: `BusinessCalendar` counting the days of business-day conventions (bus/252)
+        :frequency: coupons in a year of act/act ICMA
+        :maturity: maturity date of 30E/360 ISDA (datetime.date, datetime64 or ordinal)
+        
+        The (dim, diy, flavor) conventions available are those of `register_convention`.
         """
         self.dim = dim
         self.diy = diy
         self.flavor = flavor
+        self.calendar = calendar
+        self.frequency = frequency
+        self.maturity = maturity
+        
+        method = _convention_key(self.dim, self.diy, self.flavor)
+        try:
+            convention = _conventions[method]
+        except KeyError:
+            raise InputError(expr = "Error in InterestFactor(), unknown convention %s, registered: %s"
+                             % (method, ', '.join(registered_conventions())))
+        if 'calendar' in convention.parameters and calendar is None:
+            raise InputError(expr = "Error in InterestFactor(), %s needs a calendar" % method)
+        if 'frequency' in convention.parameters and (frequency not in _FREQUENCIES):
+            raise InputError(expr = "Error in InterestFactor(), frequency of %s must divide 12" % method)
+        values = {'calendar': calendar,
+                  'frequency': int(frequency),
+                  'maturity': None if maturity is None else int(_to_ordinals(maturity))}
+        bound = dict((name, values[name]) for name in convention.parameters)
+        self._convention = convention
+        self._bound = bound
+        if bound:
+            self.factor, self.factor_ordinal, self._array_method = [functools.partial(function, **bound)
+                                                                   for function in convention[:3]]
+        else:
+            self.factor, self.factor_ordinal, self._array_method = convention[:3]
+    
+    @instrumented
+    def factor_array(self, i_dates, f_dates, frequency=None, maturity=None):
+        """Return a float64 array of factors between each pair of initial and final dates.
         
-        method = '_'.join([str(self.dim), str(self.diy), str(self.flavor)])
-        #try:
-        self.factor = self._methods[method]
-        #except KeyError as e:
-            #pass #TODO: catch this key error
+        :i_dates: initial dates.
+        :f_dates: final dates.
+        :frequency: coupons in a year, scalar or per pair, instead of the one of the constructor (act/act ICMA)
+        :maturity: maturity dates, scalar or per pair, instead of the one of the constructor (30E/360 ISDA)
+        
+        *i_dates* and *f_dates* must be arrays (or broadcastable to a common shape) of datetime64 values
+        or of integer ordinals as given by `datetime.date.toordinal()`.
+        Results are the same as calling `factor` on each pair, without a Python call per element.
+        `frequency` and `maturity` are ignored by conventions that do not take them, so portfolios
+        can pass them whatever their convention.
+        """
+        parameters = self._convention.parameters
+        overrides = {}
+        if frequency is not None and 'frequency' in parameters:
+            frequency = np.asarray(frequency, dtype='int64')
+            if not np.all(np.isin(frequency, _FREQUENCIES)):
+                raise InputError(expr = "Error in InterestFactor.factor_array(), frequency must divide 12")
+            overrides['frequency'] = frequency
+        if maturity is not None and 'maturity' in parameters:
+            overrides['maturity'] = _to_ordinals(maturity)
+        if overrides:
+            return self._convention.factor_array(_to_ordinals(i_dates), _to_ordinals(f_dates),
+                                                 **dict(self._bound, **overrides))
+        return self._array_method(_to_ordinals(i_dates), _to_ordinals(f_dates))
         
     def __repr__(self):
         """Representation.
@@ -209,14 +597,6 @@ class InterestFactor(object):
         """
         return "interestFactor(dim=%(dim)r, diy=%(diy)r, flavor=%(flavor)r)" % {'dim':self.dim, 'diy':self.diy, 'flavor':self.flavor}
     
-    _methods = {
-                 '30_360_None':     _daycount_30_360,
-                 '30_360_US':       _daycount_30_360_US,
-                 'act_act_Fixed':   _daycount_act_365_Fixed,
-                 'act_act_ISDA':    _daycount_act_act_ISDA,
-                 'act_act_Euro':    _daycount_act_act_Euro,
-                 }
-    
 
 if __name__ == '__main__':
     
@@ -225,4 +605,17 @@ if __name__ == '__main__':
     days360 = InterestFactor(30, 360)
     print(days360)
     print(days360.factor(date1, date2))
-    
+    print(days360.factor_array(np.array([date1, date2], dtype='datetime64[D]'),
+                               np.array([date2, date2], dtype='datetime64[D]')))
+    
+    
+    # Regular month-end coupon periods of act/act ICMA accrue exactly 1/frequency
+    semiannual = InterestFactor('act', 'act', 'ICMA', frequency=2)
+    quarterly = InterestFactor('act', 'act', 'ICMA', frequency=4)
+    assert semiannual.factor(date(2022, 9, 30), date(2023, 3, 31)) == 0.5
+    assert semiannual.factor(date(2023, 2, 28), date(2023, 8, 31)) == 0.5
+    assert semiannual.factor(date(2023, 8, 31), date(2024, 2, 29)) == 0.5
+    assert quarterly.factor(date(2022, 9, 30), date(2022, 12, 31)) == 0.25
+    assert list(semiannual.factor_array(np.array(['2022-09-30', '2023-02-28'], dtype='datetime64[D]'),
+                                        np.array(['2023-03-31', '2023-08-31'], dtype='datetime64[D]'))) == [0.5, 0.5]
+    print(semiannual.factor(date(2022, 9, 30), date(2023, 1, 15)))
@@ -4,7 +4,24 @@
 from __future__ import division
 import logging
 
-logger = logging.getLogger(__name__).addHandler(logger.NullHandler())
+import numpy as np
+
+from instrumentation import instrumented
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+class Error(Exception):
+    """Base class for exceptions in this module.
+    """
+    def __init__(self, expr):
+        Exception.__init__(self, expr)
+        self.expr = expr
+
+class InputError(Error):
+    """Exception raised for errors in parameters.
+    """
+    pass
 
 class InterestRate(object):
     """Base class for interest rates.
@@ -38,10 +55,12 @@ class InterestRate(object):
         
         Uses the formula:
         c_r = (1+i_r) * (1+spread) - 1
+        
+        The combined rate is an annual effective rate ('EMR1' with one period in a year).
         """
         #aer_rate = self.to_AER()
         combined_rate = (1+self.to_AER())*(1+spread)-1
-        return InterestRate(combined_rate, self.piy, self.term)
+        return InterestRate(combined_rate, 1, self.add_method, 'EMR1')
     
     def _add(self, spread):
         """Add the rate value with the spread and return an interestRate.
@@ -49,7 +68,7 @@ class InterestRate(object):
         :spread: spread to add to the rate.
         
         """
-        return InterestRate(self.i + spread, self.piy, self.term)
+        return InterestRate(self.i + spread, self.piy, self.add_method, self.term)
     
     def to_AER(self):
         """Convert to Annual Effective Interest Rate.
@@ -60,6 +79,102 @@ class InterestRate(object):
         return "interestRate(i=%(i)r, piy=%(piy)r, add_method=%(add_method)r, term=%(term)r)" % {'i':self.i, 'piy':self.piy, 'add_method':self.add_method, 'term':self.term}
     
 
+class InterestRateArray(object):
+    """Set of interest rates stored as arrays, one column per attribute of `InterestRate`.
+    
+    Rates, periods in a year and term codes are NumPy columns, so converting, adding or
+    combining spreads works on the whole set at once. Terms are stored as indexes into
+    `RATE_CASES`; all rates share one `add_method`.
+    
+    Usage::
+    >>> rates = InterestRateArray([0.032, 0.05], [12, 4], 'add', ['MNR1', 'MNR1'])
+    >>> rates.add_spread(0.02).to_AER()
+    """
+    def __init__(self, i, piy, add_method=None, term='EMR1'):
+        """Create a set of interest rates.
+        
+        :i: values of the interest rates stated as fractions (**not** percentages).
+        :piy: number of periods in a year for each rate (or one for all of them)
+        :term: term of the rates, a single string, a sequence of strings or an array of term codes
+        """
+        self.i = np.array(i, dtype='float64', ndmin=1)
+        self.piy = np.array(np.broadcast_to(np.asarray(piy, dtype='float64'), self.i.shape))
+        term = np.asarray(term)
+        if term.dtype.kind in 'iu':
+            term_codes = term
+        else:
+            try:
+                term_codes = np.array([RATE_CASES.index(t) for t in term.ravel()], dtype='int8').reshape(term.shape)
+            except ValueError:
+                raise InputError(expr = "Error in InterestRateArray(), terms must be in %r" % (RATE_CASES,))
+        self.term_codes = np.array(np.broadcast_to(term_codes, self.i.shape), dtype='int8')
+        self.add_method = add_method
+        if add_method is None:
+            self.add_spread = None
+        elif add_method == 'add':
+            self.add_spread = self._add
+        elif add_method == 'combine':
+            self.add_spread = self._combine
+        else:
+            raise InputError(expr = "Error in InterestRateArray(), add_method must be None, 'add' or 'combine'")
+    
+    @classmethod
+    def from_rates(cls, rates):
+        """Build the array from a list of `InterestRate` sharing the same add_method.
+        """
+        add_methods = set(rate.add_method for rate in rates)
+        if len(add_methods) > 1:
+            raise InputError(expr = "Error in InterestRateArray.from_rates(), all rates must have the same add_method")
+        return cls([rate.i for rate in rates],
+                   [rate.piy for rate in rates],
+                   add_methods.pop() if add_methods else None,
+                   [rate.term for rate in rates])
+    
+    def to_rates(self):
+        """Return the list of `InterestRate` in the array.
+        """
+        return [InterestRate(i, piy, self.add_method, RATE_CASES[code])
+                for i, piy, code in zip(self.i.tolist(), self.piy.tolist(), self.term_codes.tolist())]
+    
+    @property
+    def term(self):
+        """Array with the term of each rate."""
+        return np.array(RATE_CASES)[self.term_codes]
+    
+    def __len__(self):
+        return len(self.i)
+    
+    def _combine(self, spread):
+        """Combine every rate with the spread(s) and return an InterestRateArray of annual effective rates.
+        
+        :spread: spread to combine with the rates, a scalar or one per rate.
+        """
+        combined_rates = (1+self.to_AER())*(1+np.asarray(spread))-1
+        return InterestRateArray(combined_rates, 1, self.add_method, RATE_CASES.index('EMR1'))
+    
+    def _add(self, spread):
+        """Add the spread(s) to every rate and return an InterestRateArray.
+        
+        :spread: spread to add to the rates, a scalar or one per rate.
+        """
+        return InterestRateArray(self.i + spread, self.piy, self.add_method, self.term_codes)
+    
+    def to_AER(self):
+        """Convert every rate to Annual Effective Interest Rate, one conversion per distinct term.
+        """
+        codes = np.unique(self.term_codes)
+        if len(codes) == 1:
+            return rate_plan(RATE_CASES[codes[0]], 'EMR2')(self.i, self.piy, 1)
+        aer = np.empty_like(self.i)
+        for code in codes:
+            mask = self.term_codes == code
+            aer[mask] = rate_plan(RATE_CASES[code], 'EMR2')(self.i[mask], self.piy[mask], 1)
+        return aer
+    
+    def __repr__(self):
+        return "interestRateArray(n=%(n)r, add_method=%(add_method)r, terms=%(terms)r)" % {'n':len(self), 'add_method':self.add_method, 'terms':[RATE_CASES[c] for c in np.unique(self.term_codes)]}
+    
+
 def _change_eff(i_rate1, piy1, piy2):
     """Convert rate expressed in terms of one effectivity to a different one.
     
@@ -120,6 +235,7 @@ def _ant_2_mat(anticipated_rate):
     return anticipated_rate/(1-anticipated_rate)
 
 
+@instrumented
 def change_rate(i_rate, i_case, piy1, f_case='EMR2', piy2=1):
     """Convert rate to equivalent one.
     
@@ -156,67 +272,110 @@ def change_rate(i_rate, i_case, piy1, f_case='EMR2', piy2=1):
     MNR : 
         Matured Nominal Rate
     """
-    log = 'Changing %(i_rate)f[%(i_case)s], with %(piy1)f period in a year' % {"i_rate": i_rate, "i_case": i_case, "piy1": piy1}
-    logger.debug(log)
-    log = 'to a [%(f_case)s] with %(piy2)f periods in a year.' % {"f_case": f_case, "piy2": piy2}
-    logger.debug(log)
-    
-    case_list = ['ANR1', 'AER1', 'EMR1', 'MNR1',
-                 'ANR2', 'AER2', 'EMR2', 'MNR2']
-    
-    case = i_case
-    f_rate = i_rate
-    while case != f_case:
-        case1 = case
-        rate1 = f_rate
-        if case == 'MNR1':
-            #Matured Nominal --> Effective Matured
-            f_rate = _nom_2_eff(f_rate, piy1)
-            case = 'EMR1'
-        elif case == 'EMR1':
-            #Effective Matured --> Effective Matured
-            f_rate = _change_eff(f_rate, piy1, piy2)
-            case = 'EMR2'
-        elif case == 'EMR2':
-            #Branch
-            if f_case == 'AER2' or f_case == 'ANR2':
-                #Effective Matured --> Anticipated Effective
-                f_rate = _mat_2_ant(f_rate)
-                case = 'AER2'
-            elif f_case == 'MNR2':
-                #Effective Matured --> Matured Nominal
-                f_rate = _eff_2_nom(f_rate, piy2)
-                case = 'MNR2'
-            else:
-                #raise Error(expr= "")
-                pass
-        elif case == 'MNR2':
-            #Matured Nominal
-            pass
-        elif case == 'ANR1':
-            #Anticipated Nominal --> Anticipated Effective
-            f_rate = _nom_2_eff(f_rate,piy1)
-            case = 'AER1'
-        elif case == 'AER1':
-            #Anticipated Effective --> Effective Matured
-            f_rate = _ant_2_mat(f_rate)
-            case = 'EMR1'
-        elif case == 'AER2':
-            #Anticipated Effective --> Anticipated Nominal
-            f_rate = _eff_2_nom(f_rate, piy2)
-            case = 'ANR2'
-        elif case == 'ANR2':
-            #Anticipated Nominal
-            pass
-        else:
-            #raise InputError(expr = "")
-            pass
-        case2 = case
-        rate2 = f_rate
-        log = '%(r1)f[%(c1)s]->%(r2)f[%(c2)s]' % {"c1":case1, "r1": rate1, "c2":case2, "r2":rate2}
-        logger.debug(log)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('Changing %s[%s], with %s period in a year', i_rate, i_case, piy1)
+        logger.debug('to a [%s] with %s periods in a year.', f_case, piy2)
+    
+    return rate_plan(i_case, f_case)(i_rate, piy1, piy2)
+
 
-    return f_rate
+def _rate_step(case, f_case):
+    """Return the next step from `case` on the way to `f_case` in the equivalence chart.
+    
+    The step is a tuple (next case, function of (rate, piy1, piy2)), or None when `f_case`
+    can not be reached from `case`.
+    """
+    if case == 'MNR1':
+        #Matured Nominal --> Effective Matured
+        return ('EMR1', lambda rate, piy1, piy2: _nom_2_eff(rate, piy1))
+    elif case == 'EMR1':
+        #Effective Matured --> Effective Matured
+        return ('EMR2', _change_eff)
+    elif case == 'EMR2':
+        #Branch
+        if f_case == 'AER2' or f_case == 'ANR2':
+            #Effective Matured --> Anticipated Effective
+            return ('AER2', lambda rate, piy1, piy2: _mat_2_ant(rate))
+        elif f_case == 'MNR2':
+            #Effective Matured --> Matured Nominal
+            return ('MNR2', lambda rate, piy1, piy2: _eff_2_nom(rate, piy2))
+    elif case == 'ANR1':
+        #Anticipated Nominal --> Anticipated Effective
+        return ('AER1', lambda rate, piy1, piy2: _nom_2_eff(rate, piy1))
+    elif case == 'AER1':
+        #Anticipated Effective --> Effective Matured
+        return ('EMR1', lambda rate, piy1, piy2: _ant_2_mat(rate))
+    elif case == 'AER2':
+        #Anticipated Effective --> Anticipated Nominal
+        return ('ANR2', lambda rate, piy1, piy2: _eff_2_nom(rate, piy2))
+    return None
+
+RATE_CASES = ('ANR1', 'AER1', 'EMR1', 'MNR1',
+              'ANR2', 'AER2', 'EMR2', 'MNR2')
+
+_rate_plans = {}
+
+class RatePlan(object):
+    """Conversion between two cases of the rate equivalence chart, compiled once.
+    
+    The path through the chart is resolved when the plan is built, calling the plan only
+    applies the conversion formulas. Rates and periods in a year can be scalars or NumPy
+    arrays (broadcast together), so a whole curve converts in a single call.
+    
+    Usage::
+    >>> plan = rate_plan('MNR1', 'EMR2')
+    >>> plan(np.array([0.032, 0.05]), 12)
+    """
+    __slots__ = ('i_case', 'f_case', 'path', '_steps')
+    
+    def __init__(self, i_case, f_case):
+        """Constructor.
+        
+        :i_case: code for initial case
+        :f_case: code for the desired final case
+        """
+        self.i_case = i_case
+        self.f_case = f_case
+        self.path = [i_case]
+        self._steps = []
+        case = i_case
+        while case != f_case:
+            step = _rate_step(case, f_case)
+            if step is None:
+                raise InputError(expr = "Error in RatePlan(), a %r rate can not be changed to a %r rate" % (i_case, f_case))
+            case, function = step
+            self.path.append(case)
+            self._steps.append(function)
+    
+    def __call__(self, i_rate, piy1, piy2=1):
+        """Return the rate(s) equivalent to `i_rate`.
+        
+        :i_rate: initial rate(s) to be changed
+        :piy1: number of periods in a year for the initial rate(s)
+        :piy2: number of periods in a year for the desired rate(s)
+        """
+        if isinstance(i_rate, (list, tuple)):
+            i_rate = np.asarray(i_rate, dtype='float64')
+        if isinstance(piy1, (list, tuple)):
+            piy1 = np.asarray(piy1, dtype='float64')
+        if isinstance(piy2, (list, tuple)):
+            piy2 = np.asarray(piy2, dtype='float64')
+        f_rate = i_rate
+        for step in self._steps:
+            f_rate = step(f_rate, piy1, piy2)
+        return f_rate
+    
+    def __repr__(self):
+        return "ratePlan(%(path)s)" % {'path': ' -> '.join(self.path)}
+
+def rate_plan(i_case, f_case='EMR2'):
+    """Return the cached `RatePlan` converting `i_case` rates to `f_case` rates.
+    """
+    try:
+        return _rate_plans[(i_case, f_case)]
+    except KeyError:
+        plan = _rate_plans[(i_case, f_case)] = RatePlan(i_case, f_case)
+        return plan
     
     
 if __name__ == '__main__':
@@ -230,6 +389,11 @@ if __name__ == '__main__':
     print(IBR_combine.i)
     print(IBR)
     print(InterestRate(0.09,32))
+    print(rate_plan('MNR1', 'EMR2'))
+    print(rate_plan('MNR1', 'EMR2')(np.array([3.2/100, 5.2/100]), np.array([12, 360/28])))
+    IBR_array = InterestRateArray.from_rates([IBR1, IBR])
+    print(IBR_array)
+    print(IBR_array.add_spread(spread).to_AER())
     #print ((((3.2/100) + (2/100))/(360/28))+1)**(360/28)-1
     #change_rate(rate1, icase, piy1, fcase, piy2)
 
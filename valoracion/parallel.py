@@ -0,0 +1,149 @@
+"""
+Parallel IRR / own-margin solving over shared-memory portfolio arrays.
+
+The flat portfolio arrays are copied once into `multiprocessing.shared_memory` blocks.
+Every worker attaches to them when it starts and solves ranges of instruments from views of
+the shared buffers; tasks only carry the range bounds and only roots and status codes
+come back, so nothing proportional to the cashflows is pickled.
+
+Usage::
+>>> roots, status = solve_tir_parallel(flows, days, reference_rates, offsets=offsets, workers=8)
+"""
+from __future__ import division
+
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from instrumentation import instrumented
+from root_find import _portfolio_arrays, _solve_portfolio, NUMPY_TYPE, SOLVER_NO_BRACKET
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+_worker_arrays = None
+
+class SharedArrays(object):
+    """Named numpy arrays placed in shared memory, to be attached by other processes.
+
+    `spec` is a small picklable description of the blocks; `attach(spec)` returns views of
+    them in another process. The creating process releases the blocks with `close`
+    (or by using the object as a context manager).
+    """
+    def __init__(self, **arrays):
+        self._blocks = []
+        self.arrays = {}
+        self.spec = {}
+        try:
+            for name, values in arrays.items():
+                values = np.ascontiguousarray(values)
+                block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+                self._blocks.append(block)
+                shared = np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf)
+                shared[...] = values
+                self.arrays[name] = shared
+                self.spec[name] = (block.name, values.shape, values.dtype.str)
+        except Exception:
+            self.close()
+            raise
+
+    @staticmethod
+    def attach(spec):
+        """Return ``(arrays, blocks)`` for a `spec`, the blocks must be kept alive while the arrays are used.
+        """
+        arrays, blocks = {}, []
+        for name, (block_name, shape, dtype) in spec.items():
+            block = shared_memory.SharedMemory(name=block_name)
+            blocks.append(block)
+            arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        return arrays, blocks
+
+    def close(self):
+        """Release and remove the shared blocks.
+        """
+        self.arrays = {}
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _init_worker(spec):
+    global _worker_arrays
+    _worker_arrays = SharedArrays.attach(spec)
+
+def _solve_range(arrays, start, stop, options):
+    """Solve instruments ``start`` to ``stop`` (excluded) of the shared portfolio.
+    """
+    offsets = arrays['offsets']
+    first, last = offsets[start], offsets[stop]
+    owners = np.repeat(np.arange(stop - start), np.diff(offsets[start:stop + 1]))
+    roots, status, _ = _solve_portfolio(arrays['flows'][first:last], arrays['times'][first:last],
+                                        arrays['t_log_ref'][first:last], owners, stop - start,
+                                        lower=arrays['lower'][start:stop], upper=arrays['upper'][start:stop],
+                                        **options)
+    return roots, status
+
+def _worker_solve_range(bounds, options):
+    return _solve_range(_worker_arrays[0], bounds[0], bounds[1], options)
+
+
+@instrumented
+def solve_tir_parallel(cashflows,
+                       days_to_flows,
+                       reference_rates=None,
+                       day_count_base=365,
+                       offsets=None,
+                       lower=-0.999,
+                       upper=0.999,
+                       xtol=2e-12,
+                       maxiter=100,
+                       workers=None,
+                       chunk_size=None):
+    """
+    Solve the IRR (or own margin) of every instrument in a pool of processes sharing the portfolio arrays.
+
+    Same arguments (but `x0`) and result as `solve_tir_batch`, plus:
+    - `workers`: number of processes, default the number of CPUs
+    - `chunk_size`: instruments per task, default an even split in four tasks per worker
+    """
+    flows, times, t_log_ref, owners, n_instruments = _portfolio_arrays(cashflows, days_to_flows, reference_rates,
+                                                                      day_count_base, offsets)
+    roots = np.full(n_instruments, np.nan)
+    status = np.full(n_instruments, SOLVER_NO_BRACKET, dtype='int8')
+    if n_instruments == 0:
+        return roots, status
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = -(-n_instruments // (4 * workers))
+    bounds = [(start, min(start + chunk_size, n_instruments)) for start in range(0, n_instruments, chunk_size)]
+    options = {'xtol': xtol, 'maxiter': maxiter}
+    broadcast = lambda values: np.broadcast_to(np.asarray(values, dtype=NUMPY_TYPE), (n_instruments,))
+
+    with SharedArrays(flows=flows, times=times, t_log_ref=t_log_ref,
+                      offsets=np.concatenate([[0], np.cumsum(np.bincount(owners, minlength=n_instruments))]),
+                      lower=broadcast(lower), upper=broadcast(upper)) as shared:
+        del flows, times, t_log_ref, owners
+        logger.debug('solve_tir_parallel: %d instruments in %d tasks over %d workers', n_instruments, len(bounds), workers)
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(shared.spec,)) as pool:
+            results = pool.map(_worker_solve_range, bounds, [options] * len(bounds))
+            for (start, stop), (chunk_roots, chunk_status) in zip(bounds, results):
+                roots[start:stop] = chunk_roots
+                status[start:stop] = chunk_status
+    return roots, status
+
+
+if __name__ == '__main__':
+    cashflows = [[-100, 5, 5, 105], [-98.5, 3, 3, 3, 103], [-101, 4, 104]]
+    days_to_flows = [[0, 182, 365, 547], [0, 90, 180, 270, 360], [0, 180, 360]]
+    print(solve_tir_parallel(cashflows, days_to_flows, workers=2, chunk_size=1))
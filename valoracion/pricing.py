@@ -0,0 +1,118 @@
+"""
+Accrued interest and clean / dirty prices of an instrument over a series of settlement dates.
+"""
+from __future__ import division
+
+import logging
+from collections import namedtuple
+
+import numpy as np
+
+from date_helper import _to_ordinals, _ORDINAL_EPOCH
+from instrumentation import instrumented
+from interest_factor import InterestFactor
+from interest_rate import InputError
+
+NUMPY_TYPE = 'float64'
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+Schedule = namedtuple('Schedule', ['payment_dates', 'period_starts', 'coupons', 'principal'])
+PriceSeries = namedtuple('PriceSeries', ['period_index', 'accrued_fraction', 'accrued_interest',
+                                         'dirty_price', 'clean_price'])
+
+def instrument_schedule(cashflows, k):
+    """Return the `Schedule` of instrument `k` of a `Cashflows` tuple from `generate_cashflows`.
+
+    Price entries (zero accrual factor) are left out. To price over a history window the
+    cashflows must have been generated with a valuation date before the window.
+    """
+    start, end = cashflows.offsets[k], cashflows.offsets[k + 1]
+    periods = slice(start, end)
+    keep = cashflows.accrual_factors[periods] > 0
+    principal = cashflows.principal[periods][keep]
+    return Schedule(cashflows.payment_dates[periods][keep], cashflows.period_starts[periods][keep],
+                    cashflows.flows[periods][keep] - principal, principal)
+
+@instrumented
+def price_series(schedule,
+                 settlement_dates,
+                 yields=None,
+                 convention=(30, 360, None),
+                 day_count_base=365,
+                 calendar=None,
+                 frequency=None):
+    """
+    Return accrued interest and, given yields, dirty and clean prices for every settlement date.
+
+    The coupon period of each settlement is found with ``searchsorted`` over the payment dates
+    (a settlement on a payment date belongs to the next period). The accrued fraction is
+    ``factor(period_start, settlement)/factor(period_start, payment_date)`` with the
+    `InterestFactor` convention, and the accrued interest that fraction of the period coupon.
+    Dirty prices discount every later flow as ``flow/(1+yield)**(days/day_count_base)``, like
+    `parametrize_tir`; clean prices are dirty prices less accrued interest.
+
+    Keyword arguments:
+    - `schedule`: a `Schedule` (see `instrument_schedule`), payment dates ascending
+    - `settlement_dates`: datetime64 values, datetime.date objects or ordinals
+    - `yields`: annual effective yields, scalar or one per settlement date; without them
+      only the accrued interest is computed and prices are NaN
+    - `convention`: (dim, diy, flavor) of `InterestFactor`
+    - `day_count_base`: day count base of the discounting
+    - `calendar`: `BusinessCalendar` of business-day conventions (bus/252)
+    - `frequency`: coupons in a year for act/act ICMA, by default from the months of the last
+      period; 30E/360 ISDA takes the last payment date as maturity
+
+    Returns a `PriceSeries` of arrays with one value per settlement date. `period_index` is the
+    index of the current period in the schedule, or its number of periods once the instrument has matured
+    (accrued interest and prices are zero then).
+    """
+    payments = _to_ordinals(schedule.payment_dates)
+    starts = _to_ordinals(schedule.period_starts)
+    coupons = np.asarray(schedule.coupons, dtype=NUMPY_TYPE)
+    principal = np.broadcast_to(np.asarray(schedule.principal, dtype=NUMPY_TYPE), coupons.shape)
+    settlements = _to_ordinals(settlement_dates).ravel()
+    if not len(payments) or not (payments.shape == starts.shape == coupons.shape) or np.any(np.diff(payments) <= 0):
+        raise InputError(expr = "Error in price_series(), the schedule arrays must be non-empty, of the same length and with ascending payment dates")
+
+    n_periods = len(payments)
+    period = np.searchsorted(payments, settlements, side='right')
+    alive = period < n_periods
+    current = np.minimum(period, n_periods - 1)
+
+    if frequency is None:
+        months = np.diff((np.array([starts[-1], payments[-1]]) - _ORDINAL_EPOCH)
+                         .astype('datetime64[D]').astype('datetime64[M]').astype('int64'))[0]
+        frequency = 12 // months if months > 0 and 12 % months == 0 else 0
+    interest_factor = InterestFactor(*convention, calendar=calendar)
+    factor_array = lambda i, f: interest_factor.factor_array(i, f, frequency, payments[-1])
+    period_start = starts[current]
+    elapsed = np.where(alive, np.maximum(settlements - period_start, 0), 0) + period_start
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = factor_array(period_start, elapsed) / factor_array(period_start, payments[current])
+    fraction = np.where(alive & np.isfinite(fraction), fraction, 0.)
+    accrued = fraction * np.where(alive, coupons[current], 0.)
+
+    if yields is None:
+        dirty = np.full(len(settlements), np.nan)
+    else:
+        log_growth = np.log1p(np.broadcast_to(np.asarray(yields, dtype=NUMPY_TYPE), settlements.shape))
+        # (settlements x flows) matrix of discounted flows, zero for flows already paid
+        days = payments - settlements[:, np.newaxis]
+        discounted = (coupons + principal) * np.exp(-log_growth[:, np.newaxis] * (days / day_count_base))
+        dirty = np.where(days > 0, discounted, 0.).sum(axis=1)
+    return PriceSeries(period, fraction, accrued, dirty, dirty - accrued)
+
+
+if __name__ == '__main__':
+    from datetime import date
+
+    from cashflow_gen import generate_cashflows
+
+    cashflows = generate_cashflows([date(2020, 7, 24)], [date(2030, 7, 24)], 12, date(2020, 7, 24),
+                                   coupon_rates=[0.0725], convention=('act', 'act', 'ISDA'))
+    schedule = instrument_schedule(cashflows, 0)
+    settlements = np.arange('2024-07-20', '2024-07-30', dtype='datetime64[D]')
+    series = price_series(schedule, settlements, 0.08, ('act', 'act', 'ISDA'))
+    for row in zip(settlements, *series):
+        print(row)
@@ -0,0 +1,222 @@
+"""
+Persistent cache of solved IRRs / own margins, keyed by a hash of the solver inputs.
+
+Keys hash every instrument as it enters the discounting: cashflows, year fractions
+(``days_to_flows/day_count_base``) and ``times*log(1+reference_rate)``, plus its own bracket
+and the scalar solver options; initial guesses are left out since they do not change the
+converged root. Identical instruments therefore share an entry whatever layout they were given
+in, including reference rates from a `DiscountCurve`. Entries live in a SQLite file and
+the least recently used ones are evicted beyond `maxsize`.
+
+Usage::
+>>> cache = ResultCache('results.sqlite', maxsize=5000000)
+>>> roots, status = solve_tir_cached(cashflows, days_to_flows, reference_rates, cache=cache)
+>>> cache.cache_info()
+"""
+from __future__ import division
+
+import hashlib
+import logging
+import sqlite3
+from collections import namedtuple
+
+import numpy as np
+
+from instrumentation import instrumented
+from root_find import _portfolio_arrays, _solve_portfolio, _subset_flows, InputError, NUMPY_TYPE
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'evictions', 'maxsize', 'currsize'])
+
+_SQL_BATCH = 500
+
+# Solver options hashed into the salt shared by every key; `lower` and `upper` go into each
+# instrument's key and `x0` into none
+_SALT_OPTIONS = ('xtol', 'rtol', 'maxiter')
+_KEY_OPTIONS = ('lower', 'upper', 'x0')
+
+class ResultCache(object):
+    """Size-bounded LRU cache of ``(root, status)`` pairs stored in SQLite.
+    """
+    def __init__(self, path, maxsize=1000000):
+        """Constructor.
+
+        :path: SQLite file, created if needed (':memory:' for a cache that is not persisted)
+        :maxsize: maximum number of entries
+        """
+        self.path = path
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._connection = sqlite3.connect(path)
+        with self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS results '
+                                     '(key BLOB PRIMARY KEY, root REAL, status INTEGER, last_used INTEGER)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
+        self._clock, self._size = self._connection.execute('SELECT COALESCE(MAX(last_used), 0), COUNT(*) FROM results').fetchone()
+
+    def get_many(self, keys):
+        """Return a dict ``{key: (root, status)}`` with the keys found, marking them as recently used.
+        """
+        keys = list(keys)
+        found = {}
+        for start in range(0, len(keys), _SQL_BATCH):
+            batch = keys[start:start + _SQL_BATCH]
+            rows = self._connection.execute('SELECT key, root, status FROM results WHERE key IN (%s)'
+                                            % ','.join('?' * len(batch)), batch)
+            for key, root, status in rows:
+                found[bytes(key)] = (np.nan if root is None else root, status)
+        self._clock += 1
+        with self._connection:
+            self._connection.executemany('UPDATE results SET last_used = ? WHERE key = ?',
+                                         ((self._clock, key) for key in found))
+        hits = sum(key in found for key in keys)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return found
+
+    def put_many(self, items):
+        """Store ``(key, root, status)`` items, then evict the least recently used entries beyond `maxsize`.
+        """
+        self._clock += 1
+        rows = [(key, None if np.isnan(root) else float(root), int(status), self._clock) for key, root, status in items]
+        with self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)', rows)
+            self._size = self._connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+            excess = self._size - self.maxsize
+            if excess > 0:
+                self._connection.execute('DELETE FROM results WHERE key IN '
+                                         '(SELECT key FROM results ORDER BY last_used LIMIT ?)', (excess,))
+                self.evictions += excess
+                self._size -= excess
+                logger.debug('ResultCache evicted %d entries', excess)
+
+    def get(self, key):
+        """Return ``(root, status)`` for `key`, or None.
+        """
+        return self.get_many([key]).get(key)
+
+    def put(self, key, root, status):
+        """Store one result.
+        """
+        self.put_many([(key, root, status)])
+
+    def cache_info(self):
+        """Return the hits, misses, evictions, maxsize and current size of the cache.
+        """
+        return CacheInfo(self.hits, self.misses, self.evictions, self.maxsize, self._size)
+
+    def clear(self):
+        """Drop every entry and reset the statistics.
+        """
+        with self._connection:
+            self._connection.execute('DELETE FROM results')
+        self.hits = self.misses = self.evictions = self._size = 0
+
+    def close(self):
+        self._connection.close()
+
+    def __len__(self):
+        return self._size
+
+    def __repr__(self):
+        return "resultCache(path=%(path)r, maxsize=%(maxsize)r, currsize=%(size)r)" % {'path': self.path, 'maxsize': self.maxsize, 'size': self._size}
+
+
+def _solver_salt(options):
+    """Return the salt of the scalar solver options, rejecting unknown or array-valued ones.
+    """
+    unknown = set(options) - set(_SALT_OPTIONS) - set(_KEY_OPTIONS)
+    if unknown:
+        raise InputError(expr = "Error in _solver_salt(), unknown solver options %r" % (sorted(unknown),))
+    salt = []
+    for name in _SALT_OPTIONS:
+        if name in options:
+            if np.ndim(options[name]) != 0:
+                raise InputError(expr = "Error in _solver_salt(), %s must be a scalar" % name)
+            salt.append('%s=%r' % (name, float(options[name])))
+    return ';'.join(salt).encode('ascii')
+
+def instrument_keys(flows, times, t_log_ref, offsets, salt=b'', lower=-0.999, upper=0.999):
+    """Return the list of keys of every instrument of flat portfolio arrays.
+
+    :lower, upper: bracket of the roots, scalars or one per instrument, hashed into each key
+    """
+    flows = np.ascontiguousarray(flows, dtype=NUMPY_TYPE)
+    times = np.ascontiguousarray(times, dtype=NUMPY_TYPE)
+    t_log_ref = np.ascontiguousarray(t_log_ref, dtype=NUMPY_TYPE)
+    n_instruments = len(offsets) - 1
+    bounds = np.empty((n_instruments, 2))
+    try:
+        bounds[:, 0] = lower
+        bounds[:, 1] = upper
+    except ValueError:
+        raise InputError(expr = "Error in instrument_keys(), lower and upper must be scalars or have one value per instrument")
+    bounds.sort(axis=1)
+    keys = []
+    for k, (start, end) in enumerate(zip(offsets[:-1], offsets[1:])):
+        digest = hashlib.blake2b(salt, digest_size=16)
+        digest.update(bounds[k])
+        digest.update(flows[start:end])
+        digest.update(times[start:end])
+        digest.update(t_log_ref[start:end])
+        keys.append(digest.digest())
+    return keys
+
+@instrumented
+def solve_tir_cached(cashflows,
+                     days_to_flows,
+                     reference_rates=None,
+                     day_count_base=365,
+                     offsets=None,
+                     cache=None,
+                     **options):
+    """
+    Solve the IRR (or own margin) of every instrument like `solve_tir_batch`, serving repeated instruments from `cache`.
+
+    Only the instruments missing from the cache are solved (as one batch) and stored.
+
+    Keyword arguments are those of `solve_tir_batch` plus:
+    - `cache`: a `ResultCache`; without it every instrument is solved
+    - `options`: `lower`, `upper`, `x0`, `xtol` and `maxiter` of `solve_tir_batch`; the scalar
+      tolerances and each instrument's bracket are part of its key, the initial guesses are not
+    """
+    flows, times, t_log_ref, owners, n_instruments = _portfolio_arrays(cashflows, days_to_flows, reference_rates,
+                                                                      day_count_base, offsets)
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(owners, minlength=n_instruments))])
+    if cache is None:
+        return _solve_portfolio(flows, times, t_log_ref, owners, n_instruments, **options)[:2]
+
+    keys = instrument_keys(flows, times, t_log_ref, offsets, _solver_salt(options),
+                           options.get('lower', -0.999), options.get('upper', 0.999))
+    found = cache.get_many(keys)
+    roots = np.empty(n_instruments)
+    status = np.empty(n_instruments, dtype='int8')
+    missing = []
+    for k, key in enumerate(keys):
+        if key in found:
+            roots[k], status[k] = found[key]
+        else:
+            missing.append(k)
+    if missing:
+        keep = np.zeros(n_instruments, dtype=bool)
+        keep[missing] = True
+        subset = _subset_flows(flows, times, t_log_ref, owners, keep)
+        # Per-instrument bracket and guesses follow the instruments being solved
+        subset_options = dict((name, value if np.ndim(value) == 0 or name not in _KEY_OPTIONS else np.asarray(value)[missing])
+                              for name, value in options.items())
+        roots[missing], status[missing] = _solve_portfolio(*(subset + (len(missing),)), **subset_options)[:2]
+        cache.put_many((keys[k], roots[k], status[k]) for k in missing)
+    return roots, status
+
+
+if __name__ == '__main__':
+    cache = ResultCache(':memory:', maxsize=2)
+    cashflows = [[-100, 5, 5, 105], [-98.5, 3, 3, 3, 103], [-100, 5, 5, 105]]
+    days_to_flows = [[0, 182, 365, 547], [0, 90, 180, 270, 360], [0, 182, 365, 547]]
+    print(solve_tir_cached(cashflows, days_to_flows, [0.05, 0.04, 0.05], cache=cache))
+    print(solve_tir_cached(cashflows, days_to_flows, [0.05, 0.04, 0.05], cache=cache))
+    print(cache.cache_info())
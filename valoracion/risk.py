@@ -0,0 +1,88 @@
+"""
+Vectorized sensitivities of whole portfolios: present value, durations, convexity and DV01.
+"""
+from __future__ import division
+
+import logging
+from collections import namedtuple
+
+import numpy as np
+
+from instrumentation import instrumented
+from root_find import _portfolio_arrays, InputError, NUMPY_TYPE
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+Sensitivities = namedtuple('Sensitivities', ['npv', 'present_value', 'macaulay_duration',
+                                             'modified_duration', 'convexity', 'dv01'])
+
+@instrumented
+def portfolio_sensitivities(cashflows,
+                            days_to_flows,
+                            spreads=0.,
+                            reference_rates=None,
+                            day_count_base=365,
+                            offsets=None):
+    """
+    Return the sensitivities of every instrument of a portfolio to its discount spread.
+
+    Every cashflow is discounted as ``cashflow/((1+reference_rate)*(1+spread))**(days_to_flow/day_count_base)``,
+    as in `parametrize_tir_MP` (or `parametrize_tir` when `reference_rates` is None, the spread being the IRR).
+    The discount factors are computed once and every measure comes from the moments
+    ``sum(PV)``, ``sum(t*PV)`` and ``sum(t*(t+1)*PV)`` of the same pass, with closed-form
+    derivatives instead of bumping the spread and revaluing.
+
+    Keyword arguments:
+    - `cashflows`: money-value of future cashflows, ragged, padded or flat (see `solve_tir_batch`)
+    - `days_to_flows`: number of days till the cashflows are due, in the same layout as `cashflows`
+    - `spreads`: IRR or own margin of each instrument (e.g. the roots of `solve_tir_batch`), scalar or one per instrument
+    - `reference_rates`: reference rates as "efectiva anual", per cashflow or per instrument,
+      a `DiscountCurve`, or None for IRR
+    - `day_count_base`: day count base, scalar or one per instrument
+    - `offsets`: start of each instrument in flat `cashflows`
+
+    Returns a `Sensitivities` tuple of arrays with one value per instrument:
+    - `npv`: net present value of every cashflow
+    - `present_value`: present value of the cashflows after day 0, i.e. the price they imply
+    - `macaulay_duration`: PV-weighted mean time of those cashflows, in years
+    - `modified_duration`: ``-(dPV/ds)/PV``
+    - `convexity`: ``(d2PV/ds2)/PV``
+    - `dv01`: gain in value for a one basis point drop of the spread, ``-(dPV/ds)*1e-4``
+
+    Measures normalized by `present_value` are NaN when it is zero.
+    """
+    flows, times, t_log_ref, owners, n_instruments = _portfolio_arrays(cashflows, days_to_flows, reference_rates,
+                                                                      day_count_base, offsets)
+    spreads = np.asarray(spreads, dtype=NUMPY_TYPE)
+    if spreads.ndim == 0:
+        log_spread = times * np.log1p(spreads)
+    elif spreads.shape == (n_instruments,):
+        log_spread = times * np.log1p(spreads)[owners]
+    else:
+        raise InputError(expr = "Error in portfolio_sensitivities(), spreads must be a scalar or have one value per instrument")
+
+    pvs = flows * np.exp(-(log_spread + t_log_ref))
+    npv = np.bincount(owners, weights=pvs, minlength=n_instruments)
+    present_value = np.bincount(owners, weights=np.where(times > 0, pvs, 0.), minlength=n_instruments)
+    t_pvs = times * pvs
+    first_moment = np.bincount(owners, weights=t_pvs, minlength=n_instruments)
+    second_moment = np.bincount(owners, weights=t_pvs * (times + 1), minlength=n_instruments)
+
+    growth = 1 + spreads
+    with np.errstate(divide='ignore', invalid='ignore'):
+        macaulay_duration = first_moment / present_value
+        modified_duration = macaulay_duration / growth
+        convexity = second_moment / (growth**2 * present_value)
+    dv01 = 1e-4 * first_moment / growth
+    return Sensitivities(npv, present_value, macaulay_duration, modified_duration, convexity, dv01)
+
+
+if __name__ == '__main__':
+    from root_find import solve_tir_batch
+
+    cashflows = [[-100, 5, 5, 105], [-98.5, 3, 3, 3, 103]]
+    days_to_flows = [[0, 182, 365, 547], [0, 90, 180, 270, 360]]
+    roots, status = solve_tir_batch(cashflows, days_to_flows)
+    print(roots)
+    print(portfolio_sensitivities(cashflows, days_to_flows, roots))
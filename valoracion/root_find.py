@@ -6,88 +6,159 @@ import logging
 import numpy as np
 from scipy.optimize import brentq as find_root
 
+import instrumentation
+from discount_curve import DiscountCurve
+from instrumentation import instrumented
+
 NUMPY_TYPE = 'float64'
-logger = logging.getLogger(__name__).addHandler(logger.NullHandler())
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Convergence status codes returned by the batch solvers
+SOLVER_CONVERGED = 0
+SOLVER_MAXITER = 1
+SOLVER_NO_BRACKET = 2
 
 class Error(Exception):
     """Base class for exceptions in this module."""
-    pass
+    def __init__(self, expr):
+        Exception.__init__(self, expr)
+        self.expr = expr
 
 class InputError(Error):
     """Exception raised for errors in parameters."""
     pass
 
+class ConvergenceError(Error):
+    """Exception raised when a root finder does not converge."""
+    pass
+
+class NPVEvaluator(object):
+    """
+    Net present value of a set of time-determined cashflows as a function of a spread.
+    
+    Every cashflow is discounted as ``cashflow/((1+reference_rate)*(1+spread))**(days_to_flow/day_count_base)``.
+    The parts that do not depend on the spread (year fractions, ``times*log(1+reference_rate)``
+    and the weights of the derivatives) are computed once, and each evaluation works in place
+    on a preallocated buffer, so calling the evaluator inside a root finder does not allocate arrays.
+    Because of that buffer an evaluator must not be shared between threads.
+    
+    Usage::
+    >>> npv = NPVEvaluator([-100, 5, 105], [0, 180, 365], [0.05])
+    >>> find_root(npv, -0.999, 0.999)
+    >>> find_root_halley(npv.derivatives)
+    """
+    __slots__ = ('cashflows', 'times', '_t_log_ref', '_t_cashflows', '_t2_cashflows', '_buffer')
+    
+    def __init__(self, cashflows, days_to_flows, reference_rates=None, day_count_base=365):
+        """Constructor.
+        
+        :cashflows: money-value of future cashflows
+        :days_to_flows: number of days till the cashflows are due
+        :reference_rates: reference rates as "efectiva anual", one per cashflow or a single one,
+                          a `DiscountCurve`, or None for a plain discount rate
+        :day_count_base: day count base
+        """
+        self.cashflows = np.asarray(cashflows, dtype=NUMPY_TYPE)
+        self.times = np.asarray(days_to_flows, dtype=NUMPY_TYPE) / day_count_base
+        if reference_rates is None:
+            self._t_log_ref = None
+        elif isinstance(reference_rates, DiscountCurve):
+            self._t_log_ref = -reference_rates.log_discount(days_to_flows)
+        else:
+            self._t_log_ref = self.times * np.log1p(np.asarray(reference_rates, dtype=NUMPY_TYPE))
+        self._t_cashflows = self.times * self.cashflows
+        self._t2_cashflows = self._t_cashflows * (self.times + 1)
+        self._buffer = np.empty_like(self.times)
+    
+    def _discount(self, spread):
+        """Fill the buffer with the discount factor of every cashflow and return it.
+        """
+        buf = self._buffer
+        np.multiply(self.times, np.log1p(spread), out=buf)
+        if self._t_log_ref is not None:
+            np.add(buf, self._t_log_ref, out=buf)
+        np.negative(buf, out=buf)
+        return np.exp(buf, out=buf)
+    
+    def __call__(self, spread):
+        """Return the net present value for `spread`.
+        """
+        return np.dot(self.cashflows, self._discount(spread))
+    
+    def derivatives(self, spread):
+        """Return the tuple (npv, first derivative, second derivative) with respect to `spread`.
+        """
+        discount = self._discount(spread)
+        return (np.dot(self.cashflows, discount),
+                -np.dot(self._t_cashflows, discount) / (1 + spread),
+                np.dot(self._t2_cashflows, discount) / (1 + spread)**2)
+    
+    def __repr__(self):
+        return "NPVEvaluator(n_flows=%(n)r, reference_rates=%(ref)r)" % {'n': len(self.cashflows), 'ref': self._t_log_ref is not None}
+
+
+@instrumented
 def parametrize_tir_MP(cashflows,
                        days_to_flows,
                        reference_rates,
-                       day_count_base=365):
+                       day_count_base=365,
+                       derivatives=False):
     """
     Return the function for a net present value using discount rates combined from reference rates and a spread as the only variable for a set of time-determined cashflows.
     
-    Defines a function using a particular trick found at stackoverflow__
-    
-    __
-    .. _stackoverflow:
-    http://stackoverflow.com/questions/233673/lexical-closures-in-python/235764#235764
+    The function is a reusable `NPVEvaluator`, see its documentation.
 
     Keyword arguments:
     - `cashflows`: money-value of future cashflows (list)
     - `days_to_flows`: number of days till the cashflows are due (list)
       len(day_to_flows) == len(cashflows)
     - `reference_rates`: reference rate for cashflows as "efectiva anual" (list)
-      len(reference_rates) == len(cashflows) or len(reference_rates) == 1
+      len(reference_rates) == len(cashflows) or len(reference_rates) == 1,
+      or a `DiscountCurve` giving the reference discount factor of every cashflow
     - `day_count_base`: day count base
       default = 365 (as required by "Circular Externa 030 de 2009")
+    - `derivatives`: when True the returned function gives the tuple (npv, first derivative, second derivative)
+      with respect to the spread, as required by `find_root_halley`
       
     """
     
     # Check inputs
     if len(cashflows) != len(days_to_flows):
         raise InputError(expr = "Error in parametrize_tir_MP(), len(cashflows) must be equal to len(day_to_flows)")
-    elif len(cashflows) != len(reference_rates) and len(reference_rates) != 1:
-        raise InputError(expr = "Error in parametrize_tir_MP(), len(reference_rates) must equal to len(cashflows) or equal to 1")
-    
-    if len(reference_rates) == 1:
-        reference_rates = reference_rates * len(cashflows) # repetition of list reference_rates
     
-    # Log
-    logger.debug('Paremetrizando funcion de margen propio con:\n')
-    logger.debug('{0:>26} {1:>26} {2:>26}'.format('Flujo', 'Dias flujo', 'Tasa_referencia'))
-    
-    for flow, days, rate in zip(cashflows, days_to_flows, reference_rates):
-        logger.debug('{0:>26} {1:>26} {2:>26}'.format(flow, days, rate))
+    if isinstance(reference_rates, DiscountCurve):
+        evaluator = NPVEvaluator(cashflows, days_to_flows, reference_rates, day_count_base)
+        return evaluator.derivatives if derivatives else evaluator
     
-    # Convert inputs to numpy arrays
-    cashflows = np.array(cashflows, dtype=NUMPY_TYPE)
-    days_to_flows = np.array(days_to_flows, dtype=NUMPY_TYPE)
-    reference_rates = np.array(reference_rates, dtype=NUMPY_TYPE)
+    if len(cashflows) != len(reference_rates) and len(reference_rates) != 1:
+        raise InputError(expr = "Error in parametrize_tir_MP(), len(reference_rates) must equal to len(cashflows) or equal to 1")
     
-    # Define parametrized function
-    def func(spread):
-        """
-        Dynamically defined function
-        
-        Net present value using discount rates combined from reference rates and a MP for a set of time-determined cashflows in the future.
-        """        
-        pvs = cashflows/(((1+reference_rates)*(1+spread))**(days_to_flows/day_count_base))
+    # Log
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('Paremetrizando funcion de margen propio con:\n')
+        logger.debug('{0:>26} {1:>26} {2:>26}'.format('Flujo', 'Dias flujo', 'Tasa_referencia'))
         
-        # Return parametrized function
-        return np.sum(pvs) 
-            
-    return func
+        # A single reference rate applies to every cashflow (NPVEvaluator broadcasts it)
+        rates = list(reference_rates) * len(cashflows) if len(reference_rates) == 1 else reference_rates
+        for flow, days, rate in zip(cashflows, days_to_flows, rates):
+            logger.debug('{0:>26} {1:>26} {2:>26}'.format(flow, days, rate))
+    
+    evaluator = NPVEvaluator(cashflows, days_to_flows, reference_rates, day_count_base)
+    if derivatives:
+        return evaluator.derivatives
+    return evaluator
 
 
+@instrumented
 def parametrize_tir(cashflows,
                        days_to_flows,
-                       day_count_base=365):
+                       day_count_base=365,
+                       derivatives=False):
     """
     Return the function for a net present value with a discount rate as the only variable for a set of time-determined cashflows.
     
-    Defines a function using a particular trick found at stackoverflow__
-    
-    __
-    .. _stackoverflow:
-    http://stackoverflow.com/questions/233673/lexical-closures-in-python/235764#235764
+    The function is a reusable `NPVEvaluator`, see its documentation.
 
     Keyword arguments:
     - `cashflows`: money-value of future cashflows (list)
@@ -95,6 +166,8 @@ def parametrize_tir(cashflows,
       len(day_to_flows) == len(cashflows)
     - `day_count_base`: day count base
       default = 365 (as required by "Circular Externa 030 de 2009")
+    - `derivatives`: when True the returned function gives the tuple (npv, first derivative, second derivative)
+      with respect to the discount rate, as required by `find_root_halley`
       
     """
     
@@ -105,29 +178,360 @@ def parametrize_tir(cashflows,
         raise InputError(expr = error_string)
     
     # Log
-    logger.debug('Paremetrizando funcion de margen propio con:\n')
-    logger.debug('{0:>26} {1:>26}'.format('Flujo', 'Dias flujo'))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('Paremetrizando funcion de margen propio con:\n')
+        logger.debug('{0:>26} {1:>26}'.format('Flujo', 'Dias flujo'))
+        
+        for flow, days in zip(cashflows, days_to_flows):
+            logger.debug('{0:>26} {1:>26}'.format(flow, days))
     
-    for flow, days in zip(cashflows, days_to_flows):
-        logger.debug('{0:>26} {1:>26}'.format(flow, days))
+    evaluator = NPVEvaluator(cashflows, days_to_flows, None, day_count_base)
+    if derivatives:
+        return evaluator.derivatives
+    return evaluator
+
+
+@instrumented
+def find_root_halley(func,
+                     lower=-0.999,
+                     upper=0.999,
+                     x0=None,
+                     xtol=2e-12,
+                     rtol=8.881784197001252e-16,
+                     maxiter=50,
+                     full_output=False):
+    """
+    Find a root of `func` with Halley's method, falling back to bisection inside [lower, upper].
     
-    # Convert inputs to numpy arrays
-    cashflows = np.array(cashflows, dtype=NUMPY_TYPE)
-    days_to_flows = np.array(days_to_flows, dtype=NUMPY_TYPE)
+    Alternative to `find_root` for the functions returned by `parametrize_tir` and
+    `parametrize_tir_MP` with ``derivatives=True``: each iteration uses the value and both
+    derivatives from a single call, so convergence near the root is cubic (quadratic when
+    falling back to Newton) instead of superlinear.
     
-    # Define parametrized function
-    def func(spread):
-        """
-        Dynamically defined function
+    Keyword arguments:
+    - `func`: function of one variable returning the tuple (value, first derivative, second derivative)
+    - `lower`, `upper`: bracket for the root, `func` must change sign between them
+    - `x0`: initial guess, default is the secant point of the bracket
+    - `xtol`, `rtol`: absolute and relative tolerance on the root
+    - `maxiter`: maximum number of iterations
+    - `full_output`: when True return the tuple (root, iterations, function evaluations)
+    """
+    root, iterations, evaluations = _halley(func, lower, upper, x0, xtol, rtol, maxiter)
+    if instrumentation.is_enabled():
+        instrumentation.record('root_find.find_root_halley.iterations', iterations)
+        instrumentation.record('root_find.find_root_halley.evaluations', evaluations)
+    if full_output:
+        return root, iterations, evaluations
+    return root
+
+
+def _halley(func, lower, upper, x0, xtol, rtol, maxiter):
+    """Body of `find_root_halley`, returns the tuple (root, iterations, function evaluations).
+    """
+    f_lo = func(lower)[0]
+    f_hi = func(upper)[0]
+    evaluations = 2
+    
+    if f_lo == 0 or f_hi == 0:
+        return (lower if f_lo == 0 else upper), 0, evaluations
+    if np.sign(f_lo) == np.sign(f_hi):
+        raise InputError(expr = "Error in find_root_halley(), func(lower) and func(upper) must have different signs")
+    
+    lo, hi = lower, upper
+    if x0 is None or not lo < x0 < hi:
+        x0 = lo - f_lo*(hi - lo)/(f_hi - f_lo)
+        if not lo < x0 < hi:
+            x0 = (lo + hi)/2
+    x = x0
+    
+    for iteration in range(1, maxiter + 1):
+        fx, dfx, d2fx = func(x)
+        evaluations += 1
+        if fx == 0:
+            return x, iteration, evaluations
+        
+        # Shrink the bracket
+        if np.sign(fx) == np.sign(f_lo):
+            lo = x
+        else:
+            hi = x
+        
+        # Halley step, Newton when its denominator vanishes, bisection when leaving the bracket
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            denominator = 2*dfx*dfx - fx*d2fx
+            dx = 2*fx*dfx/denominator if denominator != 0 else fx/dfx
+        x_new = x - dx
+        if abs(dx) <= xtol + rtol*abs(x_new):
+            return x_new, iteration, evaluations
+        if not (np.isfinite(x_new) and lo < x_new < hi):
+            x_new = (lo + hi)/2
+            if abs(x_new - x) <= xtol + rtol*abs(x_new):
+                return x_new, iteration, evaluations
+        x = x_new
+    
+    raise ConvergenceError(expr = "Error in find_root_halley(), failed to converge after %d iterations" % maxiter)
+
+
+def _portfolio_arrays(cashflows,
+                      days_to_flows,
+                      reference_rates=None,
+                      day_count_base=365,
+                      offsets=None):
+    """
+    Return flat arrays describing every cashflow of a portfolio.
+    
+    Returns a tuple ``(flows, times, t_log_ref, owners, n_instruments)`` where `times` are the
+    year fractions ``days_to_flows/day_count_base``, `t_log_ref` is ``times*log(1+reference_rate)``
+    and `owners` is the index of the instrument each flow belongs to.
+    
+    The portfolio can be given as:
+    - ragged: a sequence with one list of cashflows (and of days) per instrument.
+      Reference rates are one list per instrument (of the same length or of length 1) or one scalar per instrument.
+    - padded: 2-D arrays with one row per instrument, padding positions hold zero cashflows.
+      Reference rates are a 2-D array of the same shape or a 1-D array with one rate per instrument.
+    - flat: 1-D arrays with every cashflow, plus `offsets` (n_instruments + 1) delimiting each instrument.
+      Reference rates are a flat array (one per cashflow) or one rate per instrument.
+    
+    In every layout reference rates can also be a single `DiscountCurve` shared by the whole portfolio.
+    
+    `day_count_base` is a scalar or an array with one base per instrument.
+    """
+    flows, days, owners, n_instruments, reference_rates = _flat_portfolio(cashflows, days_to_flows, offsets,
+                                                                          reference_rates)
+    times = _year_fractions(days, owners, n_instruments, day_count_base)
+    t_log_ref = _reference_log_terms(reference_rates, days, times, owners, n_instruments)
+    return flows, times, t_log_ref, owners, n_instruments
+
+
+def _flat_portfolio(cashflows, days_to_flows, offsets=None, reference_rates=None):
+    """
+    Return the flat arrays ``(flows, days, owners, n_instruments, reference_rates)`` of a portfolio
+    in any of the layouts of `_portfolio_arrays`, with the raw days to every flow.
+    
+    Per-flow reference rates of the ragged and padded layouts come back flat; other reference
+    rates are returned as given.
+    """
+    if offsets is not None:
+        offsets = np.asarray(offsets, dtype='int64')
+        flows = np.asarray(cashflows, dtype=NUMPY_TYPE)
+        days = np.asarray(days_to_flows, dtype=NUMPY_TYPE)
+        n_instruments = len(offsets) - 1
+        if flows.ndim != 1 or flows.shape != days.shape or offsets[0] != 0 or offsets[-1] != len(flows):
+            raise InputError(expr = "Error in _flat_portfolio(), flat cashflows and days_to_flows must be 1-D arrays of equal length delimited by offsets")
+        counts = np.diff(offsets)
+        owners = np.repeat(np.arange(n_instruments), counts)
+    elif isinstance(cashflows, np.ndarray) and cashflows.ndim == 2:
+        days = np.asarray(days_to_flows, dtype=NUMPY_TYPE)
+        if cashflows.shape != days.shape:
+            raise InputError(expr = "Error in _flat_portfolio(), padded cashflows and days_to_flows must have the same shape")
+        n_instruments, width = cashflows.shape
+        flows = np.asarray(cashflows, dtype=NUMPY_TYPE).ravel()
+        days = days.ravel()
+        owners = np.repeat(np.arange(n_instruments), width)
+        if reference_rates is not None and not isinstance(reference_rates, DiscountCurve) and np.ndim(reference_rates) == 2:
+            reference_rates = np.asarray(reference_rates, dtype=NUMPY_TYPE).ravel()
+    else:
+        if len(cashflows) != len(days_to_flows):
+            raise InputError(expr = "Error in _flat_portfolio(), len(cashflows) must be equal to len(days_to_flows)")
+        counts = np.array([len(flows) for flows in cashflows], dtype='int64')
+        if np.any(counts != [len(days) for days in days_to_flows]):
+            raise InputError(expr = "Error in _flat_portfolio(), each instrument must have as many cashflows as days_to_flows")
+        n_instruments = len(counts)
+        flows = np.concatenate([np.asarray(flows, dtype=NUMPY_TYPE) for flows in cashflows] + [np.empty(0)])
+        days = np.concatenate([np.asarray(days, dtype=NUMPY_TYPE) for days in days_to_flows] + [np.empty(0)])
+        owners = np.repeat(np.arange(n_instruments), counts)
+        if (reference_rates is not None and not isinstance(reference_rates, DiscountCurve)
+            and any(np.ndim(rates) for rates in reference_rates)):
+            reference_rates = _flatten_ragged_rates(reference_rates, counts)
+    
+    return flows, days, owners, n_instruments, reference_rates
+
+
+def _flatten_ragged_rates(reference_rates, counts):
+    """Return a flat array of reference rates from one list per instrument (of `counts` rates or of length 1).
+    """
+    if len(reference_rates) != len(counts):
+        raise InputError(expr = "Error in _flatten_ragged_rates(), there must be one set of reference_rates per instrument")
+    try:
+        return np.concatenate([np.broadcast_to(np.asarray(rates, dtype=NUMPY_TYPE), (count,))
+                               for rates, count in zip(reference_rates, counts)] + [np.empty(0)])
+    except ValueError:
+        raise InputError(expr = "Error in _flatten_ragged_rates(), len(reference_rates) must equal to len(cashflows) or equal to 1")
+
+
+def _year_fractions(days, owners, n_instruments, day_count_base):
+    """Return ``days/day_count_base`` for flat days, `day_count_base` being a scalar or one per instrument.
+    """
+    day_count_base = np.asarray(day_count_base, dtype=NUMPY_TYPE)
+    if day_count_base.ndim == 0:
+        return days / day_count_base
+    elif len(day_count_base) == n_instruments:
+        return days / day_count_base[owners]
+    raise InputError(expr = "Error in _year_fractions(), day_count_base must be a scalar or have one value per instrument")
+
+
+def _reference_log_terms(reference_rates, days, times, owners, n_instruments):
+    """Return ``times*log(1+reference_rate)`` for flat flows, the way reference rates enter the discount factor.
+    
+    `reference_rates` is None, a `DiscountCurve`, a flat array (one per cashflow) or one rate per instrument.
+    """
+    if reference_rates is None:
+        return np.zeros_like(times)
+    elif isinstance(reference_rates, DiscountCurve):
+        return -reference_rates.log_discount(days)
+    reference_rates = np.asarray(reference_rates, dtype=NUMPY_TYPE)
+    if reference_rates.shape == times.shape:
+        return times * np.log1p(reference_rates)
+    elif reference_rates.shape == (n_instruments,):
+        return times * np.log1p(reference_rates)[owners]
+    raise InputError(expr = "Error in _reference_log_terms(), reference_rates must have one value per cashflow or one per instrument")
+
+
+def _npv_and_derivative(flows, times, t_log_ref, owners, n_instruments, spreads):
+    """
+    Return the net present values of every instrument and their derivatives with respect to the spread.
+    
+    Every cashflow is discounted as ``flow/((1+reference_rate)*(1+spread))**time``.
+    """
+    pvs = flows * np.exp(-(times * np.log1p(spreads)[owners] + t_log_ref))
+    npvs = np.bincount(owners, weights=pvs, minlength=n_instruments)
+    d_npvs = -np.bincount(owners, weights=pvs * times, minlength=n_instruments) / (1 + spreads)
+    return npvs, d_npvs
+
+
+def _solve_portfolio(flows, times, t_log_ref, owners, n_instruments,
+                     lower=-0.999, upper=0.999, x0=None,
+                     xtol=2e-12, rtol=8.881784197001252e-16, maxiter=100):
+    """
+    Find the spread that makes the net present value of every instrument zero.
+    
+    Runs vectorized Newton iterations safeguarded by bisection (every step stays inside a bracket
+    with a sign change). Instruments are dropped from the working arrays as they converge.
+    
+    Returns a tuple ``(roots, status, iterations)`` of arrays with one value per instrument.
+    """
+    roots = np.full(n_instruments, np.nan)
+    status = np.full(n_instruments, SOLVER_NO_BRACKET, dtype='int8')
+    iterations = np.zeros(n_instruments, dtype='int64')
+    
+    lo = np.array(np.broadcast_to(np.asarray(lower, dtype=NUMPY_TYPE), (n_instruments,)))
+    hi = np.array(np.broadcast_to(np.asarray(upper, dtype=NUMPY_TYPE), (n_instruments,)))
+    lo, hi = np.minimum(lo, hi), np.maximum(lo, hi)
+    
+    with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+        f_lo = _npv_and_derivative(flows, times, t_log_ref, owners, n_instruments, lo)[0]
+        f_hi = _npv_and_derivative(flows, times, t_log_ref, owners, n_instruments, hi)[0]
+        
+        # Roots sitting on the bracket ends; instruments without cashflows (NPV identically 0) have none
+        has_flows = np.bincount(owners, weights=(flows != 0), minlength=n_instruments) > 0
+        at_lo = (f_lo == 0) & has_flows
+        at_hi = (f_hi == 0) & has_flows & ~at_lo
+        roots[at_lo] = lo[at_lo]
+        roots[at_hi] = hi[at_hi]
+        status[at_lo | at_hi] = SOLVER_CONVERGED
         
-        Net present value using discount rates combined from reference rates and a MP for a set of time-determined cashflows in the future.
-        """        
-        pvs = cashflows/((1+spread)**(days_to_flows/day_count_base))
+        active = (np.sign(f_lo) * np.sign(f_hi) < 0)
+        index = np.flatnonzero(active)
+        if len(index) == 0:
+            return roots, status, iterations
         
-        # Return parametrized function
-        return np.sum(pvs) 
+        # Initial guess: x0 when it lies inside the bracket, the secant point otherwise
+        lo, hi, f_lo, f_hi = lo[index], hi[index], f_lo[index], f_hi[index]
+        x = lo - f_lo * (hi - lo) / (f_hi - f_lo)
+        if x0 is not None:
+            x0 = np.broadcast_to(np.asarray(x0, dtype=NUMPY_TYPE), (n_instruments,))[index]
+            x = np.where((x0 > lo) & (x0 < hi), x0, x)
+        x = np.where(np.isfinite(x) & (x > lo) & (x < hi), x, 0.5 * (lo + hi))
+        sign_lo = np.sign(f_lo)
+        dx_old = hi - lo
+        
+        if len(index) < n_instruments:
+            flows, times, t_log_ref, owners = _subset_flows(flows, times, t_log_ref, owners, active)
+        
+        for iteration in range(maxiter):
+            fx, dfx = _npv_and_derivative(flows, times, t_log_ref, owners, len(index), x)
+            iterations[index] += 1
+            
+            # Shrink the bracket
+            same_sign = np.sign(fx) == sign_lo
+            lo = np.where(same_sign, x, lo)
+            hi = np.where(same_sign, hi, x)
             
-    return func
+            # Newton step, bisection when it leaves the bracket or is not reducing fast enough
+            step = fx / dfx
+            x_new = x - step
+            small_step = np.abs(step) <= xtol + rtol * np.abs(x_new)
+            bisect = ~small_step & (~np.isfinite(x_new) | (x_new <= lo) | (x_new >= hi) | (2 * np.abs(step) > np.abs(dx_old)))
+            x_new = np.where(bisect, 0.5 * (lo + hi), x_new)
+            dx = x_new - x
+            
+            done = (fx == 0) | small_step | (np.abs(dx) <= xtol + rtol * np.abs(x_new))
+            roots[index[done]] = np.where(fx == 0, x, x_new)[done]
+            status[index[done]] = SOLVER_CONVERGED
+            
+            keep = ~done
+            if not keep.any():
+                break
+            x, lo, hi, sign_lo, dx_old = x_new[keep], lo[keep], hi[keep], sign_lo[keep], dx[keep]
+            if not keep.all():
+                index = index[keep]
+                flows, times, t_log_ref, owners = _subset_flows(flows, times, t_log_ref, owners, keep)
+        else:
+            roots[index] = x
+            status[index] = SOLVER_MAXITER
+    
+    return roots, status, iterations
+
+
+def _subset_flows(flows, times, t_log_ref, owners, keep):
+    """Return the flat flow arrays restricted to the instruments where `keep` is True, renumbering owners.
+    """
+    flow_mask = keep[owners]
+    new_owner = np.cumsum(keep) - 1
+    return flows[flow_mask], times[flow_mask], t_log_ref[flow_mask], new_owner[owners[flow_mask]]
+
+
+@instrumented
+def solve_tir_batch(cashflows,
+                    days_to_flows,
+                    reference_rates=None,
+                    day_count_base=365,
+                    offsets=None,
+                    lower=-0.999,
+                    upper=0.999,
+                    x0=None,
+                    xtol=2e-12,
+                    maxiter=100):
+    """
+    Solve the IRR (or the own-margin spread over reference rates) of every instrument in a portfolio at once.
+    
+    Vectorized counterpart of calling `find_root` on each function returned by `parametrize_tir`
+    (when `reference_rates` is None) or by `parametrize_tir_MP`.
+    
+    Keyword arguments:
+    - `cashflows`: money-value of future cashflows, ragged (one list per instrument), padded (2-D array) or flat (with `offsets`)
+    - `days_to_flows`: number of days till the cashflows are due, in the same layout as `cashflows`
+    - `reference_rates`: reference rates as "efectiva anual", per cashflow or per instrument,
+      a `DiscountCurve` shared by every instrument, or None for IRR
+    - `day_count_base`: day count base, scalar or one per instrument
+      default = 365 (as required by "Circular Externa 030 de 2009")
+    - `offsets`: start of each instrument in flat `cashflows`, with a final entry equal to the number of flows
+    - `lower`, `upper`: bracket for the roots, scalars or one per instrument
+    - `x0`: optional initial guesses, used when they lie inside the bracket
+    - `xtol`: absolute tolerance on the roots
+    - `maxiter`: maximum number of iterations
+    
+    Returns a tuple ``(roots, status)`` of arrays with one value per instrument, where status is
+    SOLVER_CONVERGED, SOLVER_MAXITER (root holds the last iterate) or
+    SOLVER_NO_BRACKET (no sign change in the bracket, or no non-zero cashflow, root is NaN).
+    """
+    portfolio = _portfolio_arrays(cashflows, days_to_flows, reference_rates, day_count_base, offsets)
+    roots, status, iterations = _solve_portfolio(*portfolio, lower=lower, upper=upper, x0=x0,
+                                                 xtol=xtol, maxiter=maxiter)
+    if instrumentation.is_enabled():
+        values, counts = np.unique(iterations, return_counts=True)
+        instrumentation.record_counts('root_find.solve_tir_batch.iterations', values.tolist(), counts.tolist())
+    return roots, status
 
 
 if __name__ == '__main__':
@@ -145,5 +549,10 @@ if __name__ == '__main__':
     
     print(find_root(npv_MP,-0.999,0.999))
     print(find_root(npv_TIR,-0.999,0.999))
+    print(find_root_halley(parametrize_tir(flow_list, days_list, derivatives=True)))
+    
+    print(solve_tir_batch([flow_list, flow_list],
+                          [days_list, days_list],
+                          [reference_rate, [0]]))
     
     
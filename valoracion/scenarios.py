@@ -0,0 +1,206 @@
+"""
+Revaluation of a portfolio under many reference-rate scenarios.
+
+The (scenarios x cashflows) discount matrix is built in chunks of at most `max_elements`
+entries, so memory stays bounded whatever the number of scenarios, and chunks are spread
+over a process pool. Each worker receives the portfolio arrays once, when it starts.
+
+Usage::
+>>> npvs = scenario_npvs(flows, days, shocked_rates, spreads, offsets=offsets)
+>>> spreads, status = scenario_spreads(flows, days, shocked_rates, offsets=offsets)
+"""
+from __future__ import division
+
+import functools
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from discount_curve import DiscountCurve
+from instrumentation import instrumented
+from root_find import (_flat_portfolio, _year_fractions, _solve_portfolio, InputError, NUMPY_TYPE,
+                       SOLVER_NO_BRACKET)
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+MAX_ELEMENTS = 2**22
+
+_worker_portfolio = None
+
+class _Portfolio(object):
+    """Flat arrays of a portfolio shared by every chunk.
+    """
+    __slots__ = ('flows', 'days', 'times', 'owners', 'offsets', 'n_instruments')
+
+    def __init__(self, cashflows, days_to_flows, day_count_base, offsets):
+        flows, days, owners, n_instruments, _ = _flat_portfolio(cashflows, days_to_flows, offsets)
+        self.flows = flows
+        self.days = days
+        self.times = _year_fractions(days, owners, n_instruments, day_count_base)
+        self.owners = owners
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(owners, minlength=n_instruments))])
+        self.n_instruments = n_instruments
+
+    def log_terms(self, scenario_rates):
+        """Return the (scenarios x cashflows) matrix of ``times*log(1+reference_rate)``.
+        """
+        if isinstance(scenario_rates, list):
+            return -np.stack([curve.log_discount(self.days) for curve in scenario_rates])
+        if scenario_rates.shape[1] == len(self.flows):
+            return self.times * np.log1p(scenario_rates)
+        return self.times * np.log1p(scenario_rates)[:, self.owners]
+
+def _init_worker(portfolio):
+    global _worker_portfolio
+    _worker_portfolio = portfolio
+
+def _npv_chunk(portfolio, scenario_rates, spreads):
+    """Return the (scenarios x instruments) net present values of a chunk of scenarios.
+    """
+    exponent = portfolio.log_terms(scenario_rates)
+    exponent += portfolio.times * np.log1p(spreads)[portfolio.owners]
+    np.negative(exponent, out=exponent)
+    pvs = np.exp(exponent, out=exponent)
+    pvs *= portfolio.flows
+
+    npvs = np.zeros((len(pvs), portfolio.n_instruments))
+    starts = portfolio.offsets[:-1]
+    filled = portfolio.offsets[1:] > starts
+    if np.any(filled):
+        npvs[:, filled] = np.add.reduceat(pvs, starts[filled], axis=1)
+    return npvs
+
+def _spread_chunk(portfolio, scenario_rates, lower, upper, x0, xtol, maxiter):
+    """Return the (scenarios x instruments) roots and status of a chunk of scenarios.
+
+    Every (scenario, instrument) pair is solved as one instrument of a single batch.
+    """
+    t_log_ref = portfolio.log_terms(scenario_rates)
+    n_scenarios, n = len(t_log_ref), portfolio.n_instruments
+    owners = (portfolio.owners + n * np.arange(n_scenarios)[:, np.newaxis]).ravel()
+    tile = lambda values: np.tile(np.broadcast_to(values, (n,)), n_scenarios)
+    roots, status, iterations = _solve_portfolio(np.tile(portfolio.flows, n_scenarios),
+                                                 np.tile(portfolio.times, n_scenarios),
+                                                 t_log_ref.ravel(), owners, n_scenarios * n,
+                                                 lower=tile(lower), upper=tile(upper),
+                                                 x0=None if x0 is None else tile(x0),
+                                                 xtol=xtol, maxiter=maxiter)
+    return roots.reshape(n_scenarios, n), status.reshape(n_scenarios, n)
+
+def _worker_chunk(chunk_func, scenario_rates, *args):
+    return chunk_func(_worker_portfolio, scenario_rates, *args)
+
+
+def _scenario_rates(scenario_rates, portfolio):
+    """Validate scenarios: a list of `DiscountCurve` or a 2-D array with one row per scenario.
+    """
+    if len(scenario_rates) and isinstance(scenario_rates[0], DiscountCurve):
+        return list(scenario_rates)
+    scenario_rates = np.asarray(scenario_rates, dtype=NUMPY_TYPE)
+    if scenario_rates.ndim != 2 or scenario_rates.shape[1] not in (len(portfolio.flows), portfolio.n_instruments):
+        raise InputError(expr = "Error in _scenario_rates(), scenario_rates must have one row per scenario with one rate per cashflow or per instrument")
+    return scenario_rates
+
+def _run_chunks(chunk_func, portfolio, scenario_rates, args, max_elements, workers):
+    """Yield (start, stop, result) for every chunk of scenarios, in order.
+    """
+    n_scenarios = len(scenario_rates)
+    rows = max(1, max_elements // max(len(portfolio.flows), 1))
+    bounds = [(start, min(start + rows, n_scenarios)) for start in range(0, n_scenarios, rows)]
+    chunks = [scenario_rates[start:stop] for start, stop in bounds]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(chunks))
+    logger.debug('%d scenarios in %d chunks of %d rows, %d workers', n_scenarios, len(chunks), rows, workers)
+
+    if workers <= 1:
+        results = (chunk_func(portfolio, chunk, *args) for chunk in chunks)
+        for (start, stop), result in zip(bounds, results):
+            yield start, stop, result
+        return
+    task = functools.partial(_worker_chunk, chunk_func)
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(portfolio,)) as pool:
+        results = pool.map(task, chunks, *[[arg] * len(chunks) for arg in args])
+        for (start, stop), result in zip(bounds, results):
+            yield start, stop, result
+
+
+@instrumented
+def scenario_npvs(cashflows,
+                  days_to_flows,
+                  scenario_rates,
+                  spreads=0.,
+                  day_count_base=365,
+                  offsets=None,
+                  max_elements=MAX_ELEMENTS,
+                  workers=None):
+    """
+    Return the net present value of every instrument under every scenario of reference rates.
+
+    Cashflows are discounted as in `parametrize_tir_MP`, with the own margin `spreads` fixed.
+
+    Keyword arguments:
+    - `cashflows`: money-value of future cashflows, ragged, padded or flat (see `solve_tir_batch`)
+    - `days_to_flows`: number of days till the cashflows are due, in the same layout as `cashflows`
+    - `scenario_rates`: reference rates as "efectiva anual", a 2-D array with one row per scenario
+      and one column per flat cashflow or per instrument, or a list of `DiscountCurve`
+    - `spreads`: own margin of each instrument, scalar or one per instrument
+    - `day_count_base`: day count base, scalar or one per instrument
+    - `offsets`: start of each instrument in flat `cashflows`
+    - `max_elements`: maximum size of the discount matrix of a chunk of scenarios
+    - `workers`: number of processes, default the number of CPUs; 1 runs in the calling process
+
+    Returns a (scenarios x instruments) array.
+    """
+    portfolio = _Portfolio(cashflows, days_to_flows, day_count_base, offsets)
+    scenario_rates = _scenario_rates(scenario_rates, portfolio)
+    spreads = np.array(np.broadcast_to(np.asarray(spreads, dtype=NUMPY_TYPE), (portfolio.n_instruments,)))
+    npvs = np.empty((len(scenario_rates), portfolio.n_instruments))
+    for start, stop, result in _run_chunks(_npv_chunk, portfolio, scenario_rates, (spreads,), max_elements, workers):
+        npvs[start:stop] = result
+    return npvs
+
+@instrumented
+def scenario_spreads(cashflows,
+                     days_to_flows,
+                     scenario_rates,
+                     day_count_base=365,
+                     offsets=None,
+                     lower=-0.999,
+                     upper=0.999,
+                     x0=None,
+                     xtol=2e-12,
+                     maxiter=100,
+                     max_elements=MAX_ELEMENTS,
+                     workers=None):
+    """
+    Solve the own margin of every instrument under every scenario of reference rates.
+
+    Keyword arguments are those of `scenario_npvs` plus the solver options of `solve_tir_batch`
+    (`lower`, `upper` and `x0` scalars or one per instrument).
+
+    Returns a tuple ``(spreads, status)`` of (scenarios x instruments) arrays, status as in `solve_tir_batch`.
+    """
+    portfolio = _Portfolio(cashflows, days_to_flows, day_count_base, offsets)
+    scenario_rates = _scenario_rates(scenario_rates, portfolio)
+    shape = (len(scenario_rates), portfolio.n_instruments)
+    spreads = np.empty(shape)
+    status = np.full(shape, SOLVER_NO_BRACKET, dtype='int8')
+    args = (lower, upper, x0, xtol, maxiter)
+    for start, stop, (roots, chunk_status) in _run_chunks(_spread_chunk, portfolio, scenario_rates, args,
+                                                          max_elements, workers):
+        spreads[start:stop] = roots
+        status[start:stop] = chunk_status
+    return spreads, status
+
+
+if __name__ == '__main__':
+    cashflows = [[-100, 5, 5, 105], [-98.5, 3, 3, 3, 103]]
+    days_to_flows = [[0, 182, 365, 547], [0, 90, 180, 270, 360]]
+    shocks = np.linspace(-0.01, 0.01, 5)[:, np.newaxis]
+    rates = 0.05 + shocks + np.zeros((1, 2))
+    print(scenario_npvs(cashflows, days_to_flows, rates, workers=1))
+    print(scenario_spreads(cashflows, days_to_flows, rates, workers=2, max_elements=9))
@@ -0,0 +1,221 @@
+"""
+Micro-batching valuation server speaking JSON lines over TCP or a Unix socket.
+
+Every request line is one instrument, in the JSON-lines format of `batch`::
+
+    {"id": 7, "cashflows": [-98.5, 6, 106], "days_to_flows": [0, 180, 365], "reference_rates": 0.05}
+
+Requests arriving within `window` seconds of the first pending one (or until `max_batch`
+are pending) are solved together with `solve_tir_batch`, off the event loop, and every
+caller receives its own line ``{"id": ..., "spread": ..., "status": ...}`` (or
+``{"id": ..., "error": ...}`` for an invalid request). Requests on one connection may be
+pipelined, answers then come back as their batches finish.
+
+Usage::
+    python valoracion/server.py --port 8765 --window-ms 2
+    python valoracion/server.py --unix /tmp/valoracion.sock
+"""
+from __future__ import division
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+
+from batch import check_instrument, value_chunk
+from root_find import InputError
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+class MicroBatcher(object):
+    """Collect instruments from concurrent callers and solve them in batches.
+    """
+    def __init__(self, window=0.002, max_batch=4096, xtol=2e-12, maxiter=100):
+        """Constructor.
+
+        :window: seconds to wait for more requests after the first one of a batch
+        :max_batch: size at which a batch is solved without waiting for the window to close
+        :xtol, maxiter: solver options
+        """
+        self.window = window
+        self.max_batch = max_batch
+        self.xtol = xtol
+        self.maxiter = maxiter
+        self.batches = 0
+        self.solved = 0
+        self._queue = None
+        self._task = None
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def value(self, instrument):
+        """Return the result row ``(id, spread, status)`` of `instrument` once its batch is solved.
+
+        :instrument: tuple ``(id, cashflows, days_to_flows, reference_rates, day_count_base)``
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((instrument, future))
+        return await future
+
+    async def _collect(self):
+        """Wait for a first request, then gather more until the window closes or the batch is full.
+        """
+        pending = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.window
+        while len(pending) < self.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                pending.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        while len(pending) < self.max_batch and not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        return pending
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = await self._collect()
+            instruments = [instrument for instrument, _ in pending]
+            try:
+                rows = await loop.run_in_executor(None, value_chunk, instruments, self.xtol, self.maxiter)
+            except Exception:
+                # Solve one at a time, so that every caller only gets its own error
+                logger.exception('batch of %d instruments failed, solving them one by one', len(pending))
+                rows = [await loop.run_in_executor(None, _value_one, instrument, self.xtol, self.maxiter)
+                        for instrument in instruments]
+            self.batches += 1
+            self.solved += len(rows)
+            for (_, future), row in zip(pending, rows):
+                if future.done():
+                    continue
+                if isinstance(row, Exception):
+                    future.set_exception(row)
+                else:
+                    future.set_result(row)
+
+
+def _value_one(instrument, xtol, maxiter):
+    """Return the result row of one instrument, or the exception raised solving it.
+    """
+    try:
+        return value_chunk([instrument], xtol, maxiter)[0]
+    except Exception as error:
+        return error
+
+
+def parse_request(record):
+    """Return the instrument tuple of a decoded request, with float arrays as `check_instrument`
+    gives them, raising ValueError when it is invalid.
+    """
+    if not isinstance(record, dict):
+        raise ValueError('a request must be a JSON object')
+    try:
+        return check_instrument((record.get('id'), record.get('cashflows'), record.get('days_to_flows'),
+                                 record.get('reference_rates'), record.get('day_count_base', 365)))
+    except InputError as error:
+        raise ValueError(error.expr)
+
+async def _value_request(batcher, record):
+    """Return the response to a decoded request, carrying its id even when it is invalid.
+    """
+    identifier = record.get('id') if isinstance(record, dict) else None
+    try:
+        instrument = parse_request(record)
+    except (ValueError, KeyError, TypeError) as error:
+        return {'id': identifier, 'error': '%s: %s' % (type(error).__name__, error)}
+    try:
+        identifier, spread, status = await batcher.value(instrument)
+        return {'id': identifier, 'spread': spread, 'status': status}
+    except Exception as error:
+        return {'id': identifier, 'error': '%s: %s' % (type(error).__name__, error)}
+
+async def _answer(batcher, line, writer):
+    try:
+        record = json.loads(line)
+    except ValueError as error:
+        # Only a line that is not JSON at all has no id to answer with
+        response = {'id': None, 'error': '%s: %s' % (type(error).__name__, error)}
+    else:
+        response = await _value_request(batcher, record)
+    writer.write((json.dumps(response) + '\n').encode('utf-8'))
+    try:
+        # Wait while the client is slow to read, so answers do not pile up in the transport
+        await writer.drain()
+    except ConnectionError:
+        pass
+
+async def handle_connection(batcher, reader, writer):
+    """Answer every request line of a connection, without waiting for earlier answers.
+    """
+    answers = set()
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if line.strip():
+                answer = asyncio.ensure_future(_answer(batcher, line, writer))
+                answers.add(answer)
+                answer.add_done_callback(answers.discard)
+        if answers:
+            await asyncio.wait(answers)
+        await writer.drain()
+    finally:
+        writer.close()
+
+async def serve(host='127.0.0.1', port=8765, unix=None, **options):
+    """Run the server until cancelled.
+
+    :options: `window`, `max_batch`, `xtol` and `maxiter` of `MicroBatcher`
+    """
+    batcher = MicroBatcher(**options)
+    batcher.start()
+    handler = lambda reader, writer: handle_connection(batcher, reader, writer)
+    if unix:
+        server = await asyncio.start_unix_server(handler, path=unix)
+    else:
+        server = await asyncio.start_server(handler, host, port)
+    logger.info('serving on %s', unix or '%s:%d' % (host, port))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await batcher.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Micro-batching IRR / own margin server (JSON lines).')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help='listen on this Unix socket path instead of TCP')
+    parser.add_argument('--window-ms', type=float, default=2., help='batching window in milliseconds')
+    parser.add_argument('--max-batch', type=int, default=4096, help='largest batch solved at once')
+    parser.add_argument('--xtol', type=float, default=2e-12)
+    parser.add_argument('--maxiter', type=int, default=100)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix, window=args.window_ms / 1000, max_batch=args.max_batch,
+                          xtol=args.xtol, maxiter=args.maxiter))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""
+"""
+from __future__ import division
+
+import logging
+
+import numpy as np
+
+from discount_curve import DiscountCurve
+from root_find import (_flat_portfolio, _flatten_ragged_rates, _year_fractions, _reference_log_terms,
+                       _solve_portfolio, _subset_flows, InputError, NUMPY_TYPE,
+                       SOLVER_CONVERGED, SOLVER_NO_BRACKET)
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+class ValuationSession(object):
+    """Portfolio kept in memory between revaluations, solving IRRs / own margins incrementally.
+
+    Year fractions and flat cashflow arrays are built once. `update_rates` and
+    `update_instrument` only recompute what they change and mark the affected instruments,
+    and `solve` only solves those, warm-started from their previous root inside a tight
+    bracket whose width follows the size of the last move (widened when it holds no root).
+
+    Usage::
+    >>> session = ValuationSession(cashflows, days_to_flows, reference_rates)
+    >>> roots, status = session.solve()          # cold run
+    >>> session.update_rates(new_reference_rates)
+    >>> roots, status = session.solve()          # warm-started run
+    """
+    def __init__(self, cashflows, days_to_flows, reference_rates=None, day_count_base=365, offsets=None,
+                 lower=-0.999, upper=0.999, min_width=1e-3, xtol=2e-12, maxiter=100):
+        """Constructor.
+
+        :cashflows: money-value of future cashflows, ragged, padded or flat (see `solve_tir_batch`)
+        :days_to_flows: number of days till the cashflows are due, in the same layout
+        :reference_rates: reference rates as "efectiva anual", per cashflow or per instrument,
+                          a `DiscountCurve`, or None for IRR
+        :day_count_base: day count base, scalar or one per instrument
+        :offsets: start of each instrument in flat `cashflows`
+        :lower, upper: widest bracket for the roots
+        :min_width: smallest half-width of the warm-start bracket around the previous root
+        :xtol, maxiter: solver tolerance and maximum number of iterations
+        """
+        flows, days, owners, n_instruments, _ = _flat_portfolio(cashflows, days_to_flows, offsets)
+        self.flows = flows
+        self.days = days
+        self.owners = owners
+        self.n_instruments = n_instruments
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(owners, minlength=n_instruments))])
+        self.day_count_base = day_count_base
+        self.times = _year_fractions(days, owners, n_instruments, day_count_base)
+        self.t_log_ref = np.zeros_like(self.times)
+        self._curve = None
+        self._has_reference = reference_rates is not None
+
+        self.lower = lower
+        self.upper = upper
+        self.min_width = min_width
+        self.xtol = xtol
+        self.maxiter = maxiter
+
+        self.roots = np.full(n_instruments, np.nan)
+        self.status = np.full(n_instruments, SOLVER_NO_BRACKET, dtype='int8')
+        self._moves = np.zeros(n_instruments)
+        self._dirty = np.ones(n_instruments, dtype=bool)
+        if reference_rates is not None:
+            self.update_rates(reference_rates)
+            self._dirty[:] = True
+
+    def _flat_rates(self, reference_rates):
+        """Return reference rates in a layout accepted by `_reference_log_terms`.
+        """
+        if reference_rates is None or isinstance(reference_rates, DiscountCurve):
+            return reference_rates
+        if isinstance(reference_rates, np.ndarray):
+            return reference_rates.ravel() if reference_rates.ndim == 2 else reference_rates
+        if any(np.ndim(rates) for rates in reference_rates):
+            return _flatten_ragged_rates(reference_rates, np.diff(self.offsets))
+        return np.asarray(reference_rates, dtype=NUMPY_TYPE)
+
+    def update_rates(self, reference_rates):
+        """Set new reference rates, only instruments whose discounting changed are solved again.
+
+        :reference_rates: same layouts as in the constructor
+
+        Returns the number of instruments marked for solving.
+        """
+        t_log_ref = _reference_log_terms(self._flat_rates(reference_rates), self.days, self.times,
+                                         self.owners, self.n_instruments)
+        changed = np.bincount(self.owners, weights=(t_log_ref != self.t_log_ref), minlength=self.n_instruments) > 0
+        self.t_log_ref = t_log_ref
+        self._curve = reference_rates if isinstance(reference_rates, DiscountCurve) else None
+        self._has_reference = reference_rates is not None
+        self._dirty |= changed
+        return int(changed.sum())
+
+    def update_instrument(self, k, cashflows, days_to_flows, reference_rates=None):
+        """Replace the cashflows of instrument `k`, its previous root is kept as starting point.
+
+        :k: index of the instrument
+        :cashflows: new money-value of its cashflows
+        :days_to_flows: new number of days till they are due
+        :reference_rates: its reference rates (one per cashflow or a single one); may be omitted
+                          when the session uses a `DiscountCurve` or no reference rates
+        """
+        flows = np.asarray(cashflows, dtype=NUMPY_TYPE)
+        days = np.asarray(days_to_flows, dtype=NUMPY_TYPE)
+        if flows.shape != days.shape or flows.ndim != 1:
+            raise InputError(expr = "Error in ValuationSession.update_instrument(), len(cashflows) must be equal to len(days_to_flows)")
+        base = np.asarray(self.day_count_base)
+        times = days / (base if base.ndim == 0 else base[k])
+        if reference_rates is not None:
+            t_log_ref = times * np.log1p(np.broadcast_to(np.asarray(reference_rates, dtype=NUMPY_TYPE), times.shape))
+        elif self._curve is not None:
+            t_log_ref = -self._curve.log_discount(days)
+        elif not self._has_reference:
+            t_log_ref = np.zeros_like(times)
+        else:
+            raise InputError(expr = "Error in ValuationSession.update_instrument(), reference_rates are required for this session")
+
+        start, end = self.offsets[k], self.offsets[k + 1]
+        splice = lambda column, new: np.concatenate([column[:start], new, column[end:]])
+        self.flows = splice(self.flows, flows)
+        self.days = splice(self.days, days)
+        self.times = splice(self.times, times)
+        self.t_log_ref = splice(self.t_log_ref, t_log_ref)
+        self.offsets[k + 1:] += len(flows) - (end - start)
+        self.owners = np.repeat(np.arange(self.n_instruments), np.diff(self.offsets))
+        self._dirty[k] = True
+
+    def _solve_subset(self, index, lower, upper, x0):
+        """Solve the instruments in the sorted array `index` inside per-instrument brackets.
+        """
+        if len(index) == self.n_instruments:
+            arrays = (self.flows, self.times, self.t_log_ref, self.owners)
+        else:
+            keep = np.zeros(self.n_instruments, dtype=bool)
+            keep[index] = True
+            arrays = _subset_flows(self.flows, self.times, self.t_log_ref, self.owners, keep)
+        return _solve_portfolio(*(arrays + (len(index),)), lower=lower, upper=upper, x0=x0,
+                                xtol=self.xtol, maxiter=self.maxiter)
+
+    def solve(self):
+        """Solve every instrument whose inputs changed since the last call.
+
+        Instruments with a previous root start from it, inside a bracket of half-width
+        ``max(min_width, 2*|last move|)`` that is widened 8 times whenever it holds no root,
+        up to [lower, upper]. The others are solved over [lower, upper].
+
+        Returns a tuple ``(roots, status)`` for every instrument, as `solve_tir_batch`.
+        """
+        index = np.flatnonzero(self._dirty)
+        if len(index) == 0:
+            return self.roots.copy(), self.status.copy()
+
+        previous = self.roots[index]
+        warm = (self.status[index] == SOLVER_CONVERGED) & np.isfinite(previous)
+        width = np.maximum(self.min_width, 2 * np.abs(self._moves[index]))
+        roots = np.full(len(index), np.nan)
+        status = np.full(len(index), SOLVER_NO_BRACKET, dtype='int8')
+
+        pending = np.arange(len(index))
+        while len(pending):
+            lower = np.where(warm[pending], np.maximum(previous[pending] - width[pending], self.lower), self.lower)
+            upper = np.where(warm[pending], np.minimum(previous[pending] + width[pending], self.upper), self.upper)
+            roots[pending], status[pending], iterations = self._solve_subset(index[pending], lower, upper,
+                                                                             previous[pending])
+            # Widen the brackets that held no root while they can still grow
+            retry = (status[pending] == SOLVER_NO_BRACKET) & ((lower > self.lower) | (upper < self.upper))
+            pending = pending[retry]
+            width[pending] *= 8
+
+        moved = warm & (status == SOLVER_CONVERGED)
+        self._moves[index] = np.where(moved, roots - previous, 0.)
+        self.roots[index] = roots
+        self.status[index] = status
+        self._dirty[index] = False
+        logger.debug('ValuationSession solved %d instruments (%d warm-started)', len(index), int(warm.sum()))
+        return self.roots.copy(), self.status.copy()
+
+    def __repr__(self):
+        return "valuationSession(n_instruments=%(n)r, pending=%(pending)r)" % {'n': self.n_instruments, 'pending': int(self._dirty.sum())}